@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Poll, Choice
+from .models import Poll, Choice, ClientVote, Job
 
 
 class ChoiceInline(admin.TabularInline):
@@ -39,4 +39,19 @@ class ChoiceAdmin(admin.ModelAdmin):
     vote_count_display.short_description = 'Votes'
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'args', 'status', 'attempts', 'run_at', 'duration', 'created_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'duration', 'last_error')
+
+
+@admin.register(ClientVote)
+class ClientVoteAdmin(admin.ModelAdmin):
+    list_display = ['client_vote_id', 'user', 'poll', 'choice', 'voted_at', 'status', 'uploaded_by', 'received_at']
+    list_filter = ['status']
+    search_fields = ['client_vote_id']
+    raw_id_fields = ['user', 'poll', 'choice', 'uploaded_by']
+
+
 # Vote admin is provided by django-vote package
\ No newline at end of file
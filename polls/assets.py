@@ -0,0 +1,165 @@
+"""
+Self-hosted, fingerprinted and precompressed static assets.
+
+``manage.py vendor_assets`` copies Bootstrap, the Bootswatch theme named by
+``BOOTSWATCH_THEME`` and Bootstrap Icons from the CDN (or a local mirror)
+into ``static/vendor/``. Templates link them with ``{% vendor_static %}``,
+which falls back to the CDN until they have been vendored.
+
+``CompressedManifestStaticFilesStorage`` makes ``collectstatic`` write
+content-hashed copies plus ``.gz`` and (with the ``brotli`` package) ``.br``
+siblings, and ``serve`` hands out the smallest one the client accepts with
+far-future immutable caching headers.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.request
+from functools import cache
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.templatetags.static import static
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+CDN = 'https://cdn.jsdelivr.net/npm/'
+BOOTSTRAP = 'bootstrap@5.3.3/dist/'
+BOOTSWATCH = 'bootswatch@5.3.3/dist/'
+ICONS = 'bootstrap-icons@1.11.3/font/'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.ttf', '.eot'}
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE = 'public, max-age=31536000, immutable'
+SOURCE_MAP = re.compile(r'^\s*(/\*# sourceMappingURL=.*\*/|//# sourceMappingURL=.*)$', re.M)
+
+
+def vendor_assets():
+    """{path under static/: path on the CDN}"""
+    theme = getattr(settings, 'BOOTSWATCH_THEME', 'darkly')
+    css = BOOTSTRAP + 'css/bootstrap.min.css' if theme == 'bootstrap' else f'{BOOTSWATCH}{theme}/bootstrap.min.css'
+    return {
+        'vendor/bootstrap/bootstrap.min.css': css,
+        'vendor/bootstrap/bootstrap.bundle.min.js': BOOTSTRAP + 'js/bootstrap.bundle.min.js',
+        'vendor/bootstrap-icons/bootstrap-icons.min.css': ICONS + 'bootstrap-icons.min.css',
+        'vendor/bootstrap-icons/fonts/bootstrap-icons.woff2': ICONS + 'fonts/bootstrap-icons.woff2',
+        'vendor/bootstrap-icons/fonts/bootstrap-icons.woff': ICONS + 'fonts/bootstrap-icons.woff',
+    }
+
+
+def fetch_vendor_assets(dest, source=CDN):
+    """
+    Copy the vendor assets into ``dest`` from a URL prefix or local directory.
+
+    Source map comments are stripped: the maps aren't vendored, and the
+    manifest storage refuses to hash files that reference missing ones.
+    Yields each path written.
+    """
+    for name, remote in vendor_assets().items():
+        target = Path(dest) / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if '://' in source:
+            with urllib.request.urlopen(source + remote, timeout=30) as response:
+                data = response.read()
+        else:
+            data = (Path(source) / remote).read_bytes()
+        if target.suffix in ('.css', '.js'):
+            data = SOURCE_MAP.sub('', data.decode('utf-8')).encode('utf-8')
+        target.write_bytes(data)
+        yield name
+
+
+@cache
+def vendor_url(name):
+    """URL of a vendor asset: self-hosted once vendored, the CDN until then"""
+    if finders.find(name):
+        return static(name)
+    return CDN + vendor_assets()[name]
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage that also writes .gz/.br variants of text assets"""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if os.path.splitext(name)[1] in COMPRESSIBLE and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            data = original.read()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return
+        variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        for suffix, packed in variants.items():
+            if len(packed) < len(data):
+                with open(self.path(name + suffix), 'wb') as out:
+                    out.write(packed)
+
+
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def serve(request, path):
+    """
+    Serve a collected static file, precompressed when the client allows.
+
+    Fingerprinted names (listed in the manifest) never change, so they are
+    cached for a year as immutable; anything else gets a short max-age.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = Path(safe_join(settings.STATIC_ROOT, path))
+    except ValueError:
+        raise Http404(path)
+    if not fullpath.is_file():
+        raise Http404(path)
+
+    accepted = {
+        part.split(';')[0].strip() for part in request.headers.get('Accept-Encoding', '').split(',')
+    }
+    chosen, encoding = fullpath, None
+    for name, suffix in ENCODINGS:
+        candidate = fullpath.with_name(fullpath.name + suffix)
+        if name in accepted and candidate.is_file():
+            chosen, encoding = candidate, name
+            break
+
+    stat = chosen.stat()
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type = mimetypes.guess_type(fullpath.name)[0] or 'application/octet-stream'
+    response = FileResponse(chosen.open('rb'), content_type=content_type, filename=fullpath.name)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Content-Length'] = stat.st_size
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = IMMUTABLE if _is_fingerprinted(path) else 'public, max-age=300'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def _is_fingerprinted(path):
+    return path in _fingerprinted_names()
+
+
+@cache
+def _fingerprinted_names():
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
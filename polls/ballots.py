@@ -0,0 +1,120 @@
+"""
+Vectorized tallies for approval and ranked-choice (instant runoff) polls.
+
+Ballots are loaded once into a packed ``(ballots, max_rank)`` int32 matrix
+of choice indices, padded with a sentinel. Approval is then one bincount;
+each runoff round is a handful of array operations over the whole matrix:
+mask eliminated choices, take each ballot's first surviving preference,
+bincount. Results are cached against the poll's vote version, which every
+new ballot bumps.
+"""
+from itertools import chain
+
+import numpy as np
+from django.core.cache import cache
+
+from .cache import vote_version
+from .models import Poll, BallotRank
+
+TALLY_KEY = 'polls:tally:{}:{}'
+
+
+def tally(poll):
+    """
+    Tally a ballot poll, cached until its next ballot.
+
+    Returns ``{'ballots': n, 'counts': {choice_id: n}, 'rounds': [...],
+    'winner': choice_id or None}``. For ranked polls ``counts`` is the final
+    round and every round is listed as ``{'counts': ..., 'eliminated': [...]}``.
+    """
+    key = TALLY_KEY.format(poll.pk, vote_version(poll.pk))
+    result = cache.get(key)
+    if result is None:
+        choice_ids, matrix = load_ballots(poll)
+        if poll.poll_type == Poll.RANKED:
+            result = instant_runoff(choice_ids, matrix)
+        else:
+            result = approval(choice_ids, matrix)
+        cache.set(key, result, 60 * 60)
+    return result
+
+
+def load_ballots(poll):
+    """(sorted choice ids, int32 ballot matrix padded with len(choice_ids))"""
+    choice_ids = np.array(sorted(poll.choices.values_list('pk', flat=True)), dtype=np.int64)
+    rows = (
+        BallotRank.objects.filter(ballot__poll=poll)
+        .order_by('ballot_id', 'rank').values_list('ballot_id', 'choice_id')
+    )
+    flat = np.fromiter(chain.from_iterable(rows.iterator(chunk_size=10000)), dtype=np.int64)
+    ballot_ids, marked = flat[0::2], flat[1::2]
+
+    _, starts, inverse = np.unique(ballot_ids, return_index=True, return_inverse=True)
+    position = np.arange(len(ballot_ids)) - starts[inverse]
+    width = int(position.max()) + 1 if len(position) else 0
+
+    matrix = np.full((len(starts), width), len(choice_ids), dtype=np.int32)
+    matrix[inverse, position] = np.searchsorted(choice_ids, marked)
+    return choice_ids, matrix
+
+
+def approval(choice_ids, matrix):
+    counts = np.bincount(matrix.ravel(), minlength=len(choice_ids) + 1)[:len(choice_ids)]
+    return {
+        'ballots': len(matrix),
+        'counts': _by_id(choice_ids, counts),
+        'rounds': [],
+        'winner': _leader(choice_ids, counts),
+    }
+
+
+def instant_runoff(choice_ids, matrix):
+    n = len(choice_ids)
+    if not matrix.size:
+        counts = _by_id(choice_ids, np.zeros(n, dtype=np.int64))
+        return {'ballots': len(matrix), 'counts': counts, 'rounds': [], 'winner': None}
+    eliminated = np.zeros(n + 1, dtype=bool)
+    eliminated[n] = True  # the padding sentinel never counts
+    rows = np.arange(len(matrix))
+    rounds, winner = [], None
+
+    while True:
+        alive = ~eliminated[matrix]
+        has_choice = alive.any(axis=1)
+        top = matrix[rows, alive.argmax(axis=1)][has_choice]
+        counts = np.bincount(top, minlength=n + 1)[:n]
+
+        continuing = ~eliminated[:n]
+        total = counts.sum()
+        round_ = {'counts': _by_id(choice_ids, counts), 'eliminated': []}
+        rounds.append(round_)
+        if not total:
+            break
+
+        leader = np.flatnonzero(continuing)[counts[continuing].argmax()]
+        if counts[leader] * 2 > total or continuing.sum() == 1:
+            winner = int(choice_ids[leader])
+            break
+
+        losers = continuing & (counts == counts[continuing].min())
+        if losers.sum() == continuing.sum():  # everyone left is tied
+            break
+        eliminated[:n] |= losers
+        round_['eliminated'] = [int(pk) for pk in choice_ids[losers]]
+
+    return {
+        'ballots': len(matrix),
+        'counts': rounds[-1]['counts'],
+        'rounds': rounds,
+        'winner': winner,
+    }
+
+
+def _by_id(choice_ids, counts):
+    return {int(pk): int(count) for pk, count in zip(choice_ids, counts)}
+
+
+def _leader(choice_ids, counts):
+    if not len(counts) or not counts.max():
+        return None
+    return int(choice_ids[counts.argmax()])
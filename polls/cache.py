@@ -0,0 +1,233 @@
+"""
+Render and page caching for polls.
+
+Cached fragments are keyed by poll id, ``updated_at`` and a per-poll vote
+version; cached anonymous pages by a per-poll or global list generation.
+Voting and editing bump these, so stale entries simply become unreachable
+and expire on their own - nothing has to be hunted down. Hot polls' keys
+move on at most once a second or so instead (``pinned_vote_version``).
+"""
+import functools
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django_components import ComponentCache
+
+from . import metrics
+from .hotpolls import hot_polls
+
+VOTE_VERSION_KEY = 'polls:vote_version:{}'
+LIST_GENERATION_KEY = 'polls:list_generation'
+PAGE_KEY = 'polls:page:{}:{}:{}'
+
+
+def _fresh_version():
+    # Seeding with the clock (rather than 0) means a version key that was
+    # evicted never comes back with a value an old fragment was stored under.
+    return time.time_ns() // 1000
+
+
+def _current(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _fresh_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _fresh_version(), timeout=None)
+        return cache.get(key)
+
+
+def vote_version(poll_id):
+    """Current vote version of a poll, doubling as its page generation"""
+    return _current(VOTE_VERSION_KEY.format(poll_id))
+
+
+def pinned_vote_version(poll_id):
+    """vote_version, held between recomputes while the poll is hot (see polls.hotpolls)"""
+    from .loaders import VoteLoader
+    loader = VoteLoader.current()
+    if loader is not None and loader.voted_in_request(poll_id):
+        return vote_version(poll_id)
+    return hot_polls().pinned(poll_id, 'vote_version', lambda: vote_version(poll_id))
+
+
+def bump_vote_version(poll_id):
+    """Invalidate everything cached against the poll's current vote version"""
+    return _bump(VOTE_VERSION_KEY.format(poll_id))
+
+
+def list_generation():
+    return _current(LIST_GENERATION_KEY)
+
+
+def bump_list_generation():
+    """Invalidate every cached poll list page"""
+    return _bump(LIST_GENERATION_KEY)
+
+
+class RenderStats:
+    """Process-local hit/miss counters and render time per component"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _entry(self, name):
+        return self._stats.setdefault(name, {'hits': 0, 'misses': 0, 'render_seconds': 0.0})
+
+    def hit(self, name):
+        with self._lock:
+            self._entry(name)['hits'] += 1
+
+    def miss(self, name, seconds):
+        with self._lock:
+            entry = self._entry(name)
+            entry['misses'] += 1
+            entry['render_seconds'] += seconds
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """Stats per component, with render time saved estimated from the mean miss"""
+        with self._lock:
+            report = {}
+            for name, entry in self._stats.items():
+                lookups = entry['hits'] + entry['misses']
+                mean = entry['render_seconds'] / entry['misses'] if entry['misses'] else 0.0
+                report[name] = {
+                    **entry,
+                    'hit_ratio': round(entry['hits'] / lookups, 3) if lookups else 0.0,
+                    'mean_render_ms': round(mean * 1000, 3),
+                    'saved_ms': round(entry['hits'] * mean * 1000, 3),
+                }
+            return report
+
+
+render_stats = RenderStats()
+metrics.register('component_cache', render_stats.snapshot)
+
+
+class PollFragmentCache(ComponentCache):
+    """
+    Opt-in render cache for components that take a ``poll`` kwarg.
+
+        class Cache(PollFragmentCache):
+            enabled = True
+
+    Other kwargs are ignored unless listed in ``vary_on``; anything derived
+    from the poll itself (results, totals) is covered by the vote version.
+    """
+    ttl = 60 * 60
+    vary_on = ()
+
+    def hash(self, args, kwargs):
+        poll = kwargs['poll']
+        parts = [
+            self.component_cls.__name__,
+            str(poll.pk),
+            poll.updated_at.isoformat() if poll.updated_at else '',
+            str(pinned_vote_version(poll.pk)),
+        ]
+        parts += [f"{name}={kwargs.get(name)}" for name in self.vary_on]
+        return ':'.join(parts)
+
+    def get_entry(self, cache_key):
+        html = super().get_entry(cache_key)
+        if html is None:
+            self._render_started = time.perf_counter()
+        else:
+            render_stats.hit(self.component_cls.__name__)
+        return html
+
+    def set_entry(self, cache_key, value):
+        started = getattr(self, '_render_started', None)
+        if started is not None:
+            render_stats.miss(self.component_cls.__name__, time.perf_counter() - started)
+        super().set_entry(cache_key, value)
+
+
+page_stats = {'hits': 0, 'misses': 0, 'bypassed': 0}
+metrics.register('page_cache', lambda: dict(page_stats))
+
+
+@functools.cache
+def filter_query_keys(filterset_class):
+    """Query parameters that can change a filtered list page"""
+    keys = {'page'}
+    for name, field in filterset_class().form.fields.items():
+        suffixes = getattr(field.widget, 'widgets_names', None) or ['']
+        keys.update(name + suffix for suffix in suffixes)
+    return frozenset(keys)
+
+
+class AnonymousPageCacheMixin:
+    """
+    Serve whole GET pages to anonymous users from the cache.
+
+    Views provide ``get_page_generation()``; the key is that generation plus
+    host, path and the sorted non-empty query parameters, so ``?b=&a=1`` and
+    ``?a=1`` share an entry. Pages echo the request URL (pagination, login
+    ``next``), so parameters outside ``page_cache_query_keys`` bypass the
+    cache. So do authenticated users, requests with pending messages and
+    responses that issued a CSRF token.
+    """
+    page_cache_query_keys = frozenset()
+    
+    def get_page_generation(self):
+        raise NotImplementedError
+    
+    def get_page_cache_key(self):
+        params = sorted(
+            (key, value)
+            for key, values in self.request.GET.lists() if key in self.page_cache_query_keys
+            for value in values if value
+        )
+        url = self.request.get_host() + self.request.path + '?' + urlencode(params)
+        return PAGE_KEY.format(type(self).__name__, self.get_page_generation(), url)
+    
+    def _page_cacheable(self, request):
+        return (
+            request.method in ('GET', 'HEAD')
+            and set(request.GET) <= self.page_cache_query_keys
+            and not request.user.is_authenticated
+            and not len(messages.get_messages(request))
+        )
+    
+    def dispatch(self, request, *args, **kwargs):
+        if not self._page_cacheable(request):
+            page_stats['bypassed'] += 1
+            return super().dispatch(request, *args, **kwargs)
+        
+        self.request, self.args, self.kwargs = request, args, kwargs
+        key = self.get_page_cache_key()
+        cached = cache.get(key)
+        if cached is not None:
+            page_stats['hits'] += 1
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Page-Cache'] = 'hit'
+            return response
+        
+        page_stats['misses'] += 1
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        if (response.status_code == 200 and not response.cookies
+                and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')):
+            cache.set(key, (response.content, response['Content-Type']),
+                      getattr(settings, 'POLLS_PAGE_CACHE_TIMEOUT', 300))
+        response['X-Page-Cache'] = 'miss'
+        return response
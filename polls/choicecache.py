@@ -0,0 +1,295 @@
+"""
+Process-local cache of who voted for what.
+
+``VoteLoader.user_choice_id`` answers "which choice did this user pick in
+this poll" for every authenticated detail page, vote and poll card. The
+answer only changes when that user votes, so each worker process keeps a
+bounded LRU of ``(user_id, poll_id) -> choice_id`` (None for "hasn't voted")
+in front of the database.
+
+A vote evicts its key locally and publishes it on an invalidation bus, so
+the other workers drop it too. They do this at the start of their next
+request. The bus is pluggable:
+
+    POLLS_CHOICE_CACHE = {
+        'MAX_ENTRIES': 100_000,                      # 0 disables the cache
+        'BUS': 'polls.choicecache.SQLiteBus',        # or FileBus, LocalBus
+        'OPTIONS': {'path': '/run/votely/choice-bus.sqlite3'},
+    }
+
+``LocalBus`` suits a single process, and ``FileBus`` and ``SQLiteBus`` suit
+workers sharing one host. Anything else (Redis pub/sub, say) needs only
+``publish`` and ``receive``. Without the setting the cache is off.
+
+Hit ratio, evictions and approximate memory are reported under the
+``choice_cache`` metric.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+FLUSH = object()  # received instead of a key when every entry must go
+_MISSING = object()
+
+
+class LocalBus:
+    """No other processes to tell"""
+
+    def publish(self, keys):
+        pass
+
+    def receive(self):
+        return []
+
+
+class FileBus:
+    """
+    Invalidations appended as lines to a shared file.
+
+    Each process remembers how far it has read; checking for news is a
+    ``stat``. Truncating the file (to reclaim space) makes every reader
+    flush.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._offset = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def publish(self, keys):
+        data = ''.join('*\n' if key is FLUSH else f'{key[0]} {key[1]}\n' for key in keys)
+        # One O_APPEND write per batch, so lines from different processes never interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data.encode())
+        finally:
+            os.close(fd)
+
+    def receive(self):
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                size = 0
+            if size == self._offset:
+                return []
+            if size < self._offset:
+                self._offset = size
+                return [FLUSH]
+            with open(self.path, 'rb') as bus:
+                bus.seek(self._offset)
+                data = bus.read(size - self._offset)
+            complete = data.rfind(b'\n') + 1
+            self._offset += complete
+        return [_parse(line) for line in data[:complete].decode().splitlines()]
+
+
+def _parse(line):
+    if line == '*':
+        return FLUSH
+    user_id, poll_id = line.split()
+    return int(user_id), int(poll_id)
+
+
+class SQLiteBus:
+    """
+    Invalidations as rows of a small SQLite table in WAL mode.
+
+    Rows older than ``retain`` seconds are pruned. A reader that fell
+    further behind than that flushes instead of trusting its entries.
+    """
+
+    def __init__(self, path, retain=3600):
+        self.path = str(path)
+        self.retain = retain
+        self._local = threading.local()
+        db = self._connect()
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS invalidation ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, poll_id INTEGER, at REAL)'
+        )
+        self._last = db.execute('SELECT coalesce(max(id), 0) FROM invalidation').fetchone()[0]
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def publish(self, keys):
+        now = time.time()
+        rows = [(None, None, now) if key is FLUSH else (key[0], key[1], now) for key in keys]
+        db = self._connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany('INSERT INTO invalidation (user_id, poll_id, at) VALUES (?, ?, ?)', rows)
+            self._published += 1
+            if self._published % 1000 == 0:
+                db.execute('DELETE FROM invalidation WHERE at < ?', (now - self.retain,))
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def receive(self):
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT id, user_id, poll_id FROM invalidation WHERE id > ? ORDER BY id', (self._last,)
+            ).fetchall()
+            if not rows:
+                return []
+            missed = rows[0][0] > self._last + 1
+            self._last = rows[-1][0]
+        if missed:  # pruned before we saw them (or ids skipped by a rollback): be safe
+            return [FLUSH]
+        return [FLUSH if user_id is None else (user_id, poll_id) for _, user_id, poll_id in rows]
+
+
+class ChoiceCache:
+    """Thread-safe LRU of (user_id, poll_id) -> choice_id, kept coherent through a bus"""
+
+    # Rough per-entry cost: the dict slot plus a 2-tuple key and three small ints
+    ENTRY_BYTES = sys.getsizeof((1, 2)) + 3 * sys.getsizeof(2 ** 40) + 2 * 8
+
+    def __init__(self, max_entries=100_000, bus=None):
+        self.max_entries = max_entries
+        self.bus = bus or LocalBus()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._seq = 0
+        self._dropped = OrderedDict()  # key -> seq of its last invalidation (recent ones only)
+        self._flushed_at = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """The cached choice id (None meaning "no vote"), or _MISSING"""
+        if not self.max_entries:
+            return _MISSING
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def mark(self):
+        """Position to pass to ``fill`` for results read from the database after now"""
+        return self._seq
+
+    def fill(self, values, since):
+        """
+        Cache database results read after ``mark()`` returned ``since``.
+
+        Keys invalidated meanwhile are skipped: what was read may predate
+        the vote that invalidated them.
+        """
+        self.sync()
+        with self._lock:
+            if self._flushed_at > since:
+                return
+            for key, value in values.items():
+                if self._dropped.get(key, 0) > since:
+                    continue
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        """Drop keys here and tell the other processes"""
+        keys = list(keys)
+        self._drop(keys)
+        self.bus.publish(keys)
+
+    def invalidate_all(self):
+        self._drop([FLUSH])
+        self.bus.publish([FLUSH])
+
+    def sync(self):
+        """Apply invalidations published by other processes"""
+        received = self.bus.receive()
+        if received:
+            self._drop(received)
+
+    def _drop(self, keys):
+        with self._lock:
+            for key in keys:
+                self._seq += 1
+                self.invalidations += 1
+                if key is FLUSH:
+                    self._entries.clear()
+                    self._dropped.clear()
+                    self._flushed_at = self._seq
+                    continue
+                self._entries.pop(key, None)
+                self._dropped[key] = self._seq
+                self._dropped.move_to_end(key)
+            # Forgetting an old invalidation must not let a fill from before it through
+            while len(self._dropped) > 10_000:
+                _, seq = self._dropped.popitem(last=False)
+                self._flushed_at = max(self._flushed_at, seq)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'approx_bytes': sys.getsizeof(self._entries) + len(self._entries) * self.ENTRY_BYTES,
+                'bus': type(self.bus).__name__,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def choice_cache():
+    """This process's cache, built from POLLS_CHOICE_CACHE on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = getattr(settings, 'POLLS_CHOICE_CACHE', {})
+                bus = import_string(config.get('BUS', 'polls.choicecache.LocalBus'))(**config.get('OPTIONS', {}))
+                _cache = ChoiceCache(config.get('MAX_ENTRIES', 0), bus)
+    return _cache
+
+
+@receiver(setting_changed)
+def reset_choice_cache(setting, **kwargs):
+    global _cache
+    if setting == 'POLLS_CHOICE_CACHE':
+        _cache = None
+
+
+metrics.register('choice_cache', lambda: choice_cache().stats())
@@ -0,0 +1,3 @@
+# COMPONENTS['libraries'] imports this package; importing the modules registers
+# their components even where autodiscovery is off (votely.settings_prod)
+from . import alerts, navbar, poll_card, poll_results, vote_form  # noqa: F401
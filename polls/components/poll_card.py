@@ -1,13 +1,20 @@
 from django_components import component
+from polls.cache import PollFragmentCache
 
 
 @component.register("poll_card")
 class PollCardComponent(component.Component):
     template_name = "polls/components/poll_card.html"
     
-    def get_context_data(self, poll, show_actions=True, **kwargs):
+    class Cache(PollFragmentCache):
+        enabled = True
+        vary_on = ('show_actions', 'voted')
+    
+    def get_context_data(self, poll, show_actions=True, voted=False, **kwargs):
         return {
             "poll": poll,
+            "tags": list(poll.tags.all()),
             "show_actions": show_actions,
+            "voted": voted,
             "total_votes": poll.total_votes,
         }
@@ -1,13 +1,21 @@
 from django_components import component
+from polls.cache import PollFragmentCache
 
 
 @component.register("poll_results")
 class PollResultsComponent(component.Component):
     template_name = "polls/components/poll_results.html"
     
+    class Cache(PollFragmentCache):
+        enabled = True
+    
     def get_context_data(self, poll, results=None, **kwargs):
+        results = results or poll.get_results()
+        tally = poll.tally() if poll.uses_ballots else {}
         return {
             "poll": poll,
-            "results": results or poll.get_results(),
-            "total_votes": poll.total_votes,
+            "results": results,
+            "total_votes": poll.total_votes if poll.uses_ballots else sum(r['count'] for r in results),
+            "rounds": len(tally.get("rounds", [])),
+            "winner": next((r['choice'] for r in results if r['choice'].pk == tally.get("winner")), None),
         }
@@ -0,0 +1,105 @@
+"""
+Cross-poll analytics: "people who picked X in poll A picked what in poll B?"
+
+Each poll's marks become a sparse users x choices incidence matrix over the
+users of both polls; the crosstab is then a single sparse product
+``A.T @ B``. Single-choice polls use votes, approval polls every approved
+choice and ranked polls first preferences. Results are cached per ordered
+pair until either poll's vote version moves.
+"""
+from itertools import chain
+
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Max
+from django.utils import timezone
+from scipy import sparse
+from scipy.stats.contingency import association
+
+from .models import Poll, Choice, BallotRank, PollCrosstab
+from .voting import Vote, VoteEvent
+
+
+def crosstab(poll_a, poll_b):
+    """
+    Compute, store and return the crosstab of two polls' respondents.
+
+    Returns ``{'a': poll, 'b': poll, 'columns': [choice], 'rows': [{'choice',
+    'counts', 'shares', 'total'}], 'respondents': n, 'cramers_v': v}`` with
+    polls and choices as ``{'id', 'text'/'title'}`` dicts. ``shares`` are the
+    percentage of the row's respondents picking each column; ``cramers_v``
+    (0 to 1, None when undefined) measures how strongly the answers are
+    associated.
+    """
+    started = timezone.now()
+    through = VoteEvent.objects.aggregate(m=Max('id'))['m'] or 0
+    result = compute_crosstab(poll_a, poll_b)
+    PollCrosstab.objects.update_or_create(
+        poll=poll_a, other=poll_b,
+        defaults={'result': result, 'through_event': through, 'computed_at': started},
+    )
+    return result
+
+
+def compute_crosstab(poll_a, poll_b):
+    choices_a, users_a, cols_a = load_marks(poll_a)
+    choices_b, users_b, cols_b = load_marks(poll_b)
+    users = np.union1d(users_a, users_b)
+    a = incidence(users, users_a, cols_a, len(choices_a))
+    b = incidence(users, users_b, cols_b, len(choices_b))
+
+    counts = (a.T @ b).toarray()
+    answered_both = (a.getnnz(axis=1) > 0) & (b.getnnz(axis=1) > 0)
+    # Row totals: respondents of both polls who picked the row's choice
+    totals = np.asarray(a[answered_both].sum(axis=0)).ravel()
+    shares = np.divide(100.0 * counts, totals[:, None], out=np.zeros(counts.shape), where=totals[:, None] > 0)
+
+    return {
+        'a': {'id': poll_a.pk, 'title': poll_a.title},
+        'b': {'id': poll_b.pk, 'title': poll_b.title},
+        'columns': [{'id': pk, 'text': text} for pk, text in choices_b],
+        'rows': [
+            {
+                'choice': {'id': pk, 'text': text},
+                'counts': [int(n) for n in counts[i]],
+                'shares': [round(float(s), 1) for s in shares[i]],
+                'total': int(totals[i]),
+            }
+            for i, (pk, text) in enumerate(choices_a)
+        ],
+        'respondents': int(answered_both.sum()),
+        'cramers_v': cramers_v(counts),
+    }
+
+
+def load_marks(poll):
+    """(choices as [(id, text)], user ids, choice column indices) for one poll"""
+    choices = list(poll.choices.order_by('pk').values_list('pk', 'text'))
+    choice_ids = np.array([pk for pk, _ in choices], dtype=np.int64)
+    if poll.uses_ballots:
+        rows = BallotRank.objects.filter(ballot__poll=poll)
+        if poll.poll_type == Poll.RANKED:
+            rows = rows.filter(rank=1)
+        rows = rows.values_list('ballot__user_id', 'choice_id')
+    else:
+        rows = Vote.objects.filter(
+            content_type=ContentType.objects.get_for_model(Choice), object_id__in=choice_ids.tolist()
+        ).values_list('user_id', 'object_id')
+    flat = np.fromiter(chain.from_iterable(rows.order_by().iterator(chunk_size=10000)), dtype=np.int64)
+    users, marked = flat[0::2], flat[1::2]
+    return choices, users, np.searchsorted(choice_ids, marked)
+
+
+def incidence(users, marked_users, columns, n_choices):
+    """Sparse 0/1 matrix: row per user in ``users``, column per choice"""
+    rows = np.searchsorted(users, marked_users)
+    data = np.ones(len(rows), dtype=np.int32)
+    return sparse.csr_matrix((data, (rows, columns)), shape=(len(users), n_choices))
+
+
+def cramers_v(counts):
+    """Cramér's V of a contingency table, ignoring empty rows and columns"""
+    table = counts[counts.sum(axis=1) > 0][:, counts.sum(axis=0) > 0]
+    if min(table.shape, default=0) < 2:
+        return None
+    return round(float(association(table, method='cramer')), 4)
@@ -0,0 +1,230 @@
+"""
+Columnar export of the vote log for offline analysis.
+
+``manage.py export_votes DIR`` appends the vote events added since the last
+run as a new partition:
+
+    DIR/manifest.json
+    DIR/part-00000/{kind,user_id,poll_id,choice_id,created_at}.npy
+    DIR/part-00001/...            (or part-NNNNN.arrow with --format arrow)
+
+Each column is a flat fixed-width array (21 bytes a row in all), so
+``read_partitions`` can memory-map them without copying: 100M events are
+about 2GB on disk and cost nothing to open. ``current_votes`` folds
+the events into the votes standing at export time. Events come from the
+append-only ``VoteEvent`` log, not ``Vote`` rows, because vote rows change
+in place and an id watermark would miss those changes.
+
+Event ids can commit out of order on PostgreSQL, so ids below the
+watermark that were missing at export time are kept in the manifest and
+asked for again on later runs, until ``GAP_GRACE`` seconds have passed.
+Late events land in the next partition. Events on choices that have
+since been deleted are left out, as their poll is no longer known. A
+change event's poll can still come from its previous choice, which is
+kept. Events of deleted accounts have user_id 0. Partitions an
+interrupted run left behind without listing them are removed before
+writing.
+
+Reading needs only NumPy (and pyarrow for Arrow partitions), not Django.
+"""
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # optional: .npy partitions only
+    pyarrow = None
+
+MANIFEST = 'manifest.json'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_US = timedelta(microseconds=1)
+KINDS = ['cast', 'change', 'retract']  # codes in the kind column
+GAP_GRACE = 600      # seconds a skipped event id may still commit
+GAP_WINDOW = 1000    # only ids this close below the newest can still be in flight
+COLUMNS = {
+    'kind': 'int8',
+    'user_id': 'int32',
+    'poll_id': 'int32',
+    'choice_id': 'int32',
+    'created_at': 'datetime64[us]',
+}
+
+
+def read_manifest(path):
+    try:
+        return json.loads((Path(path) / MANIFEST).read_text())
+    except FileNotFoundError:
+        return {'columns': COLUMNS, 'partitions': [], 'watermark': 0, 'gaps': []}
+
+
+def _write_manifest(path, manifest):
+    tmp = Path(path) / (MANIFEST + '.tmp')
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, Path(path) / MANIFEST)
+
+
+def export_votes(path, partition_size=5_000_000, format='npy'):
+    """
+    Append every vote event newer than the manifest's watermark, and the late ones among its gaps.
+
+    Writes up to ``partition_size`` events per partition and publishes each
+    partition (files first, then the manifest) before starting the next, so
+    an interrupted export loses nothing already listed. Returns the list of
+    new partition entries.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from django.db.models import Q
+    from .models import Choice
+    from .voting import VoteEvent
+
+    if format == 'arrow' and pyarrow is None:
+        raise ImportError("Arrow export needs pyarrow installed")
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(path)
+    _remove_unlisted(path, manifest)
+
+    events = VoteEvent.objects.filter(content_type=ContentType.objects.get_for_model(Choice))
+    until = events.order_by('-id').values_list('id', flat=True).first() or 0
+    choice_polls = dict(Choice.objects.order_by().values_list('id', 'poll_id').iterator(chunk_size=10000))
+    codes = {kind: code for code, kind in enumerate(KINDS)}
+    now = time.time()
+    gaps = dict(manifest.get('gaps', []))
+
+    added = []
+    while True:
+        watermark = manifest['watermark']
+        rows = (
+            events.filter(Q(id__gt=watermark, id__lte=until) | Q(id__in=list(gaps))).order_by('id')
+            .values_list('id', 'kind', 'user_id', 'object_id', 'previous_object_id', 'created_at')
+            [:partition_size]
+        )
+        ids, columns = _to_columns(rows.iterator(chunk_size=10000), codes, choice_polls)
+        if not len(ids):
+            break
+        for pk in ids[ids <= watermark].tolist():
+            gaps.pop(pk, None)
+        fresh = ids[ids > watermark]
+        if len(fresh):
+            newest = int(fresh[-1])
+            skipped = np.setdiff1d(np.arange(max(watermark, newest - GAP_WINDOW) + 1, newest), fresh)
+            gaps.update(dict.fromkeys(skipped.tolist(), now + GAP_GRACE))
+            manifest['watermark'] = newest
+        manifest['gaps'] = sorted(gaps.items())
+        if len(columns['kind']):
+            entry = {
+                'name': f"part-{len(manifest['partitions']):05d}",
+                'format': format,
+                'rows': len(columns['kind']),
+                'min_id': int(ids[0]),
+                'max_id': int(ids[-1]),
+            }
+            _write_partition(path, entry, columns)
+            manifest['partitions'].append(entry)
+            added.append(entry)
+        _write_manifest(path, manifest)
+        if len(ids) < partition_size:
+            break
+
+    # Every gap is asked for on at least one later run before it expires
+    manifest['gaps'] = sorted((pk, expires) for pk, expires in gaps.items() if expires > now)
+    _write_manifest(path, manifest)
+    return added
+
+
+def _to_columns(rows, codes, choice_polls):
+    """(every row's event id, columns of the rows whose poll is known)"""
+    flat = np.fromiter(
+        (value for pk, kind, user_id, choice_id, previous_id, created_at in rows
+         for value in (pk, codes[kind], user_id or 0,
+                       choice_polls.get(choice_id) or choice_polls.get(previous_id, -1), choice_id,
+                       (created_at - EPOCH) // ONE_US)),
+        dtype=np.int64,
+    ).reshape(-1, 6)
+    known = flat[flat[:, 3] >= 0]
+    columns = {
+        'kind': known[:, 1].astype(np.int8),
+        'user_id': known[:, 2].astype(np.int32),
+        'poll_id': known[:, 3].astype(np.int32),
+        'choice_id': known[:, 4].astype(np.int32),
+        'created_at': known[:, 5].view('datetime64[us]'),
+    }
+    return flat[:, 0], columns
+
+
+def _remove_unlisted(path, manifest):
+    """Delete partitions and temporaries an interrupted export wrote but never listed"""
+    listed = {entry['name'] for entry in manifest['partitions']}
+    for item in path.glob('part-*'):
+        if item.name.split('.')[0] not in listed or item.name.endswith('.tmp'):
+            if item.is_dir():
+                shutil.rmtree(item)
+            else:
+                item.unlink()
+
+
+def _write_partition(path, entry, columns):
+    if entry['format'] == 'arrow':
+        target = path / f"{entry['name']}.arrow"
+        table = pyarrow.table({name: np.ascontiguousarray(values) for name, values in columns.items()})
+        with pyarrow.OSFile(str(target) + '.tmp', 'wb') as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(str(target) + '.tmp', target)
+        return
+    tmp = path / (entry['name'] + '.tmp')
+    tmp.mkdir(exist_ok=True)
+    for name, values in columns.items():
+        np.save(tmp / f'{name}.npy', np.ascontiguousarray(values))
+    os.replace(tmp, path / entry['name'])
+
+
+def read_partitions(path):
+    """Yield each partition as {column: array}, memory-mapped read-only"""
+    path = Path(path)
+    for entry in read_manifest(path)['partitions']:
+        if entry['format'] == 'arrow':
+            if pyarrow is None:
+                raise ImportError("Reading Arrow partitions needs pyarrow installed")
+            source = pyarrow.memory_map(str(path / f"{entry['name']}.arrow"))
+            table = pyarrow.ipc.open_file(source).read_all()
+            yield {name: table.column(name).to_numpy() for name in COLUMNS}
+        else:
+            yield {
+                name: np.load(path / entry['name'] / f'{name}.npy', mmap_mode='r')
+                for name in COLUMNS
+            }
+
+
+def read_columns(path, columns=tuple(COLUMNS)):
+    """Whole columns across all partitions (concatenated, so copied)"""
+    parts = list(read_partitions(path))
+    return {
+        name: np.concatenate([part[name] for part in parts]) if parts else np.empty(0, COLUMNS[name])
+        for name in columns
+    }
+
+
+def current_votes(path):
+    """
+    The standing votes as columns: user_id, poll_id, choice_id, created_at.
+
+    A user holds one vote per poll, so it is the latest event of each
+    (user, poll) pair unless that event is a retraction. Deleted accounts
+    hold none.
+    """
+    events = read_columns(path)
+    order = np.lexsort((np.arange(len(events['kind'])), events['poll_id'], events['user_id']))
+    user, poll = events['user_id'][order], events['poll_id'][order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (user[1:] != user[:-1]) | (poll[1:] != poll[:-1])
+    keep = order[last]
+    keep = keep[(events['kind'][keep] != KINDS.index('retract')) & (events['user_id'][keep] != 0)]
+    return {name: events[name][keep] for name in ('user_id', 'poll_id', 'choice_id', 'created_at')}
@@ -1,5 +1,6 @@
 from django import forms
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column
 from .models import Poll, Choice
@@ -41,6 +42,55 @@ class VoteForm(forms.Form):
         return cleaned_data
 
 
+class BallotForm(forms.Form):
+    """
+    Ballot for approval polls (tick any number of choices) and ranked polls
+    (number the choices you care about, 1 = favourite).
+    """
+    
+    def __init__(self, poll, user, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.poll = poll
+        self.user = user
+        self.choices = list(poll.choices.all())
+        existing = poll.user_ballot(user)
+        self.has_voted = bool(existing)
+        
+        if poll.poll_type == Poll.APPROVAL:
+            self.fields['choices'] = forms.ModelMultipleChoiceField(
+                queryset=poll.choices.all(),
+                widget=forms.CheckboxSelectMultiple,
+                initial=existing,
+            )
+        else:
+            ranks = {choice_id: rank for rank, choice_id in enumerate(existing, start=1)}
+            for choice in self.choices:
+                self.fields[f'rank_{choice.pk}'] = forms.IntegerField(
+                    label=choice.text,
+                    min_value=1,
+                    max_value=len(self.choices),
+                    required=False,
+                    initial=ranks.get(choice.pk),
+                )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if not self.poll.is_active:
+            raise ValidationError("This poll is no longer active.")
+        if self.poll.poll_type == Poll.RANKED:
+            ranked = [(cleaned_data.get(f'rank_{choice.pk}'), choice) for choice in self.choices]
+            ranked = sorted((rank, choice.pk, choice) for rank, choice in ranked if rank)
+            ranks = [rank for rank, _, _ in ranked]
+            if not ranks:
+                raise ValidationError("Rank at least one choice.")
+            if len(set(ranks)) != len(ranks):
+                raise ValidationError("Each rank can only be used once.")
+            cleaned_data['ranking'] = [choice for _, _, choice in ranked]
+        else:
+            cleaned_data['ranking'] = list(cleaned_data.get('choices') or [])
+        return cleaned_data
+
+
 class PollForm(forms.ModelForm):
     choices = forms.CharField(
         widget=forms.Textarea(attrs={'rows': 4}),
@@ -49,7 +99,7 @@ class PollForm(forms.ModelForm):
     
     class Meta:
         model = Poll
-        fields = ['title', 'description', 'tags']
+        fields = ['title', 'description', 'poll_type', 'tags']
         
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -57,24 +107,62 @@ class PollForm(forms.ModelForm):
         self.helper.layout = Layout(
             'title',
             'description',
+            'poll_type',
             'tags',
             'choices',
             Submit('submit', 'Create Poll', css_class='btn btn-success')
         )
     
     def save(self, user):
-        poll = super().save(commit=False)
-        poll.created_by = user
-        poll.save()
-        
-        # Save tags
-        self.save_m2m()
-        
-        # Create choices
-        choices_text = self.cleaned_data['choices'].strip()
-        for line in choices_text.split('\n'):
-            line = line.strip()
-            if line:
-                Choice.objects.create(poll=poll, text=line)
+        with transaction.atomic():
+            poll = super().save(commit=False)
+            poll.created_by = user
+            poll.save()
+            
+            # Save tags
+            self.save_m2m()
+            
+            # Create choices
+            choices_text = self.cleaned_data['choices'].strip()
+            Choice.objects.bulk_create([
+                Choice(poll=poll, text=line.strip())
+                for line in choices_text.split('\n') if line.strip()
+            ])
         
-        return poll
\ No newline at end of file
+        return poll
+
+
+class StringListField(forms.Field):
+    """A JSON list of non-empty strings (a newline separated string also works)"""
+    
+    def __init__(self, *, max_length, **kwargs):
+        self.max_length = max_length
+        super().__init__(**kwargs)
+    
+    def to_python(self, value):
+        if value in self.empty_values:
+            return []
+        if isinstance(value, str):
+            value = value.split('\n')
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValidationError("Expected a list of strings.")
+        items = [item.strip() for item in value if item.strip()]
+        too_long = [item for item in items if len(item) > self.max_length]
+        if too_long:
+            raise ValidationError(f"Items may be at most {self.max_length} characters: {too_long[0][:30]}...")
+        return items
+
+
+class PollImportForm(forms.Form):
+    """Validates one record of a batch poll import"""
+    title = forms.CharField(max_length=200)
+    description = forms.CharField()
+    is_active = forms.BooleanField(required=False)
+    choices = StringListField(max_length=200)
+    tags = StringListField(max_length=100, required=False)
+    
+    def clean_choices(self):
+        choices = self.cleaned_data['choices']
+        if len(choices) < 2:
+            raise ValidationError("A poll needs at least two choices.")
+        return choices
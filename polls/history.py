@@ -0,0 +1,56 @@
+"""
+A user's vote history, newest first, with keyset pagination.
+
+Pages are addressed by an opaque cursor encoding the ``(created_at, id)`` of
+the last vote shown, so page N costs the same as page 1: one range scan on
+the ``(user, created_at)`` index plus one query for the choices and polls.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import BadRequest
+from django.db.models import Q
+
+from .models import Choice
+from .voting import Vote
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def encode_cursor(created_at, pk):
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1)}.{pk}"
+
+
+def decode_cursor(cursor):
+    try:
+        micros, pk = cursor.split('.')
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except ValueError:
+        raise BadRequest(f"Invalid cursor: {cursor!r}")
+
+
+def vote_history(user, after=None, limit=20):
+    """
+    One page of the user's votes: ``(entries, next_cursor)``.
+
+    Entries are ``{'poll', 'choice', 'voted_at'}`` dicts; ``next_cursor`` is
+    None on the last page.
+    """
+    votes = Vote.objects.filter(
+        user=user, content_type=ContentType.objects.get_for_model(Choice)
+    ).order_by('-created_at', '-id')
+    if after:
+        created_at, pk = decode_cursor(after)
+        votes = votes.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    page = list(votes.values_list('id', 'object_id', 'created_at')[:limit + 1])
+    more, page = len(page) > limit, page[:limit]
+    choices = Choice.objects.select_related('poll__created_by').in_bulk(
+        [object_id for _, object_id, _ in page]
+    )
+    entries = [
+        {'poll': choices[object_id].poll, 'choice': choices[object_id], 'voted_at': created_at}
+        for _, object_id, created_at in page if object_id in choices
+    ]
+    next_cursor = encode_cursor(page[-1][2], page[-1][0]) if more else None
+    return entries, next_cursor
@@ -0,0 +1,207 @@
+"""
+Hot-poll detection and pinned results.
+
+Traffic is skewed: a few polls take most of the reads and votes, and every
+vote on them bumps their vote version, so their cached results and pages
+are thrown away and rebuilt over and over. Each worker counts requests to
+the detail page, the results endpoint and votes per poll in a
+space-saving sketch (Metwally et al.): at most ``CAPACITY`` counters, the
+smallest one handed over, with its count as the error bound, when an
+unseen poll arrives. Counts halve every ``DECAY`` seconds so the sketch
+follows current traffic.
+
+The ``TOP`` polls whose guaranteed count (count minus error) reaches
+``MIN_HITS`` are hot. For a hot poll, values passed through ``pinned()``
+are recomputed at most once per ``INTERVAL`` seconds whatever the request
+fan-in. One thread recomputes and the others keep serving the previous
+value meanwhile. The vote version behind fragment and page cache keys and
+the counts the ``VoteLoader`` hands out are pinned this way, so a hot
+poll's results lag its votes by at most ``INTERVAL``. The request that
+casts a vote reads its poll unpinned, so its response shows the vote;
+the voter's next page may not, for up to ``INTERVAL``.
+
+    POLLS_HOT_POLLS = {'CAPACITY': 256, 'TOP': 10, 'MIN_HITS': 50, 'INTERVAL': 1.0, 'DECAY': 60}
+
+``MIN_HITS`` = 0 turns pinning off; the sketch still runs. The current
+top polls are reported under the ``hot_polls`` metric.
+"""
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+
+
+class SpaceSaving:
+    """Approximate top-k counter over a stream of keys in fixed space"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+
+    def add(self, key):
+        self.total += 1
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+            self.errors[key] = 0
+        else:
+            # O(capacity), and only on a miss; hot keys take the branch above
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[key] = floor + 1
+            self.errors[key] = floor
+
+    def decay(self):
+        """Halve every count, dropping keys that reach zero"""
+        for key in list(self.counts):
+            self.counts[key] //= 2
+            self.errors[key] //= 2
+            if not self.counts[key]:
+                del self.counts[key], self.errors[key]
+        self.total //= 2
+
+    def top(self, n):
+        """[(key, count, error)] of the n largest counts, largest first"""
+        return [(key, count, self.errors[key])
+                for key, count in heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])]
+
+
+class _Pin:
+    __slots__ = ('value', 'computed_at', 'lock')
+
+    def __init__(self):
+        self.value = None
+        self.computed_at = None
+        self.lock = threading.Lock()
+
+
+class HotPolls:
+    def __init__(self, capacity=256, top=10, min_hits=50, interval=1.0, decay=60):
+        self.sketch = SpaceSaving(capacity)
+        self.top_n = top
+        self.min_hits = min_hits
+        self.interval = interval
+        self.decay_every = decay
+        self._lock = threading.Lock()
+        self._hot = frozenset()
+        self._hot_at = self._decayed_at = time.monotonic()
+        self._pins = {}    # (poll_id, name) -> _Pin
+        self.recomputes = self.pinned_hits = 0
+
+    def record(self, poll_id):
+        """Count one request for a poll"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decayed_at > self.decay_every:
+                self.sketch.decay()
+                self._decayed_at = now
+            self.sketch.add(int(poll_id))
+
+    def hot(self):
+        """Ids of the hot polls, re-ranked at most once per interval"""
+        if time.monotonic() - self._hot_at > self.interval:
+            self.rank()
+        return self._hot
+
+    def rank(self):
+        """Pick the hot polls from the sketch now; pins of polls that cooled down go"""
+        with self._lock:
+            self._hot = frozenset(
+                key for key, count, error in self.sketch.top(self.top_n)
+                if self.min_hits and count - error >= self.min_hits
+            )
+            self._hot_at = time.monotonic()
+            for key in [key for key in list(self._pins) if key[0] not in self._hot]:
+                self._pins.pop(key, None)
+
+    def pinned(self, poll_id, name, compute):
+        """compute(), held for up to an interval if the poll is hot"""
+        if poll_id not in self.hot():
+            return compute()
+        pin = self._pins.get((poll_id, name))
+        if pin is None:
+            pin = self._pins.setdefault((poll_id, name), _Pin())
+        if pin.computed_at is not None and time.monotonic() - pin.computed_at < self.interval:
+            self.pinned_hits += 1
+            return pin.value
+        # Someone else is recomputing: serve what they are replacing
+        if not pin.lock.acquire(blocking=pin.computed_at is None):
+            self.pinned_hits += 1
+            return pin.value
+        try:
+            if pin.computed_at is None or time.monotonic() - pin.computed_at >= self.interval:
+                pin.value = compute()
+                pin.computed_at = time.monotonic()
+                self.recomputes += 1
+            else:
+                self.pinned_hits += 1
+            return pin.value
+        finally:
+            pin.lock.release()
+
+    def unpin(self, poll_id):
+        """Drop a poll's pinned values (after it was edited)"""
+        for key in [key for key in list(self._pins) if key[0] == poll_id]:
+            self._pins.pop(key, None)
+
+    def stats(self):
+        hot = self.hot()
+        with self._lock:
+            top = self.sketch.top(self.top_n)
+            total = self.sketch.total
+        return {
+            'top': [{'poll': key, 'hits': count, 'error': error, 'hot': key in hot} for key, count, error in top],
+            'requests': total,
+            'tracked': len(self.sketch.counts),
+            'pinned': len(self._pins),
+            'recomputes': self.recomputes,
+            'pinned_hits': self.pinned_hits,
+        }
+
+
+_hot_polls = None
+_hot_polls_lock = threading.Lock()
+
+
+def hot_polls():
+    """This process's tracker, configured from POLLS_HOT_POLLS on first use"""
+    global _hot_polls
+    if _hot_polls is None:
+        with _hot_polls_lock:
+            if _hot_polls is None:
+                config = getattr(settings, 'POLLS_HOT_POLLS', {})
+                _hot_polls = HotPolls(
+                    capacity=config.get('CAPACITY', 256),
+                    top=config.get('TOP', 10),
+                    min_hits=config.get('MIN_HITS', 50),
+                    interval=config.get('INTERVAL', 1.0),
+                    decay=config.get('DECAY', 60),
+                )
+    return _hot_polls
+
+
+class HotPollMixin:
+    """Count requests to a poll view (the poll's id is the ``pk`` URL kwarg)"""
+
+    def dispatch(self, request, *args, **kwargs):
+        hot_polls().record(kwargs['pk'])
+        return super().dispatch(request, *args, **kwargs)
+
+
+@receiver(setting_changed)
+def reset_hot_polls(setting, **kwargs):
+    global _hot_polls
+    if setting == 'POLLS_HOT_POLLS':
+        _hot_polls = None
+
+
+metrics.register('hot_polls', lambda: hot_polls().stats())
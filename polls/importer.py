@@ -0,0 +1,200 @@
+"""
+Streaming batch import of polls with their choices and tags.
+
+Input is a JSON array of poll records or NDJSON (one record per line):
+
+    {"title": "...", "description": "...", "choices": ["A", "B"],
+     "tags": ["food"], "is_active": true}
+
+Records are validated one by one with ``PollImportForm`` and written in
+batches: polls, choices, tags and tag links each take a single set-based
+statement per batch, inside one transaction. Every record gets a report.
+A malformed element of an array is reported on its own and reading
+resumes after it.
+"""
+import json
+import re
+from itertools import islice
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.functions import Lower
+from taggit.models import Tag, TaggedItem
+
+from .cache import bump_list_generation
+from .forms import PollImportForm
+from .models import Poll, Choice
+
+READ_SIZE = 64 * 1024
+
+
+class RecordError(ValueError):
+    """A record that could not even be parsed"""
+
+
+def iter_records(stream):
+    """Yield records from a text stream holding a JSON array or NDJSON"""
+    head = stream.read(READ_SIZE)
+    if head.lstrip().startswith('['):
+        yield from _iter_array(stream, head.lstrip()[1:])
+    else:
+        yield from _iter_lines(stream, head)
+
+
+def _iter_lines(stream, head):
+    buffer = head
+    while True:
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line)
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+    if buffer.strip():
+        yield _parse_line(buffer)
+
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as exc:
+        return RecordError(f"Invalid JSON: {exc}")
+
+
+def _iter_array(stream, buffer):
+    decoder = json.JSONDecoder()
+    eof = False
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as exc:
+            boundary = _element_end(buffer)
+            if boundary is None and not eof:
+                chunk = stream.read(READ_SIZE)
+                eof = not chunk
+                buffer += chunk
+                continue
+            # Malformed: report this element and resume at the next one
+            yield RecordError(f"Invalid JSON: {exc}")
+            if boundary is None:
+                return
+            buffer = buffer[boundary:]
+            continue
+        yield record
+        buffer = buffer[end:]
+
+
+# Strings (cut short at a newline or the end of the buffer) and the characters that nest
+_STRUCTURE = re.compile(r'"(?:[^"\\\n]|\\.)*(?:"|(?=\n)|\Z)|[][{},]')
+
+
+def _element_end(buffer):
+    """Offset of the top-level ',' or ']' ending the array element buffer starts with, or None"""
+    depth = 0
+    for match in _STRUCTURE.finditer(buffer):
+        token = match.group()
+        if token in '[{':
+            depth += 1
+        elif token in ']}':
+            if not depth and token == ']':
+                return match.start()
+            depth = max(depth - 1, 0)
+        elif token == ',' and not depth:
+            return match.start()
+    return None
+
+
+class PollImporter:
+    def __init__(self, user, batch_size=500):
+        self.user = user
+        self.batch_size = batch_size
+
+    def run(self, records):
+        """Import records, yielding one report dict per record in input order"""
+        numbered = enumerate(records, start=1)
+        while batch := list(islice(numbered, self.batch_size)):
+            yield from self.import_batch(batch)
+
+    def import_batch(self, batch):
+        reports, valid = {}, []
+        for number, record in batch:
+            cleaned, errors = self.validate(record)
+            if errors:
+                reports[number] = {'record': number, 'status': 'error', 'errors': errors}
+            else:
+                valid.append((number, cleaned))
+
+        if valid:
+            try:
+                with transaction.atomic():
+                    polls = self.create(cleaned for _, cleaned in valid)
+            except Exception as exc:
+                for number, _ in valid:
+                    reports[number] = {'record': number, 'status': 'error',
+                                       'errors': {'__all__': [str(exc)]}}
+            else:
+                bump_list_generation()
+                for (number, _), poll in zip(valid, polls):
+                    reports[number] = {'record': number, 'status': 'created', 'id': poll.pk}
+
+        return [reports[number] for number, _ in batch]
+
+    def validate(self, record):
+        """(cleaned data, None) for a valid record, otherwise (None, errors)"""
+        if isinstance(record, RecordError):
+            return None, {'__all__': [str(record)]}
+        if not isinstance(record, dict):
+            return None, {'__all__': ["Expected a JSON object."]}
+        form = PollImportForm({'is_active': True, **record})
+        if not form.is_valid():
+            return None, {field: list(errors) for field, errors in form.errors.items()}
+        return form.cleaned_data, None
+
+    def create(self, records):
+        records = list(records)
+        polls = Poll.objects.bulk_create([
+            Poll(title=data['title'], description=data['description'],
+                 is_active=data['is_active'], created_by=self.user)
+            for data in records
+        ])
+        Choice.objects.bulk_create([
+            Choice(poll=poll, text=text)
+            for poll, data in zip(polls, records) for text in data['choices']
+        ])
+
+        tags = self.get_tags({name for data in records for name in data['tags']})
+        poll_type = ContentType.objects.get_for_model(Poll)
+        TaggedItem.objects.bulk_create([
+            TaggedItem(content_type=poll_type, object_id=poll.pk, tag=tags[name.lower()])
+            for poll, data in zip(polls, records)
+            for name in {name.lower(): name for name in data['tags']}.values()
+        ])
+        return polls
+
+    def get_tags(self, names):
+        """{lowercased name: Tag}, creating missing tags (names match case-insensitively)"""
+        if not names:
+            return {}
+        wanted = {name.lower(): name for name in names}
+
+        def existing():
+            return {
+                tag.lname: tag for tag in
+                Tag.objects.annotate(lname=Lower('name')).filter(lname__in=list(wanted))
+            }
+
+        tags = existing()
+        missing = [Tag(name=name, slug=Tag().slugify(name))
+                   for lname, name in wanted.items() if lname not in tags]
+        if missing:
+            Tag.objects.bulk_create(missing, ignore_conflicts=True)
+            tags = existing()
+            # Slug collisions between different names: let taggit pick a slug
+            for lname in set(wanted) - set(tags):
+                tags[lname] = Tag.objects.create(name=wanted[lname])
+        return tags
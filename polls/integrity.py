@@ -0,0 +1,195 @@
+"""
+Vote integrity checks, run in parallel over ranges of polls.
+
+``manage.py verify_votes`` splits the polls into id ranges and checks each
+range in a process pool; every worker opens its own database connection.
+For each range it looks for:
+
+* duplicates: more than one vote by a user in one poll
+* counters: counter shards whose sum differs from the vote rows (only when
+  ``VOTE_COUNTER_SHARDS`` is on)
+
+Votes point at their choice through a generic key with no foreign key, so
+deleting a choice leaves its votes behind. Orphans (votes and counter rows
+whose choice is gone) are found by separate tasks over ranges of
+``Vote.object_id``.
+
+With ``repair``, duplicates keep the user's newest vote, orphaned votes
+go, and counters are corrected with relative updates. Removed votes get a
+retract event, so ``replay_vote_events`` doesn't bring them back, and a
+tombstone like the ``post_delete`` hook writes. Deletes run in batches,
+each a single DELETE with the events and tombstones inserted in bulk.
+Counts read while people vote can look off by a vote or two; run repairs
+while the site is quiet.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+
+from .models import Choice, Poll
+from .voting import (
+    Vote, VoteCounterShard, VoteEvent, VoteTombstone, bump_counter, counter_shards, delete_vote_rows,
+)
+
+POLLS = 'polls'
+ORPHANS = 'orphans'
+
+
+def plan(range_size=1000):
+    """[(kind, lo, hi)]: poll id ranges of range_size polls, then as many vote object_id ranges"""
+    tasks = []
+    pks = Poll.objects.order_by('pk').values_list('pk', flat=True)
+    bounds = [pk for i, pk in enumerate(pks.iterator(chunk_size=10_000)) if i % range_size == 0]
+    last = Poll.objects.aggregate(m=Max('pk'))['m']
+    for lo, hi in zip(bounds, bounds[1:] + [(last or 0) + 1]):
+        tasks.append((POLLS, lo, hi))
+
+    ct = ContentType.objects.get_for_model(Choice)
+    span = Vote.objects.filter(content_type=ct).aggregate(lo=Min('object_id'), hi=Max('object_id'))
+    if span['lo'] is not None:
+        step = -(-(span['hi'] + 1 - span['lo']) // max(len(tasks), 1))
+        for lo in range(span['lo'], span['hi'] + 1, step):
+            tasks.append((ORPHANS, lo, min(lo + step, span['hi'] + 1)))
+    return tasks
+
+
+def verify(task, repair=False, batch_size=1000):
+    """
+    Check one task's range; returns a report dict.
+
+    ``{'task', 'duplicates', 'counters', 'orphans', 'repaired', 'polls'}``,
+    where ``polls`` are the ids whose votes a repair changed.
+    """
+    kind, lo, hi = task
+    report = {'task': task, 'duplicates': 0, 'counters': 0, 'orphans': 0, 'repaired': repair, 'polls': []}
+    ct = ContentType.objects.get_for_model(Choice)
+    if kind == ORPHANS:
+        report['orphans'] = _orphans(ct, lo, hi, repair, batch_size)
+        return report
+
+    choice_polls = dict(
+        Choice.objects.filter(poll_id__gte=lo, poll_id__lt=hi).order_by().values_list('pk', 'poll_id')
+    )
+    report['duplicates'], touched = _duplicates(ct, lo, hi, choice_polls, repair, batch_size)
+    if counter_shards():
+        report['counters'] = _counters(ct, choice_polls, repair)
+    report['polls'] = sorted(touched)
+    return report
+
+
+def _duplicates(ct, lo, hi, choice_polls, repair, batch_size):
+    """Extra votes (beyond one per user and poll) in the range, and the polls they were in"""
+    votes = Vote.objects.filter(content_type=ct, object_id__in=Choice.objects.filter(
+        poll_id__gte=lo, poll_id__lt=hi).values('pk'))
+    groups = list(
+        votes.annotate(poll_id=Subquery(Choice.objects.filter(pk=OuterRef('object_id')).values('poll_id')))
+        .values('user_id', 'poll_id').annotate(n=Count('id')).filter(n__gt=1).order_by()
+        .values_list('user_id', 'poll_id', 'n')
+    )
+    extra = sum(n - 1 for _, _, n in groups)
+    if not repair or not groups:
+        return extra, set()
+
+    keep, losers = {}, []
+    candidates = votes.filter(
+        user_id__in={user_id for user_id, _, _ in groups},
+        object_id__in=[pk for pk, poll_id in choice_polls.items() if poll_id in {p for _, p, _ in groups}],
+    ).order_by('-created_at', '-id').values_list('id', 'user_id', 'object_id', 'created_at')
+    wanted = {(user_id, poll_id) for user_id, poll_id, _ in groups}
+    for pk, user_id, object_id, created_at in candidates:
+        key = (user_id, choice_polls[object_id])
+        if key not in wanted:
+            continue
+        if key in keep:
+            losers.append((pk, user_id, object_id, created_at))
+        else:
+            keep[key] = pk
+    _remove(ct, losers, batch_size)
+    return extra, {poll_id for _, poll_id in wanted}
+
+
+def _counters(ct, choice_polls, repair):
+    """Choices whose counter shards don't add up to their votes"""
+    ids = list(choice_polls)
+    votes = dict(
+        Vote.objects.filter(content_type=ct, object_id__in=ids)
+        .values('object_id').annotate(n=Count('id')).order_by().values_list('object_id', 'n')
+    )
+    shards = dict(
+        VoteCounterShard.objects.filter(content_type=ct, object_id__in=ids)
+        .values('object_id').annotate(n=Sum('count')).order_by().values_list('object_id', 'n')
+    )
+    off = {pk: votes.get(pk, 0) - shards.get(pk, 0) for pk in ids if votes.get(pk, 0) != shards.get(pk, 0)}
+    if repair:
+        with transaction.atomic():
+            for pk, delta in off.items():
+                bump_counter(ct, pk, delta, shard=0)
+    return len(off)
+
+
+def _orphans(ct, lo, hi, repair, batch_size):
+    """Votes in the object_id range whose choice is gone; their counter rows go too on repair"""
+    choices = Choice.objects.filter(pk__gte=lo, pk__lt=hi).values('pk')
+    votes = Vote.objects.filter(content_type=ct, object_id__gte=lo, object_id__lt=hi).exclude(object_id__in=choices)
+    if not repair:
+        return votes.count()
+    orphans = list(votes.values_list('id', 'user_id', 'object_id', 'created_at'))
+    _remove(ct, orphans, batch_size)
+    VoteCounterShard.objects.filter(
+        content_type=ct, object_id__gte=lo, object_id__lt=hi
+    ).exclude(object_id__in=choices).delete()
+    return len(orphans)
+
+
+def _remove(ct, votes, batch_size):
+    """
+    Delete (id, user_id, object_id, created_at) votes in batches.
+    
+    Each batch is one DELETE plus bulk inserts of the retract events and
+    tombstones, and a counter update per choice.
+    """
+    for start in range(0, len(votes), batch_size):
+        batch = votes[start:start + batch_size]
+        removed = {}
+        for _, _, object_id, _ in batch:
+            removed[object_id] = removed.get(object_id, 0) + 1
+        with transaction.atomic():
+            VoteEvent.objects.bulk_create([
+                VoteEvent(kind=VoteEvent.RETRACT, user_id=user_id, content_type=ct, object_id=object_id)
+                for _, user_id, object_id, _ in batch
+            ])
+            delete_vote_rows([pk for pk, _, _, _ in batch])
+            VoteTombstone.objects.bulk_create([
+                VoteTombstone(content_type=ct, object_id=object_id, vote_created_at=created_at)
+                for _, _, object_id, created_at in batch
+            ])
+            if counter_shards():
+                for object_id, n in removed.items():
+                    bump_counter(ct, object_id, -n, shard=0)
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # Forked workers inherit the parent's connection objects; start afresh
+    connections.close_all()
+
+
+def run(tasks, workers=4, repair=False, batch_size=1000):
+    """
+    Yield one report per task as tasks finish.
+
+    ``workers`` <= 1 checks inline, in this process and its transaction.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield verify(task, repair, batch_size)
+        return
+    # No connection may be open across the fork: children would share its socket
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = [pool.submit(verify, task, repair, batch_size) for task in tasks]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,212 @@
+"""
+A small DB-backed job queue - no broker needed.
+
+    @job('recompute_poll')
+    def recompute_poll(poll_id): ...
+
+    enqueue('recompute_poll', poll_id=42)
+
+Pending jobs with the same name and arguments coalesce into one (a partial
+unique index enforces it). ``manage.py run_jobs`` claims due jobs with a
+conditional UPDATE, so any number of workers can share the table, runs them
+on a thread or process pool, retries failures with exponential backoff and
+records how long each attempt took. Periodic jobs are listed in the
+``POLLS_JOB_SCHEDULE`` setting as ``{name: seconds}``.
+"""
+import json
+import logging
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Avg, Count, F, Max
+from django.utils import timezone
+
+from . import metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def job(name, max_attempts=3):
+    """Register a function as a job"""
+    def register(fn):
+        registry[name] = fn
+        fn.max_attempts = max_attempts
+        return fn
+    return register
+
+
+def dedupe_key(name, kwargs):
+    return f"{name}:{json.dumps(kwargs, sort_keys=True, default=str)}"[:255]
+
+
+def enqueue(name, run_at=None, **kwargs):
+    """Queue a job, or return the pending job it coalesces with"""
+    key = dedupe_key(name, kwargs)
+    fn = registry.get(name)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                name=name, args=kwargs, dedupe_key=key,
+                run_at=run_at or timezone.now(),
+                max_attempts=getattr(fn, 'max_attempts', 3),
+            )
+    except IntegrityError:
+        return Job.objects.get(dedupe_key=key, status=Job.PENDING)
+
+
+def schedule_periodic(now=None):
+    """Enqueue every scheduled job whose interval has elapsed since it was last queued"""
+    now = now or timezone.now()
+    for name, every in getattr(settings, 'POLLS_JOB_SCHEDULE', {}).items():
+        recent = Job.objects.filter(name=name, created_at__gt=now - timedelta(seconds=every))
+        if not recent.exists():
+            enqueue(name)
+
+
+def claim():
+    """Atomically take the next due job, or None"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.PENDING, run_at__lte=now).order_by('run_at')
+    for pk in due.values_list('pk', flat=True)[:20]:
+        taken = Job.objects.filter(pk=pk, status=Job.PENDING).update(
+            status=Job.RUNNING, started_at=now, attempts=F('attempts') + 1,
+        )
+        if taken:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def requeue_stale(older_than):
+    """Return jobs stuck in 'running' (their worker died) to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    requeued = 0
+    for stale in Job.objects.filter(status=Job.RUNNING, started_at__lt=cutoff):
+        requeued += _retry_or_fail(stale, 'Worker lost while running', backoff=False)
+    return requeued
+
+
+def run_job(pk):
+    """Run one claimed job, returning (name, succeeded, seconds)"""
+    current = Job.objects.get(pk=pk)
+    started = time.perf_counter()
+    try:
+        registry[current.name](**current.args)
+    except Exception:
+        current.duration = time.perf_counter() - started
+        _retry_or_fail(current, traceback.format_exc())
+        return current.name, False, current.duration
+    current.duration = time.perf_counter() - started
+    current.status = Job.DONE
+    current.finished_at = timezone.now()
+    current.save(update_fields=['status', 'finished_at', 'duration'])
+    return current.name, True, current.duration
+
+
+def _run_pooled(pk):
+    # Pool threads and processes each hold their own connection; don't leak it
+    try:
+        return run_job(pk)
+    finally:
+        connections.close_all()
+
+
+def _retry_or_fail(current, error, backoff=True):
+    current.last_error = error
+    current.finished_at = timezone.now()
+    if current.attempts >= current.max_attempts:
+        current.status = Job.FAILED
+        current.save()
+        logger.error("Job %s failed after %d attempts", current, current.attempts)
+        return 0
+    current.status = Job.PENDING
+    current.run_at = timezone.now() + timedelta(seconds=2 ** current.attempts if backoff else 0)
+    try:
+        with transaction.atomic():
+            current.save()
+    except IntegrityError:
+        # An identical job was queued meanwhile; let that one do the work
+        current.status = Job.DONE
+        current.last_error += "\nCoalesced into a newer pending duplicate."
+        current.save()
+    return 1
+
+
+def stats():
+    """Per job name: counts by status and attempt timings"""
+    report = {}
+    rows = Job.objects.values('name', 'status').annotate(
+        n=Count('id'), mean=Avg('duration'), slowest=Max('duration')
+    ).order_by()
+    for row in rows:
+        entry = report.setdefault(row['name'], {'mean_seconds': None, 'max_seconds': None})
+        entry[row['status']] = row['n']
+        if row['status'] == Job.DONE:
+            entry['mean_seconds'] = round(row['mean'] or 0, 4)
+            entry['max_seconds'] = round(row['slowest'] or 0, 4)
+    return report
+
+
+metrics.register('jobs', stats)
+
+
+class Worker:
+    """
+    Claims due jobs and feeds them to a thread or process pool.
+
+    ``mode='inline'`` runs each job in the calling thread, which is what tests
+    and one-off debugging want.
+    """
+
+    def __init__(self, concurrency=2, mode='thread', poll_interval=1.0, stale_after=3600, log=None):
+        self.concurrency = concurrency
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.log = log or (lambda message: None)
+
+    def run(self, once=False):
+        """Process jobs until interrupted (or, with once, until nothing is due)"""
+        requeue_stale(self.stale_after)
+        if self.mode == 'inline':
+            return self._run_inline(once)
+        if self.mode == 'process':
+            # Forked children must open their own connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(self.concurrency, initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(self.concurrency)
+
+        running = set()
+        with pool:
+            while True:
+                schedule_periodic()
+                while len(running) < self.concurrency and (claimed := claim()):
+                    running.add(pool.submit(_run_pooled, claimed.pk))
+                if not running:
+                    if once:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+                done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self._report(*future.result())
+
+    def _run_inline(self, once):
+        while True:
+            schedule_periodic()
+            while claimed := claim():
+                self._report(*run_job(claimed.pk))
+            if once:
+                return
+            time.sleep(self.poll_interval)
+
+    def _report(self, name, ok, seconds):
+        self.log(f"{name}: {'ok' if ok else 'error'} in {seconds * 1000:.1f}ms")
@@ -0,0 +1,280 @@
+"""
+Batch sync of votes collected offline by polling kiosks.
+
+Kiosks queue votes while offline and upload them in bursts as NDJSON (or a
+JSON array), one record per vote:
+
+    {"client_vote_id": "kiosk7-000123", "user": 42, "poll": 5, "choice": 17,
+     "timestamp": "2025-05-01T14:03:11Z"}
+
+``user`` is a user id or username. ``timestamp`` is when the kiosk took the
+vote, and defaults to now.
+
+Each ``client_vote_id`` is applied once: re-uploads after a dropped
+connection are reported as duplicates. Per (user, poll), the latest vote
+wins. It wins within the upload, and against the standing vote unless that
+one is newer. Only single-choice polls are supported.
+
+Records are processed in chunks. Each chunk is validated in memory, then
+applied in one transaction with a fixed number of set-based statements
+(bulk inserts and updates, plus one counter bump per choice touched),
+however many records it holds. Every record gets a status line back, in
+input order.
+"""
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import readmodel
+from .cache import bump_list_generation, bump_vote_version
+from .choicecache import choice_cache
+from .importer import RecordError
+from .loaders import VoteLoader
+from .models import Choice, ClientVote, Poll
+from .voting import Vote, VoteEvent, VoteTombstone, bump_counter, counter_shards
+
+DUPLICATE = 'duplicate'
+ERROR = 'error'
+
+
+class KioskSync:
+    def __init__(self, uploaded_by, batch_size=500):
+        self.uploaded_by = uploaded_by
+        self.batch_size = batch_size
+        self.ct = ContentType.objects.get_for_model(Choice)
+
+    def run(self, records):
+        """Apply records, yielding one status dict per record in input order"""
+        numbered = enumerate(records, start=1)
+        while batch := list(islice(numbered, self.batch_size)):
+            yield from self.sync_batch(batch)
+
+    def sync_batch(self, batch):
+        reports, parsed = {}, []
+        for number, record in batch:
+            cleaned, error = self.parse(record)
+            if error:
+                reports[number] = _report(number, record, ERROR, error)
+            else:
+                parsed.append((number, cleaned))
+
+        valid = []
+        for (number, data), error in zip(parsed, self.check(data for _, data in parsed)):
+            if error:
+                reports[number] = _report(number, data, ERROR, error)
+            else:
+                valid.append((number, data))
+
+        if valid:
+            # Uploads touching the same polls queue on the poll rows (see apply);
+            # should a constraint still trip, the retry sees the rows and adapts
+            for attempt in range(2):
+                try:
+                    with transaction.atomic():
+                        statuses, touched = self.apply(valid)
+                    break
+                except IntegrityError as exc:
+                    if attempt:
+                        statuses, touched = dict.fromkeys((number for number, _ in valid), ERROR), set()
+                        failure = str(exc)
+            for number, data in valid:
+                error = failure if statuses[number] == ERROR else None
+                reports[number] = _report(number, data, statuses[number], error)
+            self.announce(touched)
+
+        return [reports[number] for number, _ in batch]
+
+    def parse(self, record):
+        """(cleaned record, None), or (None, error message)"""
+        if isinstance(record, RecordError):
+            return None, str(record)
+        if not isinstance(record, dict):
+            return None, "Expected a JSON object."
+        client_vote_id = record.get('client_vote_id')
+        if not isinstance(client_vote_id, str) or not 0 < len(client_vote_id) <= 64:
+            return None, "client_vote_id must be a string of 1 to 64 characters."
+        user = record.get('user')
+        if not isinstance(user, (int, str)) or isinstance(user, bool) or user == '':
+            return None, "user must be a user id or username."
+        if not all(isinstance(record.get(key), int) and not isinstance(record.get(key), bool)
+                   for key in ('poll', 'choice')):
+            return None, "poll and choice must be ids."
+
+        now = timezone.now()
+        voted_at = record.get('timestamp')
+        if voted_at is None:
+            voted_at = now
+        else:
+            voted_at = parse_datetime(voted_at) if isinstance(voted_at, str) else None
+            if voted_at is None:
+                return None, "timestamp must be an ISO 8601 date and time."
+            if timezone.is_naive(voted_at):
+                voted_at = timezone.make_aware(voted_at)
+            # A kiosk clock running fast must not win every later conflict
+            voted_at = min(voted_at, now)
+        return {'client_vote_id': client_vote_id, 'user': user, 'poll': record['poll'],
+                'choice': record['choice'], 'voted_at': voted_at}, None
+
+    def check(self, records):
+        """Resolve users and choices in two queries; yields an error or None per record"""
+        records = list(records)
+        ids = {r['user'] for r in records if isinstance(r['user'], int)}
+        names = {r['user'] for r in records if isinstance(r['user'], str)}
+        users = {}
+        if ids or names:
+            for pk, username in User.objects.filter(
+                Q(pk__in=ids) | Q(username__in=names)
+            ).values_list('pk', 'username'):
+                users[pk] = users[username] = pk
+        choices = {
+            pk: (poll_id, is_active, poll_type) for pk, poll_id, is_active, poll_type in
+            Choice.objects.filter(pk__in={r['choice'] for r in records})
+            .values_list('pk', 'poll_id', 'poll__is_active', 'poll__poll_type')
+        }
+        for record in records:
+            record['user'] = users.get(record['user'])
+            poll_id, is_active, poll_type = choices.get(record['choice'], (None, None, None))
+            if record['user'] is None:
+                yield "Unknown user."
+            elif poll_id != record['poll']:
+                yield "Unknown choice for this poll."
+            elif not is_active:
+                yield "Poll is closed."
+            elif poll_type != Poll.SINGLE:
+                yield "Only single-choice polls can be synced."
+            else:
+                yield None
+
+    def apply(self, valid):
+        """
+        Write one chunk; returns ({record number: status}, {(user_id, poll_id) whose vote moved}).
+
+        Runs inside the caller's transaction. Locking the polls first makes
+        concurrent uploads for them take turns, so two kiosks can't both
+        cast a voter's vote on different choices: no constraint would catch
+        that. Web votes don't take the lock; one racing a cast on another
+        choice of the poll can leave two votes, which ``verify_votes
+        --repair`` settles in favour of the newer.
+        """
+        list(Poll.objects.select_for_update().filter(pk__in={data['poll'] for _, data in valid})
+             .order_by('pk').values_list('pk', flat=True))
+        statuses = {}
+        known = set(
+            ClientVote.objects.filter(client_vote_id__in=[data['client_vote_id'] for _, data in valid])
+            .values_list('client_vote_id', flat=True)
+        )
+        groups = {}
+        for number, data in valid:
+            if data['client_vote_id'] in known:
+                statuses[number] = DUPLICATE
+                continue
+            known.add(data['client_vote_id'])
+            groups.setdefault((data['user'], data['poll']), []).append((number, data))
+        if not groups:
+            return statuses, set()
+
+        user_ids = {user_id for user_id, _ in groups}
+        poll_ids = {poll_id for _, poll_id in groups}
+        choice_polls = dict(Choice.objects.filter(poll_id__in=poll_ids).values_list('pk', 'poll_id'))
+        standing = {
+            (vote.user_id, choice_polls[vote.object_id]): vote
+            for vote in Vote.objects.select_for_update().filter(
+                content_type=self.ct, user_id__in=user_ids, object_id__in=list(choice_polls)
+            )
+        }
+        synced = {
+            (user_id, poll_id): (voted_at, received_at)
+            for user_id, poll_id, voted_at, received_at in
+            ClientVote.objects.filter(user_id__in=user_ids, poll_id__in=poll_ids, status=ClientVote.APPLIED)
+            .order_by('received_at').values_list('user_id', 'poll_id', 'voted_at', 'received_at')
+        }
+
+        now = timezone.now()
+        casts, changes, tombstones, events, ledger = [], [], [], [], []
+        deltas, touched = {}, set()
+        for key, entries in groups.items():
+            number, winner = max(entries, key=lambda entry: (entry[1]['voted_at'], entry[0]))
+            for other, _ in entries:
+                statuses[other] = ClientVote.SUPERSEDED
+            vote = standing.get(key)
+            if vote is not None and vote.object_id == winner['choice']:
+                status = ClientVote.UNCHANGED
+            elif vote is not None and winner['voted_at'] < self.standing_since(vote, synced.get(key)):
+                status = ClientVote.STALE
+            elif vote is not None:
+                status = ClientVote.APPLIED
+                tombstones.append(VoteTombstone(content_type=self.ct, object_id=vote.object_id,
+                                                vote_created_at=vote.created_at))
+                events.append(VoteEvent(kind=VoteEvent.CHANGE, user_id=key[0], content_type=self.ct,
+                                        object_id=winner['choice'], previous_object_id=vote.object_id,
+                                        created_at=now))
+                deltas[vote.object_id] = deltas.get(vote.object_id, 0) - 1
+                touched.add((key[0], key[1]))
+                vote.object_id, vote.created_at = winner['choice'], now
+                changes.append(vote)
+            else:
+                status = ClientVote.APPLIED
+                casts.append(Vote(user_id=key[0], content_type=self.ct, object_id=winner['choice'], created_at=now))
+                events.append(VoteEvent(kind=VoteEvent.CAST, user_id=key[0], content_type=self.ct,
+                                        object_id=winner['choice'], created_at=now))
+                touched.add((key[0], key[1]))
+            if status == ClientVote.APPLIED:
+                deltas[winner['choice']] = deltas.get(winner['choice'], 0) + 1
+            statuses[number] = status
+            for entry_number, data in entries:
+                ledger.append(ClientVote(
+                    client_vote_id=data['client_vote_id'], user_id=key[0], poll_id=key[1],
+                    choice_id=data['choice'], voted_at=data['voted_at'], status=statuses[entry_number],
+                    uploaded_by=self.uploaded_by, received_at=now,
+                ))
+
+        Vote.objects.bulk_create(casts)
+        Vote.objects.bulk_update(changes, ['object_id', 'created_at'])
+        VoteTombstone.objects.bulk_create(tombstones)
+        VoteEvent.objects.bulk_create(events)
+        ClientVote.objects.bulk_create(ledger)
+        if counter_shards():
+            for choice_id, delta in deltas.items():
+                if delta:
+                    bump_counter(self.ct, choice_id, delta)
+        return statuses, touched
+
+    @staticmethod
+    def standing_since(vote, synced):
+        """When the standing vote was cast: its kiosk time if a sync wrote it, else its row time"""
+        if synced is not None:
+            voted_at, received_at = synced
+            if received_at >= vote.created_at:
+                return voted_at
+        return vote.created_at
+
+    def announce(self, touched):
+        """The cache invalidation a vote's signal does, once per chunk"""
+        if not touched:
+            return
+        polls = {poll_id for _, poll_id in touched}
+        for poll_id in polls:
+            bump_vote_version(poll_id)
+        bump_list_generation()
+        shared = choice_cache()
+        if shared.enabled:
+            shared.invalidate(touched)
+        readmodel.expire()
+        loader = VoteLoader.current()
+        if loader:
+            for poll_id in polls:
+                loader.forget(poll_id)
+
+
+def _report(number, record, status, error=None):
+    report = {'record': number, 'status': status}
+    if isinstance(record, dict) and isinstance(record.get('client_vote_id'), str):
+        report['client_vote_id'] = record['client_vote_id']
+    if error:
+        report['error'] = error
+    return report
@@ -0,0 +1,162 @@
+"""
+Request-scoped, DataLoader-style vote lookups.
+
+``VoteLoaderMiddleware`` gives every request one ``VoteLoader``. Polls can
+be queued with ``want()``; the first lookup then fetches counts for every
+queued poll in one batch, and every later lookup in the request is served
+from memory. Views, forms, components and models all reach the same loader
+through ``VoteLoader.get()``, so a page costs a constant number of queries
+no matter how many choices or cards it shows. Users' own choices are also
+kept across requests in the process-wide ``polls.choicecache``.
+"""
+import contextvars
+
+from django.contrib.contenttypes.models import ContentType
+
+from .choicecache import _MISSING, choice_cache
+from .hotpolls import hot_polls
+from .voting import Vote, tally_counts
+
+_current = contextvars.ContextVar('vote_loader', default=None)
+
+
+class VoteLoader:
+    def __init__(self):
+        self._pending = set()
+        self._counts = {}          # poll_id -> {choice_id: count}
+        self._user_choices = {}    # (user_id, poll_id) -> choice_id or None
+        self._shared = None        # the process's ChoiceCache, once synced
+        self._voted = set()        # polls voted in during this request; never read pinned
+
+    @classmethod
+    def current(cls):
+        """The loader of the request being served, if any"""
+        return _current.get()
+
+    @classmethod
+    def get(cls):
+        """The request's loader, or a throwaway one outside a request"""
+        return _current.get() or cls()
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+    def want(self, polls):
+        """Queue polls so the next lookup loads them all in one batch"""
+        self._pending.update(poll.pk for poll in polls if poll.pk not in self._counts)
+
+    def counts(self, poll):
+        """{choice_id: vote count} for every choice of the poll"""
+        if poll.pk not in self._counts:
+            self._pending.add(poll.pk)
+            self._load_counts()
+        return self._counts[poll.pk]
+
+    def user_choice_id(self, user, poll):
+        """Id of the choice the user voted for in this poll, or None"""
+        key = (user.pk, poll.pk)
+        if key not in self._user_choices:
+            cached = self._shared_cache().get(key)
+            if cached is not _MISSING:
+                self._user_choices[key] = cached
+                return cached
+            self._pending.add(poll.pk)
+            self._load_user_choices(user)
+        return self._user_choices[key]
+
+    def voted_poll_ids(self, user, polls):
+        """Ids of the given polls the user has voted in, in at most two queries"""
+        from .models import Ballot
+        polls = list(polls)
+        self.want(poll for poll in polls if not poll.uses_ballots)
+        voted = {poll.pk for poll in polls
+                 if not poll.uses_ballots and self.user_choice_id(user, poll)}
+        ballot_polls = [poll.pk for poll in polls if poll.uses_ballots]
+        if ballot_polls:
+            voted.update(
+                Ballot.objects.filter(user=user, poll_id__in=ballot_polls).values_list('poll_id', flat=True)
+            )
+        return voted
+    
+    def voted(self, poll_id):
+        """Note a vote in this request: the rest of it reads the poll fresh, even if hot"""
+        self._voted.add(poll_id)
+        self.forget(poll_id)
+
+    def voted_in_request(self, poll_id):
+        return poll_id in self._voted
+
+    def forget(self, poll_id):
+        """Drop memoized results for a poll after its votes changed"""
+        self._counts.pop(poll_id, None)
+        for key in [key for key in self._user_choices if key[1] == poll_id]:
+            del self._user_choices[key]
+
+    def _shared_cache(self):
+        # Catch up on other processes' invalidations once per request
+        if self._shared is None:
+            self._shared = choice_cache()
+            if self._shared.enabled:
+                self._shared.sync()
+        return self._shared
+
+    def _load_counts(self):
+        poll_ids = [pk for pk in self._pending if pk not in self._counts]
+        self._pending = set()
+
+        # Hot polls' counts are recomputed once per interval, not per request;
+        # each request gets its own copy of the shared value
+        hot = hot_polls().hot() - self._voted
+        for pk in hot.intersection(poll_ids):
+            self._counts[pk] = dict(hot_polls().pinned(pk, 'counts', lambda pk=pk: self._count_polls([pk])[pk]))
+        self._counts.update(self._count_polls([pk for pk in poll_ids if pk not in hot]))
+
+    @staticmethod
+    def _count_polls(poll_ids):
+        from .models import Choice
+        if not poll_ids:
+            return {}
+        choice_polls = dict(
+            Choice.objects.filter(poll_id__in=poll_ids).order_by().values_list('id', 'poll_id')
+        )
+        tallies = tally_counts(ContentType.objects.get_for_model(Choice), choice_polls)
+        counts = {pk: {} for pk in poll_ids}
+        for choice_id, poll_id in choice_polls.items():
+            counts[poll_id][choice_id] = tallies.get(choice_id, 0)
+        return counts
+
+    def _load_user_choices(self, user):
+        from .models import Choice
+        poll_ids = {pk for pk in self._pending | set(self._counts)
+                    if (user.pk, pk) not in self._user_choices}
+        shared = self._shared_cache()
+        since = shared.mark()
+        voted = Vote.objects.filter(
+            user=user, content_type=ContentType.objects.get_for_model(Choice)
+        ).values('object_id')
+        chosen = dict(
+            Choice.objects.filter(poll_id__in=poll_ids, pk__in=voted).order_by().values_list('poll_id', 'id')
+        )
+        loaded = {(user.pk, pk): chosen.get(pk) for pk in poll_ids}
+        self._user_choices.update(loaded)
+        if shared.enabled:
+            shared.fill(loaded, since)
+
+
+class VoteLoaderMiddleware:
+    """Scope a fresh VoteLoader to each request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.vote_loader = loader = VoteLoader()
+        token = loader.activate()
+        try:
+            return self.get_response(request)
+        finally:
+            loader.deactivate(token)
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from polls.queryplans import SCENARIOS, SNAPSHOT, check, diff, read_snapshot, write_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Explain the hot-path queries; fail on full scans, temp sorts or plans that drifted from the snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Scenarios to check (default: all of {', '.join(SCENARIOS)})")
+        parser.add_argument('--update', action='store_true', help='Rewrite the snapshot with the current plans')
+        parser.add_argument('--snapshot', default=str(SNAPSHOT), help='Snapshot file (default: polls/query_plans.json)')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database to explain against')
+        parser.add_argument('--show', action='store_true', help='Print every query and its plan')
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        vendor = connections[options['database']].vendor
+        report = check(options['scenarios'] or None, using=options['database'])
+
+        if options['show']:
+            for name, result in report.items():
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                for query in result['queries']:
+                    self.stdout.write(f"  {query['sql']}")
+                    for step in query['plan']:
+                        self.stdout.write(f"      {step}")
+
+        failures = 0
+        for name, result in report.items():
+            for problem in result['problems']:
+                self.stdout.write(self.style.ERROR(f"{name}: {problem}"))
+                failures += 1
+
+        if options['update']:
+            if failures:
+                raise CommandError(f"{failures} problems; fix them before snapshotting")
+            write_snapshot(vendor, report, options['snapshot'])
+            self.stdout.write(self.style.SUCCESS(f"Snapshot of {len(report)} scenarios written ({vendor})"))
+            return
+
+        snapshot = read_snapshot(vendor, options['snapshot'])
+        if not snapshot:
+            self.stdout.write(self.style.WARNING(f"No {vendor} snapshot yet; run with --update to record one"))
+        for name, text in diff(snapshot, report).items():
+            self.stdout.write(text)
+            failures += 1
+        if failures:
+            raise CommandError(f"{failures} query plan problems or changes")
+        self.stdout.write(self.style.SUCCESS(f"{len(report)} scenarios use their indexes as snapshotted"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from polls.voting import compact_counters, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Fold vote counter shards into one row per object (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recount every counter from the vote rows instead (not safe while voting)',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rebuild_counters()
+            self.stdout.write(self.style.SUCCESS('Rebuilt vote counters from vote rows'))
+        else:
+            folded = compact_counters()
+            self.stdout.write(self.style.SUCCESS(f'Folded {folded} counter shards'))
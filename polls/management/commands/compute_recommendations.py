@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from polls.recommend import DEFAULT_K, TAG_WEIGHT, benchmark, refresh
+
+
+class Command(BaseCommand):
+    help = 'Precompute "polls you might like" from co-voting and shared tags'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute every poll, not just those with new votes since the last run',
+        )
+        parser.add_argument('--k', type=int, default=DEFAULT_K, help=f'Neighbours kept per poll (default: {DEFAULT_K})')
+        parser.add_argument(
+            '--tag-weight',
+            type=float,
+            default=TAG_WEIGHT,
+            help=f'Share of the score from tag overlap, 0 to 1 (default: {TAG_WEIGHT})',
+        )
+        parser.add_argument('--batch-size', type=int, default=2000, help='Polls per sparse product (default: 2000)')
+        parser.add_argument(
+            '--benchmark',
+            metavar='USERS,POLLS',
+            help='Time the computation on synthetic data of this size instead (e.g. 1000000,100000)',
+        )
+        parser.add_argument(
+            '--sample',
+            type=int,
+            help='With --benchmark, compute this many polls and extrapolate',
+        )
+
+    def handle(self, *args, **options):
+        if not 0 <= options['tag_weight'] <= 1:
+            raise CommandError("--tag-weight must be between 0 and 1")
+        if options['benchmark']:
+            try:
+                users, polls = (int(n) for n in options['benchmark'].split(','))
+            except ValueError:
+                raise CommandError("--benchmark takes USERS,POLLS, e.g. 1000000,100000")
+            report = benchmark(users, polls, k=options['k'], sample=options['sample'],
+                               batch_size=options['batch_size'])
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        refreshed = refresh(
+            full=options['full'], k=options['k'],
+            tag_weight=options['tag_weight'], batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Recomputed neighbours of {refreshed} polls"))
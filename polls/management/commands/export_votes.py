@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from polls.export import export_votes, read_manifest
+
+
+class Command(BaseCommand):
+    help = 'Append new vote events to a columnar (.npy or Arrow) export for offline analysis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Export directory (created if missing)')
+        parser.add_argument(
+            '--partition-size',
+            type=int,
+            default=5_000_000,
+            help='Maximum events per partition (default: 5000000)',
+        )
+        parser.add_argument(
+            '--format',
+            choices=['npy', 'arrow'],
+            default='npy',
+            help='One .npy file per column, or an Arrow IPC file (needs pyarrow) (default: npy)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            added = export_votes(options['path'], options['partition_size'], options['format'])
+        except ImportError as exc:
+            raise CommandError(str(exc))
+        for entry in added:
+            self.stdout.write(f"  {entry['name']}: {entry['rows']} events (ids {entry['min_id']}-{entry['max_id']})")
+        manifest = read_manifest(options['path'])
+        total = sum(entry['rows'] for entry in manifest['partitions'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {sum(entry['rows'] for entry in added)} new events; "
+            f"{total} in {len(manifest['partitions'])} partitions up to id {manifest['watermark']}"
+        ))
@@ -0,0 +1,46 @@
+import json
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from polls.importer import PollImporter, iter_records
+
+
+class Command(BaseCommand):
+    help = 'Import polls, choices and tags from a JSON array or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or "-" for stdin')
+        parser.add_argument(
+            '--user',
+            required=True,
+            help='Username recorded as creator of the imported polls',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Records written per transaction (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named '{options['user']}'")
+
+        importer = PollImporter(user, batch_size=options['batch_size'])
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        created = failed = 0
+        with stream:
+            for report in importer.run(iter_records(stream)):
+                if report['status'] == 'created':
+                    created += 1
+                else:
+                    failed += 1
+                    self.stderr.write(json.dumps(report))
+                if report['record'] % options['batch_size'] == 0:
+                    self.stdout.write(f'{report["record"]} records processed...')
+
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(f'Imported {created} polls, {failed} records rejected'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from polls.cache import bump_list_generation, bump_vote_version
+from polls.choicecache import choice_cache
+from polls.models import Poll
+from polls.voting import replay_events
+
+
+class Command(BaseCommand):
+    help = 'Rebuild votes and vote counters from the vote event log (not safe while voting)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Events read and votes written per batch (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        votes = replay_events(batch_size=options['batch_size'])
+        for pk in Poll.objects.values_list('pk', flat=True).iterator():
+            bump_vote_version(pk)
+        bump_list_generation()
+        choice_cache().invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {votes} votes from the event log'))
@@ -0,0 +1,72 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from polls.jobs import Worker, enqueue, registry, stats
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (and the periodic schedule) on a worker pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Jobs run concurrently (default: 2)',
+        )
+        parser.add_argument(
+            '--mode',
+            choices=['thread', 'process', 'inline'],
+            default='thread',
+            help='Run jobs on a thread pool, a process pool, or in this process (default: thread)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait between checks for due jobs (default: 1)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no job is due instead of waiting for more',
+        )
+        parser.add_argument(
+            '--enqueue',
+            metavar='NAME',
+            help='Queue a job by name (arguments via --kwargs) and exit',
+        )
+        parser.add_argument(
+            '--kwargs',
+            default='{}',
+            help='JSON object of keyword arguments for --enqueue',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print job counts and timings and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(stats(), indent=2))
+            return
+
+        if options['enqueue']:
+            if options['enqueue'] not in registry:
+                raise CommandError(f"Unknown job '{options['enqueue']}' (known: {', '.join(sorted(registry))})")
+            queued = enqueue(options['enqueue'], **json.loads(options['kwargs']))
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{queued.pk}: {queued}'))
+            return
+
+        worker = Worker(
+            concurrency=options['workers'],
+            mode=options['mode'],
+            poll_interval=options['poll_interval'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f"Running jobs ({options['mode']} mode, {options['workers']} workers)...")
+        try:
+            worker.run(once=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped.')
@@ -1,8 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import override_settings
+from polls.choicecache import choice_cache
 from polls.models import Poll, Choice
-from polls.voting import Vote
+from polls.voting import Vote, VoteEvent, VoteCounterShard, VoteTombstone, count_shards
 import random
+import time
 
 
 class Command(BaseCommand):
@@ -14,14 +20,37 @@ class Command(BaseCommand):
             action='store_true',
             help='Clear existing data before seeding',
         )
+        parser.add_argument(
+            '--benchmark-shards',
+            metavar='K,K,...',
+            help='Instead of seeding, time votes through the vote path for each shard count (0: counters off)',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=8,
+            help='Concurrent voters for --benchmark-shards (default: 8)',
+        )
+        parser.add_argument(
+            '--increments',
+            type=int,
+            default=500,
+            help='Votes cast and retracted per thread for --benchmark-shards (default: 500)',
+        )
 
     def handle(self, *args, **options):
+        if options['benchmark_shards']:
+            shard_counts = [int(k) for k in options['benchmark_shards'].split(',')]
+            return self.benchmark_shards(shard_counts, options['threads'], options['increments'])
+        
         if options['clear']:
             self.stdout.write('Clearing existing data...')
             # Clear votes through custom voting system
             Vote.objects.all().delete()
+            VoteEvent.objects.all().delete()
             Choice.objects.all().delete()
             Poll.objects.all().delete()
+            choice_cache().invalidate_all()
             
         # Create or get admin user
         admin_user, created = User.objects.get_or_create(
@@ -153,4 +182,51 @@ class Command(BaseCommand):
                 f'   Users: user1-user5/password123\n\n'
                 f'🚀 Ready to run: python manage.py runserver'
             )
-        )
\ No newline at end of file
+        )
+
+    def benchmark_shards(self, shard_counts, threads, increments):
+        """Vote and retract on one viral choice from many threads, per shard count (0: no counters)"""
+        if connection.vendor == 'sqlite' and threads > 1:
+            # Its read-then-write vote transactions deadlock on SQLite's single writer lock
+            self.stdout.write('SQLite takes one writer at a time; running a single thread')
+            threads = 1
+        admin_user = User.objects.filter(is_superuser=True).first() or User.objects.create(username='bench')
+        poll = Poll.objects.create(
+            title='Counter benchmark', description='Temporary', created_by=admin_user, is_active=False
+        )
+        choice = Choice.objects.create(poll=poll, text='Viral choice')
+        voters = User.objects.bulk_create([User(username=f'bench-voter-{i}') for i in range(threads)])
+        voters = list(User.objects.filter(username__in=[voter.username for voter in voters]))
+        ct = ContentType.objects.get_for_model(Choice)
+        
+        def voter(user):
+            # The whole vote path: vote row, event, counter shard, cache invalidation
+            try:
+                for _ in range(increments):
+                    choice.votes.up(user)
+                    choice.votes.delete(user)
+            finally:
+                connection.close()
+        
+        self.stdout.write(f'{threads} threads x {increments} votes + retractions on one choice '
+                          f'({connection.vendor}):')
+        try:
+            for k in shard_counts:
+                VoteCounterShard.objects.filter(content_type=ct, object_id=choice.pk).delete()
+                with override_settings(VOTE_COUNTER_SHARDS=k):
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(threads) as pool:
+                        list(pool.map(voter, voters))
+                    elapsed = time.perf_counter() - started
+                ops = 2 * threads * increments
+                label = f'K={k}' if k else 'off'
+                counted = count_shards(ct, [choice.pk]).get(choice.pk, 0)
+                check = '' if counted == 0 else f', counters off by {counted}'
+                self.stdout.write(f'  {label:<6} {ops / elapsed:>10,.0f} votes/s  ({ops} in {elapsed:.2f}s{check})')
+            if connection.vendor == 'sqlite':
+                self.stdout.write('  (SQLite serializes all writers; use PostgreSQL to see K pay off)')
+        finally:
+            poll.delete()
+            User.objects.filter(pk__in=[user.pk for user in voters]).delete()
+            VoteCounterShard.objects.filter(content_type=ct, object_id=choice.pk).delete()
+            VoteTombstone.objects.filter(content_type=ct, object_id=choice.pk).delete()
@@ -0,0 +1,28 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from polls.models import Poll, Choice
+from polls.voting import take_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Snapshot per-poll vote tallies for the snapshot tally backend (run periodically)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_ids', nargs='*', type=int, help='Polls to snapshot (default: all)')
+
+    def handle(self, *args, **options):
+        polls = Poll.objects.filter(poll_type=Poll.SINGLE)
+        if options['poll_ids']:
+            polls = polls.filter(pk__in=options['poll_ids'])
+        
+        snapshotted = snapshot_polls(polls)
+        self.stdout.write(self.style.SUCCESS(f'Snapshotted {snapshotted} polls'))
+
+
+def snapshot_polls(polls):
+    ct = ContentType.objects.get_for_model(Choice)
+    count = 0
+    for poll in polls.prefetch_related('choices').iterator(chunk_size=200):
+        take_snapshots(ct, [choice.pk for choice in poll.choices.all()])
+        count += 1
+    return count
@@ -0,0 +1,126 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is imported yet
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_ms = (time.perf_counter() - started) * 1000
+if {load_urls}:
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+total_ms = (time.perf_counter() - started) * 1000
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+peak_mb = peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+print(json.dumps({{'setup_ms': setup_ms, 'total_ms': total_ms, 'rss_mb': peak_mb,
+                  'modules': len(sys.modules)}}))
+"""
+
+
+def parse_importtime(lines):
+    """[(module, self_us, cumulative_us)] from ``python -X importtime`` output"""
+    modules = []
+    for line in lines:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def by_package(modules):
+    """{top-level package: summed self time in us}"""
+    totals = defaultdict(int)
+    for name, self_us, _ in modules:
+        totals[name.split('.')[0]] += self_us
+    return dict(totals)
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and memory of django.setup() in a fresh interpreter'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=15,
+            help='Packages and modules to list (default: 15)',
+        )
+        parser.add_argument(
+            '--urls',
+            action='store_true',
+            help='Also import the URLconf (and with it every view), as the first request would',
+        )
+        parser.add_argument(
+            '--max-ms',
+            type=float,
+            help='Fail if startup takes longer than this many milliseconds',
+        )
+        parser.add_argument(
+            '--max-rss-mb',
+            type=float,
+            help='Fail if peak resident memory after startup exceeds this many MB',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the full report as JSON',
+        )
+
+    def handle(self, *args, **options):
+        report = self.profile(options['urls'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report, options['top'])
+
+        failures = []
+        if options['max_ms'] is not None and report['total_ms'] > options['max_ms']:
+            failures.append(f"startup took {report['total_ms']:.0f}ms (budget {options['max_ms']:.0f}ms)")
+        if options['max_rss_mb'] is not None and report['rss_mb'] > options['max_rss_mb']:
+            failures.append(f"peak RSS {report['rss_mb']:.1f}MB (budget {options['max_rss_mb']:.1f}MB)")
+        if failures:
+            raise CommandError('Startup over budget: ' + '; '.join(failures))
+
+    def profile(self, load_urls):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE.format(load_urls=load_urls)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f'Startup failed:\n{result.stderr[-2000:]}')
+
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        modules = parse_importtime(result.stderr.splitlines())
+        report['settings'] = settings.SETTINGS_MODULE
+        report['packages'] = {
+            name: round(us / 1000, 2)
+            for name, us in sorted(by_package(modules).items(), key=lambda item: -item[1])
+        }
+        report['slowest_modules'] = [
+            {'module': name, 'self_ms': round(self_us / 1000, 2), 'cumulative_ms': round(cum_us / 1000, 2)}
+            for name, self_us, cum_us in sorted(modules, key=lambda m: -m[1])
+        ]
+        return report
+
+    def print_report(self, report, top):
+        self.stdout.write(
+            f"{report['settings']}: {report['total_ms']:.0f}ms to start "
+            f"(django.setup {report['setup_ms']:.0f}ms), peak RSS {report['rss_mb']:.1f}MB, "
+            f"{report['modules']} modules"
+        )
+        self.stdout.write('\nImport time by package (self, ms):')
+        for name, ms in list(report['packages'].items())[:top]:
+            self.stdout.write(f'  {ms:8.1f}  {name}')
+        self.stdout.write('\nSlowest modules (self / cumulative, ms):')
+        for row in report['slowest_modules'][:top]:
+            self.stdout.write(f"  {row['self_ms']:8.1f} {row['cumulative_ms']:8.1f}  {row['module']}")
@@ -0,0 +1,32 @@
+from pathlib import Path
+from urllib.error import URLError
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from polls.assets import CDN, fetch_vendor_assets
+
+
+class Command(BaseCommand):
+    help = 'Download Bootstrap, the Bootswatch theme and Bootstrap Icons into static/vendor/'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            default=CDN,
+            help=f'URL prefix or local directory (laid out like npm packages) to copy from (default: {CDN})',
+        )
+        parser.add_argument(
+            '--dest',
+            default=str(settings.STATICFILES_DIRS[0]),
+            help='Static directory to write into (default: the first STATICFILES_DIRS entry)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            for name in fetch_vendor_assets(Path(options['dest']), options['source']):
+                self.stdout.write(f'  {name}')
+        except (URLError, OSError) as exc:
+            raise CommandError(f'Could not fetch vendor assets: {exc}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Vendored assets into {options['dest']}; run collectstatic to fingerprint and compress them"
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from polls.cache import bump_list_generation, bump_vote_version
+from polls.choicecache import choice_cache
+from polls.integrity import ORPHANS, plan, run
+
+
+class Command(BaseCommand):
+    help = 'Check votes for duplicates, orphans and counter drift in parallel over poll ranges, optionally repairing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Worker processes, each with its own connection; 1 checks inline (default: 4)')
+        parser.add_argument('--range-size', type=int, default=1000, help='Polls per task (default: 1000)')
+        parser.add_argument('--repair', action='store_true',
+                            help='Delete duplicates (keeping the newest) and orphans, and fix counters')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Votes deleted per statement (default: 1000)')
+
+    def handle(self, *args, **options):
+        tasks = plan(options['range_size'])
+        repair = options['repair']
+        totals = {'duplicates': 0, 'counters': 0, 'orphans': 0}
+        touched = set()
+        for done, report in enumerate(run(tasks, options['workers'], repair, options['batch_size']), start=1):
+            kind, lo, hi = report['task']
+            found = {name: report[name] for name in totals if report[name]}
+            for name, n in found.items():
+                totals[name] += n
+            touched.update(report['polls'])
+            label = f"{'choice ids' if kind == ORPHANS else 'polls'} {lo}-{hi - 1}"
+            summary = ', '.join(f'{n} {name}' for name, n in found.items()) or 'ok'
+            line = f'[{done}/{len(tasks)}] {label}: {summary}' + (' (repaired)' if found and repair else '')
+            self.stdout.write(self.style.WARNING(line) if found else line)
+
+        problems = sum(totals.values())
+        if repair and problems:
+            for pk in touched:
+                bump_vote_version(pk)
+            bump_list_generation()
+            choice_cache().invalidate_all()
+        summary = ', '.join(f'{n} {name}' for name, n in totals.items())
+        if problems and not repair:
+            raise CommandError(f'Found {summary}; run with --repair to fix them')
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Repaired' if problems else 'Verified'} {len(tasks)} ranges: {summary}"
+        ))
@@ -0,0 +1,16 @@
+"""
+Tiny registry of process-local metrics.
+
+Subsystems register a zero-argument callable returning a JSON-serialisable
+dict; the staff-only metrics view reports them all.
+"""
+
+_sources = {}
+
+
+def register(name, source):
+    _sources[name] = source
+
+
+def collect():
+    return {name: source() for name, source in _sources.items()}
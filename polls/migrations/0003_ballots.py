@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0002_vote_counter_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='poll_type',
+            field=models.CharField(choices=[('single', 'Single choice'), ('approval', 'Approval (pick any number)'), ('ranked', 'Ranked choice (instant runoff)')], default='single', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='Ballot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ballots', to='polls.poll')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ballots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('poll', 'user')},
+            },
+        ),
+        migrations.CreateModel(
+            name='BallotRank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('ballot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranks', to='polls.ballot')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ballot_ranks', to='polls.choice')),
+            ],
+            options={
+                'ordering': ['ballot', 'rank'],
+                'unique_together': {('ballot', 'choice'), ('ballot', 'rank')},
+            },
+        ),
+    ]
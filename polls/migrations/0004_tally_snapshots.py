@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('polls', '0003_ballots'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TallySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('votes_until', models.DateTimeField()),
+                ('tombstone_mark', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('vote_created_at', models.DateTimeField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['content_type', 'object_id', 'created_at'], name='polls_vote_content_8af82d_idx'),
+        ),
+        migrations.AddField(
+            model_name='tallysnapshot',
+            name='content_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AddField(
+            model_name='votetombstone',
+            name='content_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tallysnapshot',
+            unique_together={('content_type', 'object_id')},
+        ),
+        migrations.AddIndex(
+            model_name='votetombstone',
+            index=models.Index(fields=['content_type', 'object_id', 'id'], name='polls_votet_content_3ea95a_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def log_existing_votes(apps, schema_editor):
+    """Start the log with a cast event for every vote that predates it"""
+    Vote = apps.get_model('polls', 'Vote')
+    VoteEvent = apps.get_model('polls', 'VoteEvent')
+    votes = Vote.objects.order_by('created_at', 'id').values_list(
+        'user_id', 'content_type_id', 'object_id', 'created_at'
+    )
+    VoteEvent.objects.bulk_create(
+        (VoteEvent(kind='cast', user_id=user_id, content_type_id=ct_id,
+                   object_id=object_id, created_at=created_at)
+         for user_id, ct_id, object_id, created_at in votes.iterator(chunk_size=5000)),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('polls', '0005_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vote',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='VoteEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('cast', 'Cast'), ('change', 'Change'), ('retract', 'Retract')], max_length=7)),
+                ('object_id', models.PositiveIntegerField()),
+                ('previous_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['content_type', 'object_id'], name='polls_votee_content_8f16fc_idx')],
+            },
+        ),
+        migrations.RunPython(log_existing_votes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_vote_user_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('through_event', models.BigIntegerField(help_text='Last vote event id seen when computed')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.poll')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar', to='polls.poll')),
+            ],
+            options={
+                'verbose_name_plural': 'poll similarities',
+                'ordering': ['poll', 'rank'],
+                'unique_together': {('poll', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_poll_active_recent_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_vote_id', models.CharField(max_length=64, unique=True)),
+                ('voted_at', models.DateTimeField(help_text='When the kiosk recorded the vote')),
+                ('status', models.CharField(choices=[('applied', 'Applied'), ('unchanged', 'Already the standing vote'), ('superseded', 'Superseded by a later vote in the upload'), ('stale', 'Older than the standing vote')], max_length=10)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.choice')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='client_votes', to='polls.poll')),
+                ('uploaded_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='client_votes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'permissions': [('sync_votes', 'Can upload kiosk votes on behalf of voters')],
+                'indexes': [models.Index(fields=['user', 'poll', 'status'], name='polls_clien_user_id_dc364c_idx')],
+            },
+        ),
+    ]
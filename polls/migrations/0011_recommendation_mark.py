@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_client_votes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('through_event', models.BigIntegerField(help_text='Last vote event id the refresh saw')),
+                ('started_at', models.DateTimeField(help_text='Ballots and polls after this are picked up next time')),
+            ],
+        ),
+    ]
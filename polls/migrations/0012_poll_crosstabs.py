@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_recommendation_mark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollCrosstab',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('result', models.JSONField()),
+                ('through_event', models.BigIntegerField(help_text='Last vote event id seen when computed')),
+                ('computed_at', models.DateTimeField(help_text='When the computation started')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.poll')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='polls.poll')),
+            ],
+            options={
+                'unique_together': {('poll', 'other')},
+            },
+        ),
+    ]
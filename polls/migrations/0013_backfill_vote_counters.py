@@ -0,0 +1,29 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def count_existing_votes(apps, schema_editor):
+    """Reset the counter shards to the vote rows, which 0002 left uncounted"""
+    Vote = apps.get_model('polls', 'Vote')
+    VoteCounterShard = apps.get_model('polls', 'VoteCounterShard')
+    VoteCounterShard.objects.all().delete()
+    totals = (
+        Vote.objects.values('content_type_id', 'object_id')
+        .annotate(n=Count('id')).order_by().values_list('content_type_id', 'object_id', 'n')
+    )
+    VoteCounterShard.objects.bulk_create(
+        (VoteCounterShard(content_type_id=ct_id, object_id=object_id, shard=0, count=n)
+         for ct_id, object_id, n in totals.iterator(chunk_size=5000)),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_poll_crosstabs'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_existing_votes, migrations.RunPython.noop),
+    ]
@@ -1,17 +1,35 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.dispatch import Signal
 from django.urls import reverse
+from django.utils import timezone
 from taggit.managers import TaggableManager
-from .voting import VoteModel
+from .loaders import VoteLoader
+from .voting import Vote, VoteEvent, VoteModel
+
+
+# Sent with sender=Poll, instance=<poll>, user=<user> after a ballot is cast
+ballot_cast = Signal()
 
 
 class Poll(models.Model):
+    SINGLE = 'single'
+    APPROVAL = 'approval'
+    RANKED = 'ranked'
+    POLL_TYPES = [
+        (SINGLE, 'Single choice'),
+        (APPROVAL, 'Approval (pick any number)'),
+        (RANKED, 'Ranked choice (instant runoff)'),
+    ]
+    
     title = models.CharField(max_length=200)
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='polls')
     is_active = models.BooleanField(default=True)
+    poll_type = models.CharField(max_length=10, choices=POLL_TYPES, default=SINGLE)
     
     # Tags using django-taggit
     tags = TaggableManager(blank=True)
@@ -20,6 +38,10 @@ class Poll(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The list and detail pages page through active polls newest first
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='poll_active_recent_idx'),
+        ]
         
     def __str__(self):
         return self.title
@@ -27,17 +49,35 @@ class Poll(models.Model):
     def get_absolute_url(self):
         return reverse('polls:detail', kwargs={'pk': self.pk})
         
+    @property
+    def uses_ballots(self):
+        return self.poll_type != self.SINGLE
+    
+    def vote_counts(self):
+        """{choice_id: vote count}, memoized for the current request"""
+        if self.uses_ballots:
+            return self.tally()['counts']
+        return VoteLoader.get().counts(self)
+    
+    def tally(self):
+        """Ballot tally of an approval or ranked poll (see polls.ballots)"""
+        from .ballots import tally
+        return tally(self)
+    
     @property
     def total_votes(self):
-        """Return total votes across all choices"""
-        return sum(choice.votes.count() for choice in self.choices.all())
+        """Return total votes across all choices (ballots cast for ballot polls)"""
+        if self.uses_ballots:
+            return self.tally()['ballots']
+        return sum(self.vote_counts().values())
         
     def get_results(self):
         """Return choices with vote counts and percentages"""
-        total = self.total_votes
+        counts = self.vote_counts()
+        total = self.total_votes if self.uses_ballots else sum(counts.values())
         results = []
         for choice in self.choices.all():
-            count = choice.votes.count()
+            count = counts.get(choice.pk, 0)
             percentage = (count / total * 100) if total > 0 else 0
             results.append({
                 'choice': choice,
@@ -46,15 +86,67 @@ class Poll(models.Model):
             })
         return results
     
+    def recommended(self, k=5):
+        """Active polls most similar to this one, best first (see polls.recommend)"""
+        rows = (
+            PollSimilarity.objects.filter(poll=self, neighbor__is_active=True)
+            .select_related('neighbor').order_by('rank')[:k]
+        )
+        return [row.neighbor for row in rows]
+    
     def user_vote(self, user):
         """Get the choice that the user voted for, if any"""
         if not user.is_authenticated:
             return None
         
+        if self.uses_ballots:
+            ballot = self.user_ballot(user)
+            choice_id = ballot[0] if ballot else None
+        else:
+            choice_id = VoteLoader.get().user_choice_id(user, self)
         for choice in self.choices.all():
-            if choice.votes.exists(user):
+            if choice.pk == choice_id:
                 return choice
         return None
+    
+    def vote(self, user, choice):
+        """
+        Cast the user's single vote for choice, moving any vote they already have.
+        
+        The standing vote is read from the database under a row lock rather than
+        through ``user_vote``, whose cached answer may lag a vote just cast.
+        """
+        choices = {each.pk: each for each in self.choices.all()}
+        with transaction.atomic():
+            previous_id = Vote.objects.select_for_update().filter(
+                user=user, content_type=ContentType.objects.get_for_model(Choice), object_id__in=list(choices)
+            ).values_list('object_id', flat=True).first()
+            if previous_id is None:
+                choice.votes.up(user)
+            elif previous_id != choice.pk:
+                choice.votes.change(user, choices[previous_id])
+    
+    def user_ballot(self, user):
+        """Choice ids on the user's ballot, most preferred first"""
+        if not user.is_authenticated:
+            return []
+        return list(
+            BallotRank.objects.filter(ballot__poll=self, ballot__user=user)
+            .order_by('rank').values_list('choice_id', flat=True)
+        )
+    
+    def cast_ballot(self, user, choices):
+        """Replace the user's ballot with choices (in preference order for ranked polls)"""
+        with transaction.atomic():
+            ballot, _ = Ballot.objects.get_or_create(poll=self, user=user)
+            ballot.ranks.all().delete()
+            BallotRank.objects.bulk_create([
+                BallotRank(ballot=ballot, choice=choice, rank=rank)
+                for rank, choice in enumerate(choices, start=1)
+            ])
+            ballot.save(update_fields=['updated_at'])
+        ballot_cast.send(sender=Poll, instance=self, user=user)
+        return ballot
 
 
 class Choice(VoteModel, models.Model):
@@ -66,4 +158,152 @@ class Choice(VoteModel, models.Model):
         ordering = ['id']
         
     def __str__(self):
-        return f"{self.poll.title} - {self.text}"
\ No newline at end of file
+        return f"{self.poll.title} - {self.text}"
+
+
+class Ballot(models.Model):
+    """A user's ballot in an approval or ranked poll"""
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='ballots')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ballots')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['poll', 'user']
+
+
+class BallotRank(models.Model):
+    """One marked choice on a ballot; rank 1 is the most preferred"""
+    ballot = models.ForeignKey(Ballot, on_delete=models.CASCADE, related_name='ranks')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='ballot_ranks')
+    rank = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        ordering = ['ballot', 'rank']
+        unique_together = [['ballot', 'rank'], ['ballot', 'choice']]
+
+
+class Job(models.Model):
+    """A unit of background work for the DB-backed queue in polls.jobs"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=dict, blank=True)
+    dedupe_key = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds taken by the last attempt")
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['name', 'created_at']),
+        ]
+        constraints = [
+            # At most one pending job per dedupe key: duplicates coalesce
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=models.Q(status='pending') & ~models.Q(dedupe_key=''),
+                name='unique_pending_job',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.name}({self.args}) [{self.status}]"
+
+
+class PollSimilarity(models.Model):
+    """One of a poll's top-K most similar polls, precomputed by polls.recommend"""
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='similar')
+    neighbor = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    through_event = models.BigIntegerField(help_text="Last vote event id seen when computed")
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['poll', 'rank']
+        unique_together = ['poll', 'rank']
+        verbose_name_plural = 'poll similarities'
+    
+    def __str__(self):
+        return f"{self.poll_id} ~ {self.neighbor_id} ({self.score:.3f})"
+
+
+class PollCrosstab(models.Model):
+    """
+    A stored crosstab of two polls, computed by the ``compute_crosstab`` job.
+    
+    Kept in the database rather than the cache so every web process sees
+    what the job worker computed.
+    """
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='+')
+    result = models.JSONField()
+    through_event = models.BigIntegerField(help_text="Last vote event id seen when computed")
+    computed_at = models.DateTimeField(help_text="When the computation started")
+    
+    class Meta:
+        unique_together = ['poll', 'other']
+    
+    def __str__(self):
+        return f"{self.poll_id} x {self.other_id}"
+    
+    def is_outdated(self):
+        """Whether either poll got votes or ballots since this was computed"""
+        poll_ids = [self.poll_id, self.other_id]
+        changed = VoteEvent.objects.filter(
+            id__gt=self.through_event, content_type=ContentType.objects.get_for_model(Choice),
+            object_id__in=Choice.objects.filter(poll_id__in=poll_ids).values('pk'),
+        )
+        return (changed.exists()
+                or Ballot.objects.filter(poll_id__in=poll_ids, updated_at__gt=self.computed_at).exists())
+
+
+class RecommendationMark(models.Model):
+    """Where the last recommendation refresh left off; a single row, kept by polls.recommend"""
+    through_event = models.BigIntegerField(help_text="Last vote event id the refresh saw")
+    started_at = models.DateTimeField(help_text="Ballots and polls after this are picked up next time")
+
+
+class ClientVote(models.Model):
+    """A vote uploaded by a kiosk, kept so re-uploads are recognised (see polls.kiosk)"""
+    APPLIED = 'applied'
+    UNCHANGED = 'unchanged'
+    SUPERSEDED = 'superseded'
+    STALE = 'stale'
+    STATUSES = [
+        (APPLIED, 'Applied'),
+        (UNCHANGED, 'Already the standing vote'),
+        (SUPERSEDED, 'Superseded by a later vote in the upload'),
+        (STALE, 'Older than the standing vote'),
+    ]
+    
+    client_vote_id = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='client_votes')
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE, related_name='client_votes')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='+')
+    voted_at = models.DateTimeField(help_text="When the kiosk recorded the vote")
+    status = models.CharField(max_length=10, choices=STATUSES)
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    received_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'poll', 'status']),
+        ]
+        permissions = [('sync_votes', 'Can upload kiosk votes on behalf of voters')]
+    
+    def __str__(self):
+        return f"{self.client_vote_id}: {self.user_id} -> {self.choice_id} [{self.status}]"
@@ -0,0 +1,213 @@
+"""
+Query plan checks for the hot paths.
+
+Every scenario in ``SCENARIOS`` runs against throwaway fixture rows (rolled
+back afterwards) with caches off. Its SQL is captured and explained with
+``EXPLAIN QUERY PLAN`` on SQLite, or ``EXPLAIN`` with sequential scans
+disabled on PostgreSQL. Two things count as a problem:
+
+* a full scan of a table: ``SCAN <table>`` without an index, or ``Seq Scan``
+* a sort the planner has to materialise: ``USE TEMP B-TREE``, or ``Sort``
+
+Plans are also compared with the snapshot in ``query_plans.json``, so a
+query that silently switches to a worse index fails the build with a diff
+too. ``manage.py check_query_plans`` reports both, and ``--update`` rewrites
+the snapshot. Tests can use ``QueryPlanMixin.assertIndexed`` on any code.
+"""
+import difflib
+import json
+import re
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+SNAPSHOT = Path(__file__).with_name('query_plans.json')
+
+# Caches off so scenarios hit the database; in-process requests come from "testserver"
+CHECK_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'POLLS_CHOICE_CACHE': {},
+    'ALLOWED_HOSTS': ['testserver'],
+}
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+IN_LIST = re.compile(r'IN \((?:\?, )*\?\)')
+
+
+def normalize_sql(sql):
+    """SQL with literals as ?, so the same query shape compares equal across runs"""
+    sql = NUMBER.sub('?', STRING.sub('?', sql))
+    return IN_LIST.sub('IN (...)', sql)
+
+
+def explain(sql, using=DEFAULT_DB_ALIAS):
+    """The plan of an executed (parameter-interpolated) statement, as lines"""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            depth, lines = {0: -1}, []
+            for node, parent, _, detail in cursor.fetchall():
+                depth[node] = depth.get(parent, -1) + 1
+                lines.append('  ' * depth[node] + re.sub(r'^(SCAN|SEARCH) TABLE ', r'\1 ', detail))
+            return lines
+        if connection.vendor == 'postgresql':
+            with transaction.atomic(using=using):
+                # With sequential scans priced out, one in the plan means no usable index
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN (COSTS OFF) ' + sql)
+                return [row[0] for row in cursor.fetchall()]
+    raise NotImplementedError(f"No query plan support for {connection.vendor}")
+
+
+def problems(plan, tables, allow=()):
+    """Plan lines showing a full table scan or a materialised sort, minus allowed patterns"""
+    found = []
+    for line in plan:
+        step = line.strip().removeprefix('-> ')
+        scan = re.match(r'SCAN (\w+)$', step) or re.match(r'Seq Scan on (\w+)', step)
+        bad = (
+            (scan and scan.group(1) in tables)
+            or step.startswith('USE TEMP B-TREE')
+            or re.match(r'(Incremental )?Sort\b', step)
+        )
+        if bad and not any(re.search(pattern, step) for pattern in allow):
+            found.append(step)
+    return found
+
+
+def capture(fn, using=DEFAULT_DB_ALIAS):
+    """[(normalized sql, plan)] of the distinct statements fn runs, in order"""
+    with CaptureQueriesContext(connections[using]) as queries:
+        fn()
+    plans, seen = [], set()
+    for query in queries.captured_queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        shape = normalize_sql(sql)
+        if shape not in seen:
+            seen.add(shape)
+            plans.append((shape, explain(sql, using)))
+    return plans
+
+
+class Fixture:
+    """Just enough data for every hot path to run its real queries"""
+
+    def __init__(self):
+        from .models import Poll, Choice
+        self.user = User.objects.create_user(username='query-plan-check', password='unused')
+        self.voter = User.objects.create_user(username='query-plan-voter', password='unused')
+        self.poll = Poll.objects.create(title='Plan check', description='?', created_by=self.user)
+        self.poll.tags.add('plans')
+        self.choices = [Choice.objects.create(poll=self.poll, text=f'Choice {i}') for i in range(3)]
+        self.choices[0].votes.up(self.voter)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def get(self, name, params=None, **kwargs):
+        url = reverse(f'polls:{name}', kwargs=kwargs)
+        response = self.client.get(url + ('?' + urlencode(params) if params else ''))
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+        return response
+
+
+def _list_page(params=None):
+    return lambda f: f.get('list', params)
+
+
+# taggit's tag prefetch de-duplicates one page of polls' tags; bounded by the page size
+TAG_PREFETCH = (r'^USE TEMP B-TREE FOR DISTINCT$', r'^(Unique|HashAggregate)\b')
+
+# name -> (run against a Fixture, plan steps allowed to scan or sort)
+SCENARIOS = {
+    'vote_count': (lambda f: f.choices[0].votes.count(), ()),
+    'vote_exists': (lambda f: f.choices[0].votes.exists(f.voter), ()),
+    'poll_list': (_list_page(), TAG_PREFETCH),
+    'poll_list_title': (_list_page({'title': 'plan'}), TAG_PREFETCH),
+    # Matching polls are found through their tags, so only they are sorted
+    'poll_list_tags': (_list_page({'tags': 'plan'}), TAG_PREFETCH + (r'^USE TEMP B-TREE FOR ORDER BY$', r'^Sort\b')),
+    'poll_list_created_at': (_list_page({'created_at_min': '2020-01-01', 'created_at_max': '2100-01-01'}), TAG_PREFETCH),
+    'poll_list_is_active': (_list_page({'is_active': 'true'}), TAG_PREFETCH),
+    'poll_results_ajax': (lambda f: f.get('results_ajax', pk=f.poll.pk), ()),
+}
+
+
+def check(names=None, using=DEFAULT_DB_ALIAS):
+    """
+    Run the scenarios and explain their queries.
+
+    Returns ``{name: {'queries': [{'sql', 'plan'}], 'problems': [...]}}``.
+    Fixture rows are rolled back.
+    """
+    tables = set(connections[using].introspection.table_names())
+    report = {}
+    with override_settings(**CHECK_SETTINGS), transaction.atomic(using=using):
+        fixture = Fixture()
+        for name, (run, allow) in SCENARIOS.items():
+            if names and name not in names:
+                continue
+            plans = capture(lambda: run(fixture), using)
+            report[name] = {
+                'queries': [{'sql': sql, 'plan': plan} for sql, plan in plans],
+                'problems': [
+                    f"{step}\n    in: {sql}" for sql, plan in plans for step in problems(plan, tables, allow)
+                ],
+            }
+        transaction.set_rollback(True, using=using)
+    return report
+
+
+def read_snapshot(vendor, path=SNAPSHOT):
+    try:
+        return json.loads(Path(path).read_text()).get(vendor, {})
+    except FileNotFoundError:
+        return {}
+
+
+def write_snapshot(vendor, report, path=SNAPSHOT):
+    try:
+        snapshot = json.loads(Path(path).read_text())
+    except FileNotFoundError:
+        snapshot = {}
+    snapshot[vendor] = {name: result['queries'] for name, result in sorted(report.items())}
+    Path(path).write_text(json.dumps(snapshot, indent=2) + '\n')
+
+
+def _render(queries):
+    return [line for query in queries for line in [query['sql'], *('    ' + step for step in query['plan'])]]
+
+
+def diff(snapshot, report):
+    """Unified diff per scenario whose queries or plans differ from the snapshot"""
+    diffs = {}
+    for name, result in report.items():
+        if name not in snapshot:
+            continue
+        lines = list(difflib.unified_diff(
+            _render(snapshot[name]), _render(result['queries']),
+            fromfile=f'{name} (snapshot)', tofile=f'{name} (now)', lineterm='',
+        ))
+        if lines:
+            diffs[name] = '\n'.join(lines)
+    return diffs
+
+
+class QueryPlanMixin:
+    """TestCase mixin: ``self.assertIndexed(fn)`` fails on scans or sorts in fn's queries"""
+
+    def assertIndexed(self, fn, allow=(), using=DEFAULT_DB_ALIAS):
+        tables = set(connections[using].introspection.table_names())
+        found = [
+            f"{step}\n    in: {sql}" for sql, plan in capture(fn, using) for step in problems(plan, tables, allow)
+        ]
+        if found:
+            self.fail("Unindexed query plan steps:\n" + '\n'.join(found))
@@ -0,0 +1,307 @@
+"""
+In-memory vote tallies for active polls.
+
+With ``VOTE_TALLY_BACKEND = 'memory'`` each worker process keeps the vote
+count of every choice of the active single-choice polls in a flat
+``array('q')`` (8 bytes a choice, plus its dict slot), and
+``Poll.get_results``, ``total_votes`` and the results components read
+from it through the ``VoteLoader`` without querying the votes.
+
+The model is warmed with one aggregate over the vote rows, read in the
+same snapshot as the newest ``VoteEvent`` id (the watermark). From then
+on it tails the event log: before serving a read that is more than
+``MAX_LAG`` seconds behind, or right after a vote in this process, one
+query fetches the events past the watermark and folds them in (cast +1,
+retract -1, change -1/+1). Reads are therefore at most ``MAX_LAG``
+seconds stale, and a voter sees their own vote at once. On hot polls
+that holds only for the request that cast it: their results are pinned
+for up to ``POLLS_HOT_POLLS['INTERVAL']`` seconds on top of this (see
+``polls.hotpolls``).
+
+Event ids can commit out of order on PostgreSQL. Ids skipped by the tail
+are asked for again for ``GAP_GRACE`` seconds before they count as rolled
+back. Everything is rebuilt every ``REBUILD_EVERY`` seconds, which also
+heals drift from rows removed without an event (cascade deletes,
+``seed_data --clear``), and when the backlog gets too long to tail.
+
+Choices the model doesn't know are looked up once. Those of polls that
+became active or were created since the warm-up are loaded with their
+own snapshot. The rest (closed polls, ballot polls) are counted by the
+``FALLBACK`` backend.
+
+    VOTE_TALLY_BACKEND = 'memory'
+    POLLS_TALLY_MEMORY = {'MAX_LAG': 1.0, 'REBUILD_EVERY': 300, 'GAP_GRACE': 10, 'FALLBACK': 'votes'}
+
+Events are read in autocommit mode, so a tail inside a transaction that
+later rolls back would count its votes until the next rebuild; don't
+combine the backend with ``ATOMIC_REQUESTS``. ``warm()`` loads the model
+ahead of the first request. Size and lag are reported under the
+``tally_memory`` metric.
+"""
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import setting_changed
+from django.db import connection, connections, transaction
+from django.db.models import Count, Max, Q
+from django.dispatch import receiver
+
+from . import metrics
+from .models import Choice, Poll
+from .voting import TALLY_BACKENDS, Vote, VoteEvent
+
+
+@contextmanager
+def _snapshot():
+    """One consistent view of the database for the aggregate and the watermark"""
+    if connection.in_atomic_block:
+        yield
+        return
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        yield
+
+
+class TallyReadModel:
+    DICT_SLOT_BYTES = 100  # rough per-choice cost of the id -> slot dict
+
+    def __init__(self, max_lag=1.0, rebuild_every=300, gap_grace=10, fallback='votes',
+                 batch_size=1000, max_backlog=50_000):
+        self.max_lag = max_lag
+        self.rebuild_every = rebuild_every
+        self.gap_grace = gap_grace
+        self.fallback = fallback
+        self.batch_size = batch_size
+        self.max_backlog = max_backlog
+        self.ct = ContentType.objects.get_for_model(Choice)
+        self._lock = threading.RLock()
+        self.rebuilds = self.tails = self.applied = self.fallbacks = 0
+        self._clear()
+
+    def _clear(self):
+        self.slots = {}            # choice_id -> index into the buffers
+        self.counts = array('q')   # votes per slot
+        self.loaded = array('i')   # per slot, its entry in self.loads
+        self.loads = []            # (watermark, event ids missing from its snapshot)
+        self.declined = set()      # choice ids looked up and not served
+        self.gaps = {}             # event id skipped by the tail -> when to give up on it
+        self.watermark = 0
+        self.warmed_at = None
+        self.tailed_at = 0.0
+        self.stale = True
+
+    def counts_for(self, object_ids):
+        """({choice_id: votes} for the choices served here, [ids that are not])"""
+        with self._lock:
+            self.refresh()
+            unknown = [pk for pk in object_ids if pk not in self.slots and pk not in self.declined]
+            if unknown:
+                polls = (
+                    Choice.objects.filter(pk__in=unknown, poll__is_active=True, poll__poll_type=Poll.SINGLE)
+                    .values_list('poll_id', flat=True).distinct()
+                )
+                poll_ids = list(polls)
+                if poll_ids:
+                    self._load(poll_ids)
+                self.declined.update(pk for pk in unknown if pk not in self.slots)
+            served, unserved = {}, []
+            for pk in object_ids:
+                slot = self.slots.get(pk)
+                if slot is None:
+                    unserved.append(pk)
+                else:
+                    served[pk] = self.counts[slot]
+            return served, unserved
+
+    def refresh(self):
+        """Rebuild or catch up on the event log if due"""
+        with self._lock:
+            now = time.monotonic()
+            if self.warmed_at is None or now - self.warmed_at > self.rebuild_every:
+                self.rebuild()
+            elif self.stale or now - self.tailed_at > self.max_lag:
+                self.tail()
+
+    def expire(self):
+        """Catch up before the next read (after a vote in this process)"""
+        self.stale = True
+
+    def rebuild(self):
+        with self._lock:
+            self._clear()
+            self.watermark = self._load()
+            self.warmed_at = self.tailed_at = time.monotonic()
+            self.stale = False
+            self.rebuilds += 1
+
+    def tail(self):
+        """Fold in the events after the watermark, and the late ones among the gaps"""
+        with self._lock:
+            now = time.monotonic()
+            self.gaps = {pk: until for pk, until in self.gaps.items() if until > now}
+            self.tailed_at, self.stale = now, False
+            self.tails += 1
+            seen = 0
+            while True:
+                events = list(
+                    VoteEvent.objects.filter(Q(id__gt=self.watermark) | Q(id__in=list(self.gaps)))
+                    .order_by('id')
+                    .values_list('id', 'kind', 'content_type_id', 'object_id', 'previous_object_id')
+                    [:self.batch_size]
+                )
+                for event_id, kind, ct_id, object_id, previous_id in events:
+                    if event_id > self.watermark:
+                        if event_id - self.watermark > self.max_backlog:
+                            return self.rebuild()
+                        for gap in range(self.watermark + 1, event_id):
+                            self.gaps[gap] = now + self.gap_grace
+                        self.watermark = event_id
+                    else:
+                        self.gaps.pop(event_id, None)
+                    if ct_id != self.ct.pk:
+                        continue
+                    if kind == VoteEvent.CHANGE:
+                        self._add(event_id, previous_id, -1)
+                    self._add(event_id, object_id, -1 if kind == VoteEvent.RETRACT else 1)
+                seen += len(events)
+                if len(events) < self.batch_size:
+                    break
+                if seen > self.max_backlog or len(self.gaps) > self.max_backlog:
+                    return self.rebuild()
+
+    def _add(self, event_id, choice_id, delta):
+        slot = self.slots.get(choice_id)
+        if slot is None:
+            return
+        since, missing = self.loads[self.loaded[slot]]
+        # Events in the snapshot a slot was loaded from are already in its count
+        if event_id > since or event_id in missing:
+            self.counts[slot] += delta
+            self.applied += 1
+
+    def _load(self, poll_ids=None):
+        """Load the choices of active single-choice polls (all, or these); returns the snapshot's watermark"""
+        polls = Poll.objects.filter(is_active=True, poll_type=Poll.SINGLE)
+        if poll_ids is not None:
+            polls = polls.filter(pk__in=poll_ids)
+        choices = Choice.objects.filter(poll__in=polls)
+        with _snapshot():
+            since = VoteEvent.objects.aggregate(m=Max('id'))['m'] or 0
+            # Ids below the watermark that aren't committed yet may still arrive
+            window = max(since - self.batch_size, 0)
+            present = set(VoteEvent.objects.filter(id__gt=window).values_list('id', flat=True))
+            choice_ids = list(choices.values_list('pk', flat=True))
+            totals = dict(
+                Vote.objects.filter(content_type=self.ct, object_id__in=choices.values('pk'))
+                .values('object_id').annotate(n=Count('id')).order_by().values_list('object_id', 'n')
+            )
+        missing = frozenset(pk for pk in range(window + 1, since + 1) if pk not in present)
+        # The tail reads past its own watermark; a full load becomes that watermark
+        horizon = since if poll_ids is None else self.watermark
+        give_up = time.monotonic() + self.gap_grace
+        for pk in missing:
+            if pk <= horizon:
+                self.gaps.setdefault(pk, give_up)
+
+        load = len(self.loads)
+        self.loads.append((since, missing))
+        for pk in choice_ids:
+            slot = self.slots.get(pk)
+            if slot is None:
+                self.slots[pk] = len(self.counts)
+                self.counts.append(totals.get(pk, 0))
+                self.loaded.append(load)
+            else:
+                self.counts[slot], self.loaded[slot] = totals.get(pk, 0), load
+            self.declined.discard(pk)
+        return since
+
+    def stats(self):
+        with self._lock:
+            return {
+                'choices': len(self.slots),
+                'watermark': self.watermark,
+                'lag_seconds': round(time.monotonic() - self.tailed_at, 3) if self.warmed_at else None,
+                'age_seconds': round(time.monotonic() - self.warmed_at, 1) if self.warmed_at else None,
+                'gaps': len(self.gaps),
+                'rebuilds': self.rebuilds,
+                'tails': self.tails,
+                'events_applied': self.applied,
+                'fallbacks': self.fallbacks,
+                'approx_bytes': (
+                    self.counts.itemsize * len(self.counts) + self.loaded.itemsize * len(self.loaded)
+                    + sys.getsizeof(self.slots) + len(self.slots) * self.DICT_SLOT_BYTES
+                ),
+            }
+
+
+def count_memory(ct, object_ids):
+    """{object_id: votes} from this process's read model; what it doesn't serve from the fallback"""
+    model = tally_model()
+    if ct.pk != model.ct.pk:
+        return TALLY_BACKENDS[model.fallback](ct, object_ids)
+    counts, unserved = model.counts_for(object_ids)
+    if unserved:
+        model.fallbacks += len(unserved)
+        counts.update(TALLY_BACKENDS[model.fallback](ct, unserved))
+    return counts
+
+
+TALLY_BACKENDS['memory'] = count_memory
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def tally_model():
+    """This process's read model, configured from POLLS_TALLY_MEMORY on first use"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                config = getattr(settings, 'POLLS_TALLY_MEMORY', {})
+                _model = TallyReadModel(
+                    max_lag=config.get('MAX_LAG', 1.0),
+                    rebuild_every=config.get('REBUILD_EVERY', 300),
+                    gap_grace=config.get('GAP_GRACE', 10),
+                    fallback=config.get('FALLBACK', 'votes'),
+                )
+    return _model
+
+
+def enabled():
+    return getattr(settings, 'VOTE_TALLY_BACKEND', 'votes') == 'memory'
+
+
+def expire():
+    """Have the model catch up before its next read, if this process has one"""
+    if _model is not None:
+        _model.expire()
+
+
+def warm():
+    """
+    Load the model now rather than on the first request (no-op unless enabled).
+
+    Closes the connection it used, so a preloading server can fork after it.
+    """
+    if enabled():
+        tally_model().rebuild()
+        connections.close_all()
+
+
+@receiver(setting_changed)
+def reset_tally_model(setting, **kwargs):
+    global _model
+    if setting in ('POLLS_TALLY_MEMORY', 'VOTE_TALLY_BACKEND'):
+        _model = None
+
+
+metrics.register('tally_memory', lambda: tally_model().stats() if enabled() else {'enabled': False})
@@ -0,0 +1,269 @@
+"""
+"Polls you might like": item-item recommendations computed offline.
+
+Similarity blends two cosines. Co-voting compares the columns of a sparse
+users x polls matrix: two polls are alike when the same people vote in
+both. Tags compare IDF-weighted tag vectors, which also places polls with
+no votes yet. Rows are processed in blocks, each one a couple of sparse
+products followed by a per-row top-K, so memory stays bounded however many
+polls there are. The K best neighbours of every poll land in
+``PollSimilarity``, and serving them is one indexed read.
+
+A refresh only recomputes the polls touched since the last run: polls with
+new vote events or ballots, and new polls. For those it loads the votes of
+their voters alone. Where the last run left off is kept in
+``RecommendationMark``, apart from the neighbour rows, so polls that end up
+with no neighbours still count as done. Voter counts are read only for the
+polls those voters voted in. Neighbour lists of untouched polls drift
+slowly; a periodic ``--full`` run resets them.
+"""
+import time
+from itertools import chain
+
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+from scipy import sparse
+from taggit.models import TaggedItem
+
+from .models import Ballot, Choice, Poll, PollSimilarity, RecommendationMark
+from .voting import Vote, VoteEvent
+
+DEFAULT_K = 10
+TAG_WEIGHT = 0.3
+
+
+def refresh(full=False, k=DEFAULT_K, tag_weight=TAG_WEIGHT, batch_size=2000):
+    """Recompute neighbour lists (all, or those touched since the last run); returns how many"""
+    started = timezone.now()
+    poll_ids = np.array(sorted(Poll.objects.filter(is_active=True).values_list('pk', flat=True)), dtype=np.int64)
+    through = VoteEvent.objects.aggregate(m=Max('id'))['m'] or 0
+    last = RecommendationMark.objects.first()
+
+    if full or last is None:
+        rows = np.arange(len(poll_ids))
+        users, polls = load_votes(poll_ids)
+        voters = None
+    else:
+        touched = _touched_polls(last.through_event, last.started_at)
+        rows = np.flatnonzero(np.isin(poll_ids, list(touched)))
+        if not len(rows):
+            _store(poll_ids, rows, None, None, through, started)
+            return 0
+        users, polls = load_votes(poll_ids, voters_of=poll_ids[rows].tolist())
+        voters = _voter_counts(poll_ids, np.unique(polls))
+
+    x = vote_matrix(users, polls, len(poll_ids))
+    tags = tag_matrix(poll_ids)
+    neighbors, scores = top_k_similar(x, tags, rows, k=k, tag_weight=tag_weight,
+                                      voters=voters, batch_size=batch_size)
+    _store(poll_ids, rows, neighbors, scores, through, started)
+    return len(rows)
+
+
+def top_k_similar(x, tags, rows, k=DEFAULT_K, tag_weight=TAG_WEIGHT, voters=None, batch_size=2000):
+    """
+    Top-k neighbours of the given poll indices.
+
+    ``x`` is the users x polls 0/1 matrix, ``tags`` the polls x tags matrix
+    with L2-normalised rows, ``voters`` each poll's voter count (defaults
+    to the column sums of ``x``). Returns ``(neighbors, scores)``, both
+    ``len(rows) x k``, padded with -1 and 0 where a poll has fewer than k
+    similar polls.
+    """
+    if voters is None:
+        voters = np.asarray(x.sum(axis=0)).ravel()
+    inv_norm = np.divide(1.0, np.sqrt(voters), out=np.zeros(len(voters)), where=voters > 0)
+    by_poll = x.T.tocsr()
+    tags_t = tags.T.tocsc()
+
+    neighbors = np.full((len(rows), k), -1, dtype=np.int64)
+    scores = np.zeros((len(rows), k), dtype=np.float32)
+    for start in range(0, len(rows), batch_size):
+        block = rows[start:start + batch_size]
+        covote = sparse.diags(inv_norm[block]) @ (by_poll[block] @ x) @ sparse.diags(inv_norm)
+        similar = ((1 - tag_weight) * covote + tag_weight * (tags[block] @ tags_t)).tocsr()
+        for i, poll in enumerate(block):
+            lo, hi = similar.indptr[i], similar.indptr[i + 1]
+            cols, vals = similar.indices[lo:hi], similar.data[lo:hi]
+            keep = (cols != poll) & (vals > 0)
+            cols, vals = cols[keep], vals[keep]
+            if len(vals) > k:
+                best = np.argpartition(-vals, k)[:k]
+                cols, vals = cols[best], vals[best]
+            order = np.argsort(-vals, kind='stable')
+            neighbors[start + i, :len(order)] = cols[order]
+            scores[start + i, :len(order)] = vals[order]
+    return neighbors, scores
+
+
+def vote_matrix(users, polls, n_polls):
+    """Sparse users x polls 0/1 matrix from parallel arrays of user ids and poll indices"""
+    user_ids, rows = np.unique(users, return_inverse=True)
+    x = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, polls)), shape=(len(user_ids), n_polls)
+    )
+    x.sum_duplicates()
+    x.data[:] = 1
+    return x
+
+
+def tag_matrix(poll_ids):
+    """Sparse polls x tags matrix, IDF-weighted with L2-normalised rows"""
+    links = TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(Poll), object_id__in=poll_ids.tolist()
+    ).values_list('object_id', 'tag_id')
+    flat = np.fromiter(chain.from_iterable(links.order_by().iterator(chunk_size=10000)), dtype=np.int64)
+    polls, tag_ids = np.searchsorted(poll_ids, flat[0::2]), flat[1::2]
+    return normalized_tags(polls, tag_ids, len(poll_ids))
+
+
+def normalized_tags(polls, tag_ids, n_polls):
+    _, cols = np.unique(tag_ids, return_inverse=True)
+    n_tags = cols.max() + 1 if len(cols) else 0
+    tags = sparse.csr_matrix((np.ones(len(cols), dtype=np.float32), (polls, cols)), shape=(n_polls, n_tags))
+    tags.sum_duplicates()
+    tags.data[:] = 1
+    idf = np.log((1 + n_polls) / (1 + np.asarray(tags.sum(axis=0)).ravel())) + 1
+    tags = tags @ sparse.diags(idf.astype(np.float32))
+    norms = np.sqrt(np.asarray(tags.multiply(tags).sum(axis=1)).ravel())
+    return (sparse.diags(np.divide(1.0, norms, out=np.zeros(n_polls), where=norms > 0)) @ tags).tocsr()
+
+
+def load_votes(poll_ids, voters_of=None):
+    """(user ids, poll indices) of every vote and ballot, or only those of ``voters_of``'s voters"""
+    ct = ContentType.objects.get_for_model(Choice)
+    choice_ids, choice_polls = _choice_polls(poll_ids)
+    votes = Vote.objects.filter(content_type=ct)
+    ballots = Ballot.objects.all()
+    if voters_of is not None:
+        chosen = Choice.objects.filter(poll_id__in=voters_of).values('pk')
+        voter_ids = (
+            Vote.objects.filter(content_type=ct, object_id__in=chosen).values('user_id')
+            .union(Ballot.objects.filter(poll_id__in=voters_of).values('user_id'))
+        )
+        votes = votes.filter(user_id__in=voter_ids)
+        ballots = ballots.filter(user_id__in=voter_ids)
+
+    vote_flat = _fetch(votes.values_list('user_id', 'object_id'))
+    users, choices = vote_flat[0::2], vote_flat[1::2]
+    at = np.clip(np.searchsorted(choice_ids, choices), 0, max(len(choice_ids) - 1, 0))
+    known = (choice_ids[at] == choices) if len(choice_ids) else np.zeros(len(choices), dtype=bool)
+    vote_users, vote_polls = users[known], choice_polls[at[known]]
+
+    ballot_flat = _fetch(ballots.values_list('user_id', 'poll_id'))
+    ballot_users, ballot_polls = ballot_flat[0::2], ballot_flat[1::2]
+    polls = np.concatenate([vote_polls, ballot_polls])
+    users = np.concatenate([vote_users, ballot_users])
+    # Keep active polls only, as indices into poll_ids
+    at = np.clip(np.searchsorted(poll_ids, polls), 0, max(len(poll_ids) - 1, 0))
+    active = (poll_ids[at] == polls) if len(poll_ids) else np.zeros(len(polls), dtype=bool)
+    return users[active], at[active]
+
+
+def _fetch(rows):
+    return np.fromiter(chain.from_iterable(rows.order_by().iterator(chunk_size=10000)), dtype=np.int64)
+
+
+def _choice_polls(poll_ids):
+    """(sorted choice ids, their poll ids)"""
+    flat = _fetch(Choice.objects.filter(poll_id__in=poll_ids.tolist()).values_list('id', 'poll_id'))
+    ids, polls = flat[0::2], flat[1::2]
+    order = np.argsort(ids)
+    return ids[order], polls[order]
+
+
+def _voter_counts(poll_ids, columns):
+    """
+    Voters per poll, aligned with poll_ids.
+
+    Only the polls at the ``columns`` indices are counted (the polls the
+    loaded voters voted in, the only ones the co-vote product reaches);
+    the rest stay 0.
+    """
+    ct = ContentType.objects.get_for_model(Choice)
+    wanted = poll_ids[columns].tolist()
+    choice_polls = dict(Choice.objects.filter(poll_id__in=wanted).values_list('pk', 'poll_id'))
+    per_choice = (
+        Vote.objects.filter(content_type=ct, object_id__in=Choice.objects.filter(poll_id__in=wanted).values('pk'))
+        .values('object_id').annotate(n=Count('id')).order_by().values_list('object_id', 'n')
+    )
+    counts = dict.fromkeys(wanted, 0)
+    for choice_id, n in per_choice:
+        counts[choice_polls[choice_id]] += n
+    ballots = Ballot.objects.filter(poll_id__in=wanted).values('poll_id').annotate(n=Count('id'))
+    for poll_id, n in ballots.order_by().values_list('poll_id', 'n'):
+        counts[poll_id] += n
+    voters = np.zeros(len(poll_ids), dtype=np.float64)
+    voters[columns] = [counts[pk] for pk in wanted]
+    return voters
+
+
+def _touched_polls(through_event, since):
+    """Polls with vote events after the event mark, ballots or creation after ``since``"""
+    changed_choices = VoteEvent.objects.filter(
+        id__gt=through_event, content_type=ContentType.objects.get_for_model(Choice)
+    ).values('object_id')
+    touched = set(Choice.objects.filter(pk__in=changed_choices).values_list('poll_id', flat=True))
+    touched.update(Ballot.objects.filter(updated_at__gt=since).values_list('poll_id', flat=True))
+    touched.update(Poll.objects.filter(created_at__gt=since).values_list('pk', flat=True))
+    return touched
+
+
+def _store(poll_ids, rows, neighbors, scores, through, started):
+    """Replace the neighbour lists of the refreshed polls and move the mark on"""
+    refreshed = poll_ids[rows].tolist()
+    with transaction.atomic():
+        for start in range(0, len(refreshed), 5000):
+            PollSimilarity.objects.filter(poll_id__in=refreshed[start:start + 5000]).delete()
+        if refreshed:
+            PollSimilarity.objects.bulk_create(
+                (
+                    PollSimilarity(poll_id=poll, neighbor_id=int(poll_ids[neighbor]), rank=rank,
+                                   score=float(score), through_event=through)
+                    for poll, row_neighbors, row_scores in zip(refreshed, neighbors, scores)
+                    for rank, (neighbor, score) in enumerate(zip(row_neighbors, row_scores), start=1)
+                    if neighbor >= 0
+                ),
+                batch_size=5000,
+            )
+        RecommendationMark.objects.update_or_create(
+            pk=1, defaults={'through_event': through, 'started_at': started}
+        )
+
+
+def benchmark(users=1_000_000, polls=100_000, votes_per_user=20, tags=2_000, k=DEFAULT_K,
+              sample=None, batch_size=2000, seed=0):
+    """
+    Time the similarity computation on synthetic data, without the database.
+
+    Poll popularity and tag frequency follow a Zipf-like curve, as real
+    traffic does. ``sample`` computes that many rows and extrapolates.
+    Returns a dict of timings.
+    """
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    popularity = 1 / np.arange(1, polls + 1) ** 0.8
+    n_votes = users * votes_per_user
+    vote_users = rng.integers(0, users, n_votes)
+    vote_polls = rng.choice(polls, n_votes, p=popularity / popularity.sum())
+    x = vote_matrix(vote_users, vote_polls, polls)
+    tag_popularity = 1 / np.arange(1, tags + 1)
+    tag_polls = np.repeat(np.arange(polls), 3)
+    tag_ids = rng.choice(tags, len(tag_polls), p=tag_popularity / tag_popularity.sum())
+    tag_m = normalized_tags(tag_polls, tag_ids, polls)
+    built = time.perf_counter()
+
+    rows = np.arange(polls) if sample is None else rng.choice(polls, min(sample, polls), replace=False)
+    top_k_similar(x, tag_m, rows, k=k, batch_size=batch_size)
+    computed = time.perf_counter()
+    per_row = (computed - built) / len(rows)
+    return {
+        'users': users, 'polls': polls, 'votes': int(x.nnz), 'rows_computed': len(rows),
+        'build_seconds': round(built - started, 2),
+        'compute_seconds': round(computed - built, 2),
+        'estimated_full_seconds': round(per_row * polls, 1),
+        'matrix_mb': round((x.data.nbytes + x.indices.nbytes + x.indptr.nbytes) / 2**20, 1),
+    }
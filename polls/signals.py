@@ -0,0 +1,70 @@
+"""
+Cache invalidation hooks for votes and poll edits.
+
+Both bump the poll's vote version (fragments and its detail page) and the
+list generation (poll list pages show titles, tags and vote totals). A
+vote also evicts the voter's entry from every process's choice cache, and
+has this process's in-memory tallies catch up before their next read.
+Edits also drop the poll's pinned results if it is hot; votes on a hot
+poll show once its pins are recomputed.
+
+Shared state moves on only once the transaction commits: bumped earlier, a
+request could render the old rows and cache them under the new version.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import readmodel
+from .cache import bump_list_generation, bump_vote_version
+from .choicecache import choice_cache
+from .hotpolls import hot_polls
+from .loaders import VoteLoader
+from .models import Poll, Choice, ballot_cast
+from .voting import vote_changed
+
+
+@receiver(vote_changed, sender=Choice)
+def choice_vote_changed(sender, instance, user, **kwargs):
+    poll_id, user_id = instance.poll_id, user.pk
+    
+    def expire():
+        bump_vote_version(poll_id)
+        bump_list_generation()
+        shared = choice_cache()
+        if shared.enabled:
+            shared.invalidate([(user_id, poll_id)])
+        readmodel.expire()
+    
+    transaction.on_commit(expire)
+    loader = VoteLoader.current()
+    if loader:
+        loader.voted(poll_id)
+
+
+@receiver(ballot_cast, sender=Poll)
+def poll_ballot_cast(sender, instance, **kwargs):
+    transaction.on_commit(lambda poll_id=instance.pk: _bump(poll_id))
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda poll_id=instance.poll_id: _bump(poll_id, unpin=True))
+    loader = VoteLoader.current()
+    if loader:
+        loader.forget(instance.poll_id)
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+def poll_changed(sender, instance, **kwargs):
+    # Bound now: a deleted poll's pk is cleared before the commit
+    transaction.on_commit(lambda poll_id=instance.pk: _bump(poll_id, unpin=True))
+
+
+def _bump(poll_id, unpin=False):
+    bump_vote_version(poll_id)
+    bump_list_generation()
+    if unpin:
+        hot_polls().unpin(poll_id)
@@ -0,0 +1,50 @@
+"""
+Aggregate maintenance jobs for the queue in polls.jobs.
+
+Anything that reacts to a vote can ``enqueue('recompute_poll', poll_id=...)``
+freely: while one is pending, further requests for the same poll coalesce.
+"""
+from django.contrib.contenttypes.models import ContentType
+
+from .jobs import job
+from .models import Poll, Choice
+from .voting import compact_counters, take_snapshots
+
+
+@job('recompute_poll')
+def recompute_poll(poll_id):
+    """Refresh one poll's stored aggregates: its tally snapshot or cached ballot tally"""
+    poll = Poll.objects.filter(pk=poll_id).first()
+    if poll is None:
+        return
+    if poll.uses_ballots:
+        poll.tally()
+    else:
+        ct = ContentType.objects.get_for_model(Choice)
+        take_snapshots(ct, list(poll.choices.values_list('pk', flat=True)))
+
+
+@job('snapshot_tallies')
+def snapshot_tallies():
+    from .management.commands.snapshot_tallies import snapshot_polls
+    snapshot_polls(Poll.objects.filter(poll_type=Poll.SINGLE))
+
+
+@job('compute_crosstab')
+def compute_crosstab(poll_id, other_id):
+    """Compute and store the crosstab of a pair of active polls"""
+    from .crosstab import crosstab  # NumPy/SciPy stay out of web processes
+    polls = Poll.objects.filter(is_active=True).in_bulk([poll_id, other_id])
+    if len(polls) == 2:
+        crosstab(polls[poll_id], polls[other_id])
+
+
+@job('compact_vote_counters')
+def compact_vote_counters():
+    compact_counters()
+
+
+@job('compute_recommendations')
+def compute_recommendations():
+    from .recommend import refresh  # NumPy/SciPy stay out of web processes
+    refresh()
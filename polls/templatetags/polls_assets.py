@@ -0,0 +1,11 @@
+from django import template
+
+from polls.assets import vendor_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def vendor_static(name):
+    """{% vendor_static 'vendor/bootstrap/bootstrap.min.css' %}"""
+    return vendor_url(name)
@@ -1,4 +1,6 @@
-from django.test import TestCase, Client
+import json
+from io import StringIO
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
 from .models import Poll, Choice
@@ -164,4 +166,1426 @@ class PollViewTest(TestCase):
             {'choice': choice2.pk}
         )
         self.assertFalse(self.choice.votes.exists(self.user))
-        self.assertTrue(choice2.votes.exists(self.user))
\ No newline at end of file
+        self.assertTrue(choice2.votes.exists(self.user))
+
+class ComponentCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from .cache import render_stats
+        cache.clear()
+        render_stats.reset()
+        self.user = User.objects.create_user(username='voter', password='pass')
+        self.poll = Poll.objects.create(
+            title='Cached Poll',
+            description='Test Description',
+            created_by=self.user
+        )
+        self.choice = Choice.objects.create(poll=self.poll, text='Only Choice')
+    
+    def render_results(self):
+        from .components.poll_results import PollResultsComponent
+        return PollResultsComponent.render(kwargs={'poll': self.poll})
+    
+    def test_repeat_render_is_a_cache_hit(self):
+        from .cache import render_stats
+        self.render_results()
+        with self.assertNumQueries(0):
+            self.assertIn('0 votes', self.render_results())
+        stats = render_stats.snapshot()['PollResultsComponent']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_vote_invalidates_fragment(self):
+        self.assertIn('0 votes', self.render_results())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice.votes.up(self.user)
+        self.assertIn('1 vote', self.render_results())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice.votes.delete(self.user)
+        self.assertIn('0 votes', self.render_results())
+    
+    def test_list_page_renders_cards_from_cache(self):
+        from .cache import render_stats
+        self.client.login(username='voter', password='pass')
+        self.client.get(reverse('polls:list'))
+        self.client.get(reverse('polls:list'))
+        stats = render_stats.snapshot()['PollCardComponent']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+    
+    def test_metrics_requires_staff(self):
+        self.client.login(username='voter', password='pass')
+        self.assertEqual(self.client.get(reverse('polls:metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('polls:metrics'))
+        self.assertIn('component_cache', response.json())
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(username='voter', password='pass')
+        self.poll = Poll.objects.create(
+            title='Cached Poll',
+            description='Test Description',
+            created_by=self.user
+        )
+        self.choice = Choice.objects.create(poll=self.poll, text='Only Choice')
+        self.detail_url = reverse('polls:detail', kwargs={'pk': self.poll.pk})
+    
+    def test_anonymous_detail_page_is_cached_until_a_vote(self):
+        self.assertEqual(self.client.get(self.detail_url)['X-Page-Cache'], 'miss')
+        self.assertEqual(self.client.get(self.detail_url)['X-Page-Cache'], 'hit')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice.votes.up(self.user)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, '1 vote')
+    
+    def test_list_key_normalizes_filter_query(self):
+        url = reverse('polls:list')
+        self.client.get(url + '?title=cached&tags=')
+        self.assertEqual(self.client.get(url + '?title=cached')['X-Page-Cache'], 'hit')
+        self.assertEqual(self.client.get(url + '?title=other')['X-Page-Cache'], 'miss')
+        self.assertNotIn('X-Page-Cache', self.client.get(url + '?utm_source=x'))
+    
+    def test_new_poll_invalidates_list_pages(self):
+        url = reverse('polls:list')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Poll.objects.create(title='Fresh Poll', description='New', created_by=self.user)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Fresh Poll')
+    
+    def test_edits_invalidate_once_committed(self):
+        from .cache import list_generation, vote_version
+        before = (vote_version(self.poll.pk), list_generation())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poll.title = 'Renamed'
+            self.poll.save()
+            Choice.objects.create(poll=self.poll, text='Second Choice')
+            self.assertEqual((vote_version(self.poll.pk), list_generation()), before)
+        self.assertNotEqual(vote_version(self.poll.pk), before[0])
+        self.assertNotEqual(list_generation(), before[1])
+    
+    def test_authenticated_users_bypass_cache(self):
+        self.client.get(self.detail_url)
+        self.client.login(username='voter', password='pass')
+        response = self.client.get(self.detail_url)
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+
+class VoteLoaderTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter', password='pass')
+        self.poll = Poll.objects.create(
+            title='Loader Poll',
+            description='Test Description',
+            created_by=self.user
+        )
+        self.choices = [Choice.objects.create(poll=self.poll, text=f'Choice {i}') for i in range(2)]
+        self.client.login(username='voter', password='pass')
+    
+    def detail_queries(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('polls:detail', kwargs={'pk': self.poll.pk}))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx)
+    
+    def test_detail_queries_independent_of_choice_count(self):
+        self.choices[0].votes.up(self.user)
+        baseline = self.detail_queries()
+        for i in range(6):
+            Choice.objects.create(poll=self.poll, text=f'Extra {i}')
+        self.assertEqual(self.detail_queries(), baseline)
+    
+    def test_loader_memoizes_and_forgets_on_vote(self):
+        from .loaders import VoteLoader
+        loader = VoteLoader()
+        token = loader.activate()
+        try:
+            # counts (choice ids + tallies), then the choices themselves
+            with self.assertNumQueries(3):
+                self.assertEqual(self.poll.total_votes, 0)
+                self.assertEqual(self.poll.get_results()[0]['count'], 0)
+            self.assertIsNone(self.poll.user_vote(self.user))
+            self.choices[1].votes.up(self.user)
+            self.assertEqual(self.poll.total_votes, 1)
+            self.assertEqual(self.poll.user_vote(self.user), self.choices[1])
+        finally:
+            loader.deactivate(token)
+    
+    def test_list_page_batches_counts_across_polls(self):
+        from .loaders import VoteLoader
+        other = Poll.objects.create(title='Other', description='Other', created_by=self.user)
+        Choice.objects.create(poll=other, text='Yes')
+        loader = VoteLoader()
+        loader.want([self.poll, other])
+        with self.assertNumQueries(2):
+            loader.counts(self.poll)
+            loader.counts(other)
+
+
+class PollImportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='importer', password='pass')
+    
+    def run_import(self, text, batch_size=500):
+        import io
+        from .importer import PollImporter, iter_records
+        importer = PollImporter(self.user, batch_size=batch_size)
+        return list(importer.run(iter_records(io.StringIO(text))))
+    
+    def test_ndjson_import_reports_each_record(self):
+        reports = self.run_import(
+            '{"title": "Tea or coffee?", "description": "Morning", "choices": ["Tea", "Coffee"], "tags": ["Food", "drinks"]}\n'
+            'not json\n'
+            '{"title": "One choice", "description": "Bad", "choices": ["Only"]}\n'
+        )
+        self.assertEqual([r['status'] for r in reports], ['created', 'error', 'error'])
+        self.assertIn('choices', reports[2]['errors'])
+        poll = Poll.objects.get(pk=reports[0]['id'])
+        self.assertEqual([c.text for c in poll.choices.all()], ['Tea', 'Coffee'])
+        self.assertEqual(sorted(poll.tags.names()), ['Food', 'drinks'])
+    
+    def test_json_array_import_in_batches_reuses_tags(self):
+        import json
+        records = [
+            {'title': f'Poll {i}', 'description': 'Bulk', 'choices': ['A', 'B'], 'tags': ['bulk', 'BULK']}
+            for i in range(5)
+        ]
+        reports = self.run_import(json.dumps(records), batch_size=2)
+        self.assertEqual([r['record'] for r in reports], [1, 2, 3, 4, 5])
+        self.assertTrue(all(r['status'] == 'created' for r in reports))
+        self.assertEqual(Choice.objects.count(), 10)
+        from taggit.models import Tag
+        self.assertEqual(Tag.objects.filter(name__iexact='bulk').count(), 1)
+    
+    def test_malformed_array_element_is_reported_alone(self):
+        import io
+        from .importer import iter_records
+        good = '{"title": "Poll %d", "description": "D", "choices": ["A", "B"]}'
+        text = '[%s, {"title": "Bad", "choices": ["a, }", ]}, %s, {"title" 1}, %s]' % (good % 1, good % 2, good % 3)
+        reports = self.run_import(text)
+        self.assertEqual([r['status'] for r in reports], ['created', 'error', 'created', 'error', 'created'])
+        self.assertIn('Invalid JSON', reports[1]['errors']['__all__'][0])
+        self.assertEqual(Poll.objects.filter(title__startswith='Poll').count(), 3)
+        
+        class Trickle(io.StringIO):
+            def read(self, size=-1):
+                return super().read(7)  # elements straddle reads
+        
+        records = list(iter_records(Trickle(text)))
+        self.assertEqual([type(r).__name__ for r in records], ['dict', 'RecordError', 'dict', 'RecordError', 'dict'])
+    
+    def test_batch_query_count_is_constant(self):
+        import json
+        line = json.dumps({'title': 'P', 'description': 'D', 'choices': ['A', 'B'], 'tags': ['t']})
+        with self.assertNumQueries(9):
+            self.run_import('\n'.join([line] * 20))
+    
+    def test_import_endpoint_requires_permission(self):
+        self.client.login(username='importer', password='pass')
+        url = reverse('polls:import')
+        body = '{"title": "T", "description": "D", "choices": ["A", "B"]}\n'
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 403)
+        
+        from django.contrib.auth.models import Permission
+        self.user.user_permissions.add(Permission.objects.get(codename='add_poll'))
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+        report = b''.join(response.streaming_content).decode()
+        self.assertIn('"created"', report)
+        
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='importer', password='pass')
+        self.assertEqual(client.post(url, body, content_type='application/x-ndjson').status_code, 403)
+        token = client.get(url).json()['csrftoken']
+        response = client.post(url, body, content_type='application/x-ndjson', HTTP_X_CSRFTOKEN=token)
+        self.assertIn('"created"', b''.join(response.streaming_content).decode())
+    
+    def test_poll_form_creates_choices_in_bulk(self):
+        from .forms import PollForm
+        form = PollForm(data={'title': 'Form Poll', 'description': 'D', 'poll_type': 'single', 'tags': 'a, b', 'choices': 'X\n\nY\n'})
+        self.assertTrue(form.is_valid(), form.errors)
+        poll = form.save(user=self.user)
+        self.assertEqual([c.text for c in poll.choices.all()], ['X', 'Y'])
+
+
+@override_settings(VOTE_COUNTER_SHARDS=8)
+class VoteCounterShardTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(5)]
+        self.poll = Poll.objects.create(title='Viral', description='Hot', created_by=self.users[0])
+        self.choice1 = Choice.objects.create(poll=self.poll, text='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, text='Choice 2')
+        for user in self.users:
+            self.choice1.votes.up(user)
+        self.choice2.votes.up(self.users[0])
+        self.choice1.votes.delete(self.users[1])
+    
+    def shard_totals(self):
+        from django.contrib.contenttypes.models import ContentType
+        from .voting import count_shards
+        return count_shards(ContentType.objects.get_for_model(Choice), [self.choice1.pk, self.choice2.pk])
+    
+    def test_counters_track_votes(self):
+        self.assertEqual(self.shard_totals(), {self.choice1.pk: 4, self.choice2.pk: 1})
+    
+    def test_shards_backend_matches_vote_rows(self):
+        expected = [r['count'] for r in self.poll.get_results()]
+        with self.settings(VOTE_TALLY_BACKEND='shards'):
+            self.assertEqual([r['count'] for r in self.poll.get_results()], expected)
+    
+    def test_compaction_keeps_totals_in_one_row(self):
+        from .voting import VoteCounterShard, compact_counters
+        compact_counters()
+        self.assertEqual(self.shard_totals(), {self.choice1.pk: 4, self.choice2.pk: 1})
+        self.assertFalse(VoteCounterShard.objects.exclude(shard=0).exists())
+    
+    def test_rebuild_recounts_from_vote_rows(self):
+        from .voting import Vote, rebuild_counters
+        Vote.objects.filter(object_id=self.choice2.pk).delete()  # bypasses the counters
+        rebuild_counters()
+        self.assertEqual(self.shard_totals(), {self.choice1.pk: 4})
+
+
+class BallotPollTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(5)]
+        self.poll = Poll.objects.create(
+            title='Best fruit', description='Ranked', created_by=self.users[0], poll_type=Poll.RANKED
+        )
+        self.apple, self.banana, self.cherry = [
+            Choice.objects.create(poll=self.poll, text=text) for text in ('Apple', 'Banana', 'Cherry')
+        ]
+    
+    def test_instant_runoff_transfers_eliminated_preferences(self):
+        ballots = [
+            [self.apple, self.banana],
+            [self.apple],
+            [self.banana, self.apple],
+            [self.cherry, self.banana],
+            [self.cherry, self.banana],
+        ]
+        for user, ranking in zip(self.users, ballots):
+            self.poll.cast_ballot(user, ranking)
+        
+        tally = self.poll.tally()
+        self.assertEqual(tally['ballots'], 5)
+        self.assertEqual(tally['rounds'][0]['eliminated'], [self.banana.pk])
+        self.assertEqual(tally['counts'], {self.apple.pk: 3, self.banana.pk: 0, self.cherry.pk: 2})
+        self.assertEqual(tally['winner'], self.apple.pk)
+    
+    def test_approval_counts_every_marked_choice(self):
+        self.poll.poll_type = Poll.APPROVAL
+        self.poll.save()
+        self.poll.cast_ballot(self.users[0], [self.apple, self.banana])
+        self.poll.cast_ballot(self.users[1], [self.banana])
+        results = {r['choice'].text: r['count'] for r in self.poll.get_results()}
+        self.assertEqual(results, {'Apple': 1, 'Banana': 2, 'Cherry': 0})
+        self.assertEqual(self.poll.total_votes, 2)
+    
+    def test_tally_is_cached_until_next_ballot(self):
+        self.poll.cast_ballot(self.users[0], [self.cherry])
+        self.poll.tally()
+        with self.assertNumQueries(0):
+            self.poll.tally()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poll.cast_ballot(self.users[0], [self.apple])  # replaces the ballot
+        self.assertEqual(self.poll.tally()['winner'], self.apple.pk)
+    
+    def test_ranked_vote_view(self):
+        self.client.login(username='user1', password='pass')
+        response = self.client.post(
+            reverse('polls:vote', kwargs={'pk': self.poll.pk}),
+            {f'rank_{self.cherry.pk}': 1, f'rank_{self.apple.pk}': 2}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.poll.user_ballot(self.users[1]), [self.cherry.pk, self.apple.pk])
+        response = self.client.get(reverse('polls:detail', kwargs={'pk': self.poll.pk}))
+        self.assertContains(response, 'Winner: <strong>Cherry</strong>')
+    
+    def test_duplicate_ranks_are_rejected(self):
+        from .forms import BallotForm
+        form = BallotForm(self.poll, self.users[0], data={
+            f'rank_{self.apple.pk}': 1, f'rank_{self.banana.pk}': 1,
+        })
+        self.assertFalse(form.is_valid())
+
+
+class TallySnapshotTest(TestCase):
+    def setUp(self):
+        from django.contrib.contenttypes.models import ContentType
+        self.ct = ContentType.objects.get_for_model(Choice)
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(4)]
+        self.poll = Poll.objects.create(title='Snap', description='Shot', created_by=self.users[0])
+        self.choice1 = Choice.objects.create(poll=self.poll, text='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, text='Choice 2')
+        for user in self.users[:3]:
+            self.choice1.votes.up(user)
+    
+    def counts(self):
+        from .voting import count_snapshots
+        return count_snapshots(self.ct, [self.choice1.pk, self.choice2.pk])
+    
+    def test_snapshot_plus_delta_matches_live_count(self):
+        from django.core.management import call_command
+        from .voting import VoteTombstone
+        call_command('snapshot_tallies', stdout=StringIO())
+        self.assertFalse(VoteTombstone.objects.exists())
+        
+        self.choice1.votes.delete(self.users[0])   # counted by the snapshot
+        self.choice2.votes.up(self.users[0])        # after the snapshot
+        self.choice2.votes.up(self.users[3])
+        self.choice2.votes.delete(self.users[3])    # added and removed since
+        self.assertEqual(self.counts(), {self.choice1.pk: 2, self.choice2.pk: 1})
+        
+        with self.settings(VOTE_TALLY_BACKEND='snapshot'):
+            self.assertEqual([r['count'] for r in self.poll.get_results()], [2, 1])
+    
+    def test_delta_reads_only_recent_activity(self):
+        from .voting import take_snapshots
+        take_snapshots(self.ct, [self.choice1.pk, self.choice2.pk])
+        # snapshots + votes since + tombstones since, whatever the history size
+        with self.assertNumQueries(3):
+            self.assertEqual(self.counts(), {self.choice1.pk: 3, self.choice2.pk: 0})
+    
+    def test_unsnapshotted_objects_fall_back_to_a_full_count(self):
+        self.assertEqual(self.counts(), {self.choice1.pk: 3})
+    
+    def test_votes_committed_after_the_snapshot_still_count(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .voting import TallySnapshot, take_snapshots
+        take_snapshots(self.ct, [self.choice1.pk, self.choice2.pk])
+        # Stamped before the snapshot, committed after it
+        Vote.objects.create(user=self.users[3], content_type=self.ct, object_id=self.choice2.pk,
+                            created_at=timezone.now() - timedelta(seconds=5))
+        self.assertEqual(self.counts(), {self.choice1.pk: 3, self.choice2.pk: 1})
+        
+        with self.settings(VOTE_SNAPSHOT_GRACE=0):
+            take_snapshots(self.ct, [self.choice1.pk, self.choice2.pk])
+        self.assertEqual(TallySnapshot.objects.get(object_id=self.choice2.pk).count, 1)
+    
+    def test_recent_tombstones_are_not_subtracted_twice(self):
+        from .voting import VoteTombstone, take_snapshots
+        with self.settings(VOTE_SNAPSHOT_GRACE=0):
+            self.choice1.votes.delete(self.users[0])
+            take_snapshots(self.ct, [self.choice1.pk, self.choice2.pk])
+        # Within the overlap, so kept for the delta and compensated in the count
+        self.assertTrue(VoteTombstone.objects.exists())
+        self.assertEqual(self.counts(), {self.choice1.pk: 2, self.choice2.pk: 0})
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        from .jobs import job, registry
+        self.registry = registry
+        self.calls = []
+        
+        @job('test_record')
+        def record(**kwargs):
+            self.calls.append(kwargs)
+        
+        @job('test_explode', max_attempts=2)
+        def explode():
+            raise RuntimeError('boom')
+    
+    def tearDown(self):
+        self.registry.pop('test_record')
+        self.registry.pop('test_explode')
+    
+    def work(self):
+        from .jobs import Worker
+        with self.settings(POLLS_JOB_SCHEDULE={}):
+            Worker(mode='inline').run(once=True)
+    
+    def test_duplicate_pending_jobs_coalesce(self):
+        from .jobs import enqueue
+        first = enqueue('test_record', poll_id=42)
+        self.assertEqual(enqueue('test_record', poll_id=42), first)
+        self.assertNotEqual(enqueue('test_record', poll_id=43), first)
+        
+        self.work()
+        self.assertEqual(sorted(call['poll_id'] for call in self.calls), [42, 43])
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'done')
+        self.assertIsNotNone(first.duration)
+        # Done jobs no longer block new ones
+        self.assertNotEqual(enqueue('test_record', poll_id=42), first)
+    
+    def test_failures_retry_with_backoff_then_fail(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .jobs import enqueue, stats
+        from .models import Job
+        failing = enqueue('test_explode')
+        self.work()
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), ('pending', 1))
+        self.assertIn('boom', failing.last_error)
+        self.assertGreater(failing.run_at, timezone.now())
+        
+        Job.objects.filter(pk=failing.pk).update(run_at=timezone.now() - timedelta(seconds=1))
+        self.work()
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts), ('failed', 2))
+        self.assertEqual(stats()['test_explode']['failed'], 1)
+    
+    def test_periodic_jobs_are_queued_once_per_interval(self):
+        from .jobs import schedule_periodic
+        from .models import Job
+        with self.settings(POLLS_JOB_SCHEDULE={'test_record': 60}):
+            schedule_periodic()
+            schedule_periodic()
+        self.assertEqual(Job.objects.filter(name='test_record').count(), 1)
+    
+    def test_recompute_poll_snapshots_its_choices(self):
+        from .jobs import enqueue
+        from .voting import TallySnapshot
+        user = User.objects.create_user(username='voter', password='pass')
+        poll = Poll.objects.create(title='Jobs', description='Queue', created_by=user)
+        choice = Choice.objects.create(poll=poll, text='Yes')
+        choice.votes.up(user)
+        enqueue('recompute_poll', poll_id=poll.pk)
+        with self.settings(VOTE_SNAPSHOT_GRACE=0):
+            self.work()
+        self.assertEqual(TallySnapshot.objects.get(object_id=choice.pk).count, 1)
+
+
+class VoteEventLogTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.poll = Poll.objects.create(title='Log', description='Events', created_by=self.user1)
+        self.choice1 = Choice.objects.create(poll=self.poll, text='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, text='Choice 2')
+    
+    @override_settings(VOTE_COUNTER_SHARDS=8)
+    def test_changing_a_vote_updates_it_in_place(self):
+        from .voting import VoteEvent, count_shards
+        vote = self.choice1.votes.up(self.user1)
+        self.choice2.votes.up(self.user2)
+        moved = self.choice2.votes.change(self.user1, self.choice1)
+        self.choice2.votes.delete(self.user2)
+        
+        self.assertEqual(moved.pk, vote.pk)
+        self.assertEqual(
+            list(VoteEvent.objects.order_by('id').values_list('kind', 'object_id', 'previous_object_id')),
+            [('cast', self.choice1.pk, None), ('cast', self.choice2.pk, None),
+             ('change', self.choice2.pk, self.choice1.pk), ('retract', self.choice2.pk, None)],
+        )
+        self.assertEqual([r['count'] for r in self.poll.get_results()], [0, 1])
+        from django.contrib.contenttypes.models import ContentType
+        ct = ContentType.objects.get_for_model(Choice)
+        self.assertEqual(count_shards(ct, [self.choice1.pk, self.choice2.pk]),
+                         {self.choice1.pk: 0, self.choice2.pk: 1})
+    
+    def test_vote_view_logs_a_change(self):
+        from .voting import VoteEvent
+        self.client.login(username='user1', password='pass')
+        url = reverse('polls:vote', kwargs={'pk': self.poll.pk})
+        self.client.post(url, {'choice': self.choice1.pk})
+        self.client.post(url, {'choice': self.choice2.pk})
+        self.assertEqual(list(VoteEvent.objects.order_by('id').values_list('kind', flat=True)),
+                         ['cast', 'change'])
+        self.assertEqual(self.poll.user_vote(self.user1), self.choice2)
+    
+    def test_events_after_cursor(self):
+        from .voting import events_after
+        self.choice1.votes.up(self.user1)
+        self.choice1.votes.up(self.user2)
+        first = events_after(0, limit=1)
+        self.assertEqual([e.user_id for e in first], [self.user1.pk])
+        rest = events_after(first[-1].pk)
+        self.assertEqual([e.user_id for e in rest], [self.user2.pk])
+        self.assertEqual(events_after(rest[-1].pk), [])
+    
+    def test_replay_rebuilds_votes_from_the_log(self):
+        from django.core.management import call_command
+        from .voting import Vote
+        self.choice1.votes.up(self.user1)
+        self.choice2.votes.change(self.user1, self.choice1)
+        self.choice1.votes.up(self.user2)
+        expected = set(Vote.objects.values_list('user_id', 'object_id', 'created_at'))
+        Vote.objects.all().delete()  # a lost projection
+        
+        call_command('replay_vote_events', batch_size=2, stdout=StringIO())
+        self.assertEqual(set(Vote.objects.values_list('user_id', 'object_id', 'created_at')), expected)
+        with self.settings(VOTE_TALLY_BACKEND='shards'):
+            self.assertEqual([r['count'] for r in self.poll.get_results()], [1, 1])
+    
+    def test_deleted_accounts_keep_their_events(self):
+        from .voting import VoteEvent, VoteTombstone, replay_events
+        self.choice1.votes.up(self.user1)
+        self.choice2.votes.up(self.user2)
+        self.user2.delete()
+        self.assertEqual(list(VoteEvent.objects.order_by('id').values_list('user_id', flat=True)),
+                         [self.user1.pk, None])
+        
+        self.assertEqual(replay_events(), 1)
+        self.assertEqual([r['count'] for r in self.poll.get_results()], [1, 0])
+        self.assertFalse(VoteTombstone.objects.exists())
+
+
+class StartupProfileTest(TestCase):
+    def test_parse_importtime(self):
+        from .management.commands.startup_profile import by_package, parse_importtime
+        modules = parse_importtime([
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |     django.utils.version',
+            'import time:       300 |        420 |   django',
+            'import time:        50 |         50 | polls.voting',
+        ])
+        self.assertEqual(modules[1], ('django', 300, 420))
+        self.assertEqual(by_package(modules), {'django': 420, 'polls': 50})
+    
+    def test_budgets_fail_the_command(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, 'peak RSS'):
+            call_command('startup_profile', '--json', max_rss_mb=1, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertIn('django', report['packages'])
+        self.assertGreater(report['modules'], 0)
+
+
+class StaticAssetTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from pathlib import Path
+        from .assets import vendor_assets
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.mirror, self.static, self.root = self.tmp / 'npm', self.tmp / 'static', self.tmp / 'root'
+        for remote in vendor_assets().values():
+            path = self.mirror / remote
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if remote.endswith('icons.min.css'):
+                body = '.bi::before{content:"";src:url("./fonts/bootstrap-icons.woff2?24e3")}\n' * 40
+                path.write_text(body + '/*# sourceMappingURL=bootstrap-icons.min.css.map */\n')
+            elif remote.endswith('.css'):
+                body = '.btn{color:var(--bs-btn-color);background:url("data:image/svg+xml,%3csvg%3e")}\n' * 40
+                path.write_text(body + '/*# sourceMappingURL=bootstrap.min.css.map */\n')
+            elif remote.endswith('.js'):
+                path.write_text('console.log("bootstrap");\n' * 40 + '//# sourceMappingURL=bootstrap.bundle.min.js.map\n')
+            else:
+                path.write_bytes(b'wOF2' + bytes(range(256)))
+    
+    def collect(self):
+        from django.core.management import call_command
+        from . import assets
+        call_command('vendor_assets', source=str(self.mirror), dest=str(self.static), stdout=StringIO())
+        call_command('collectstatic', interactive=False, verbosity=0)
+        assets._fingerprinted_names.cache_clear()
+        self.addCleanup(assets._fingerprinted_names.cache_clear)
+    
+    def static_settings(self):
+        return self.settings(
+            STATICFILES_DIRS=[self.static], STATIC_ROOT=self.root,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'polls.assets.CompressedManifestStaticFilesStorage'},
+            },
+        )
+    
+    def test_collectstatic_fingerprints_and_precompresses(self):
+        import json as json_
+        with self.static_settings():
+            self.collect()
+            manifest = json_.loads((self.root / 'staticfiles.json').read_text())['paths']
+            css = manifest['vendor/bootstrap/bootstrap.min.css']
+            self.assertRegex(css, r'bootstrap\.min\.[0-9a-f]{12}\.css$')
+            self.assertTrue((self.root / (css + '.gz')).exists())
+            self.assertFalse((self.root / (manifest['vendor/bootstrap-icons/fonts/bootstrap-icons.woff2'] + '.gz')).exists())
+            icons = (self.root / manifest['vendor/bootstrap-icons/bootstrap-icons.min.css']).read_text()
+            self.assertIn(manifest['vendor/bootstrap-icons/fonts/bootstrap-icons.woff2'].split('/')[-1], icons)
+            self.assertNotIn('sourceMappingURL', icons)
+    
+    def test_serve_picks_the_precompressed_variant(self):
+        import gzip
+        from django.test import RequestFactory
+        from .assets import serve
+        with self.static_settings():
+            self.collect()
+            from django.contrib.staticfiles.storage import staticfiles_storage
+            name = staticfiles_storage.stored_name('vendor/bootstrap/bootstrap.bundle.min.js')
+            factory = RequestFactory()
+            
+            response = serve(factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'), name)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Content-Type'], 'text/javascript')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertIn(b'bootstrap', gzip.decompress(b''.join(response.streaming_content)))
+            
+            plain = serve(factory.get('/'), name)
+            self.assertFalse(plain.has_header('Content-Encoding'))
+            unhashed = serve(factory.get('/'), 'vendor/bootstrap/bootstrap.bundle.min.js')
+            self.assertNotIn('immutable', unhashed['Cache-Control'])
+    
+    def test_templates_fall_back_to_the_cdn_until_vendored(self):
+        from .assets import vendor_url
+        vendor_url.cache_clear()
+        self.addCleanup(vendor_url.cache_clear)
+        self.assertTrue(vendor_url('vendor/bootstrap/bootstrap.min.css').startswith('https://cdn.jsdelivr.net/'))
+
+
+class VoteHistoryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='voter', password='pass')
+        self.other = User.objects.create_user(username='other', password='pass')
+        self.polls = []
+        for i in range(5):
+            poll = Poll.objects.create(title=f'Poll {i}', description='D', created_by=self.other)
+            choice = Choice.objects.create(poll=poll, text=f'Pick {i}')
+            Choice.objects.create(poll=poll, text='Other')
+            choice.votes.up(self.user)
+            self.polls.append(poll)
+        self.polls[0].choices.last().votes.up(self.other)
+    
+    def test_keyset_pages_cover_every_vote_once(self):
+        from .history import vote_history
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(2):
+                entries, cursor = vote_history(self.user, after=cursor, limit=2)
+            seen += [entry['poll'].title for entry in entries]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f'Poll {i}' for i in reversed(range(5))])
+    
+    def test_json_endpoint_and_page(self):
+        self.client.login(username='voter', password='pass')
+        data = self.client.get(reverse('polls:my_votes_api'), {'limit': 3}).json()
+        self.assertEqual([v['choice']['text'] for v in data['votes']], ['Pick 4', 'Pick 3', 'Pick 2'])
+        rest = self.client.get(reverse('polls:my_votes_api'), {'after': data['next']}).json()
+        self.assertEqual([v['poll']['title'] for v in rest['votes']], ['Poll 1', 'Poll 0'])
+        self.assertIsNone(rest['next'])
+        self.assertEqual(self.client.get(reverse('polls:my_votes_api'), {'after': 'junk'}).status_code, 400)
+        self.assertContains(self.client.get(reverse('polls:my_votes')), 'Pick 4')
+    
+    def test_list_marks_voted_polls_in_one_lookup(self):
+        from .loaders import VoteLoader
+        loader = VoteLoader()
+        with self.assertNumQueries(1):
+            voted = loader.voted_poll_ids(self.other, self.polls)
+        self.assertEqual(voted, {self.polls[0].pk})
+        
+        self.client.login(username='other', password='pass')
+        self.assertContains(self.client.get(reverse('polls:list')), 'You voted', count=1)
+
+
+class VoteExportTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(3)]
+        self.poll = Poll.objects.create(title='Export', description='Me', created_by=self.users[0])
+        self.choice1 = Choice.objects.create(poll=self.poll, text='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, text='Choice 2')
+    
+    def test_incremental_partitions_fold_to_current_votes(self):
+        import numpy as np
+        from django.core.management import call_command
+        from .export import current_votes, read_manifest, read_partitions
+        from .voting import Vote
+        self.choice1.votes.up(self.users[0])
+        self.choice1.votes.up(self.users[1])
+        self.choice1.votes.up(self.users[2])
+        self.users[2].delete()  # its event stays, without the user
+        call_command('export_votes', self.path, partition_size=2, stdout=StringIO())
+        self.assertEqual([p['rows'] for p in read_manifest(self.path)['partitions']], [2, 1])
+        
+        self.choice2.votes.change(self.users[0], self.choice1)
+        self.choice1.votes.delete(self.users[1])
+        call_command('export_votes', self.path, stdout=StringIO())
+        call_command('export_votes', self.path, stdout=StringIO())  # nothing new
+        manifest = read_manifest(self.path)
+        self.assertEqual([p['rows'] for p in manifest['partitions']], [2, 1, 2])
+        
+        first = next(read_partitions(self.path))
+        self.assertIsInstance(first['user_id'], np.memmap)
+        self.assertEqual(list(first['poll_id']), [self.poll.pk] * 2)
+        
+        votes = current_votes(self.path)
+        exported = sorted(zip(votes['user_id'].tolist(), votes['choice_id'].tolist()))
+        live = sorted(Vote.objects.values_list('user_id', 'object_id'))
+        self.assertEqual(exported, live)
+    
+    def test_events_committed_out_of_order_are_exported_late(self):
+        from django.contrib.contenttypes.models import ContentType
+        from .export import export_votes, read_columns, read_manifest
+        from .voting import VoteEvent
+        ct = ContentType.objects.get_for_model(Choice)
+        self.choice1.votes.up(self.users[0])
+        first = VoteEvent.objects.get().pk
+        # Ids first+1 and first+2 are taken by transactions that haven't committed yet
+        VoteEvent.objects.create(id=first + 3, kind='cast', user=self.users[2], content_type=ct, object_id=self.choice1.pk)
+        export_votes(self.path)
+        self.assertEqual([pk for pk, _ in read_manifest(self.path)['gaps']], [first + 1, first + 2])
+        
+        VoteEvent.objects.create(id=first + 1, kind='cast', user=self.users[1], content_type=ct, object_id=self.choice2.pk)
+        export_votes(self.path)
+        manifest = read_manifest(self.path)
+        self.assertEqual([p['rows'] for p in manifest['partitions']], [2, 1])
+        self.assertEqual([pk for pk, _ in manifest['gaps']], [first + 2])
+        self.assertEqual(sorted(read_columns(self.path)['user_id'].tolist()), [u.pk for u in self.users])
+    
+    def test_rerun_after_a_crash_and_deleted_choices(self):
+        import os
+        from .export import current_votes, export_votes, read_manifest
+        other = Poll.objects.create(title='Other', description='Gone', created_by=self.users[0])
+        doomed = Choice.objects.create(poll=other, text='Doomed')
+        gone = Choice.objects.create(poll=self.poll, text='Gone')
+        self.choice1.votes.up(self.users[0])
+        doomed.votes.up(self.users[0])
+        self.choice2.votes.up(self.users[1])
+        gone.votes.change(self.users[1], self.choice2)  # its previous choice still names the poll
+        gone_id = gone.pk
+        doomed.delete()
+        gone.delete()
+        # A partition written but never listed, as if the last run died before its manifest
+        os.makedirs(os.path.join(self.path, 'part-00000'))
+        open(os.path.join(self.path, 'part-00000', 'kind.npy'), 'w').close()
+        
+        export_votes(self.path)
+        self.assertEqual([p['rows'] for p in read_manifest(self.path)['partitions']], [3])
+        votes = current_votes(self.path)
+        self.assertEqual(sorted(zip(votes['user_id'].tolist(), votes['poll_id'].tolist(), votes['choice_id'].tolist())),
+                         [(self.users[0].pk, self.poll.pk, self.choice1.pk), (self.users[1].pk, self.poll.pk, gone_id)])
+
+
+class CrosstabTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(5)]
+        self.food = Poll.objects.create(title='Food', description='?', created_by=self.users[0])
+        self.pizza = Choice.objects.create(poll=self.food, text='Pizza')
+        self.salad = Choice.objects.create(poll=self.food, text='Salad')
+        self.drink = Poll.objects.create(title='Drink', description='?', created_by=self.users[0])
+        self.cola = Choice.objects.create(poll=self.drink, text='Cola')
+        self.water = Choice.objects.create(poll=self.drink, text='Water')
+        for user in self.users[:3]:
+            self.pizza.votes.up(user)
+            self.cola.votes.up(user)
+        self.salad.votes.up(self.users[3])
+        self.water.votes.up(self.users[3])
+        self.salad.votes.up(self.users[4])  # answered only one poll
+    
+    def test_crosstab_counts_respondents_of_both_polls(self):
+        from .crosstab import crosstab
+        result = crosstab(self.food, self.drink)
+        self.assertEqual(result['respondents'], 4)
+        self.assertEqual([row['counts'] for row in result['rows']], [[3, 0], [0, 1]])
+        self.assertEqual([row['shares'] for row in result['rows']], [[100.0, 0.0], [0.0, 100.0]])
+        self.assertEqual(result['cramers_v'], 1.0)
+    
+    def test_stored_until_either_poll_gets_a_vote(self):
+        from .crosstab import crosstab
+        from .models import PollCrosstab
+        crosstab(self.food, self.drink)
+        stored = PollCrosstab.objects.get(poll=self.food, other=self.drink)
+        self.assertFalse(stored.is_outdated())
+        self.water.votes.up(self.users[4])
+        self.assertTrue(stored.is_outdated())
+        self.assertEqual(crosstab(self.food, self.drink)['rows'][1]['counts'], [0, 2])
+        self.assertEqual(PollCrosstab.objects.count(), 1)
+    
+    def work(self):
+        from .jobs import Worker
+        with self.settings(POLLS_JOB_SCHEDULE={}):
+            Worker(mode='inline').run(once=True)
+    
+    def test_endpoint_serves_what_the_job_computed(self):
+        url = reverse('polls:crosstab', kwargs={'pk': self.food.pk, 'other_pk': self.drink.pk})
+        self.assertEqual(self.client.get(url).status_code, 403)
+        
+        self.client.login(username='user0', password='pass')
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response.json()), (202, {'pending': True}))
+        self.work()
+        self.assertEqual(self.client.get(url).json()['columns'][0]['text'], 'Cola')
+        
+        from .models import Job
+        self.water.votes.up(self.users[4])
+        self.assertEqual(self.client.get(url).json()['respondents'], 4)  # outdated, still served
+        self.assertEqual(Job.objects.filter(name='compute_crosstab', status=Job.PENDING).count(), 1)
+        self.work()
+        self.assertEqual(self.client.get(url).json()['respondents'], 5)
+        
+        same = reverse('polls:crosstab', kwargs={'pk': self.food.pk, 'other_pk': self.food.pk})
+        self.assertEqual(self.client.get(same).status_code, 400)
+        Poll.objects.filter(pk=self.drink.pk).update(is_active=False)
+        self.assertEqual(self.client.get(url).status_code, 404)
+    
+    def test_detail_page_compares_only_on_request(self):
+        detail = reverse('polls:detail', kwargs={'pk': self.food.pk})
+        self.assertNotContains(self.client.get(detail, {'compare': self.drink.pk}), 'Compare With Another Poll')
+        
+        self.client.login(username='user0', password='pass')
+        self.assertNotContains(self.client.get(detail), 'name="compare"')
+        self.assertContains(self.client.get(detail, {'compare': self.drink.pk}), 'Crunching the numbers')
+        self.work()
+        response = self.client.get(detail, {'compare': self.drink.pk})
+        self.assertContains(response, "Cramér's V")
+        self.assertContains(response, '100.0%')
+
+
+class RecommendationTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(7)]
+        self.polls = {}
+        for title in ('Food', 'Drink', 'Film', 'Music'):
+            poll = Poll.objects.create(title=title, description='?', created_by=self.users[0])
+            Choice.objects.create(poll=poll, text='Yes')
+            self.polls[title] = poll
+        for user in self.users[:3]:
+            self.vote(user, 'Food', 'Drink')
+        self.vote(self.users[3], 'Food', 'Film')
+        self.polls['Music'].tags.add('jazz')
+        self.polls['Film'].tags.add('jazz')
+    
+    def vote(self, user, *titles):
+        for title in titles:
+            self.polls[title].choices.get().votes.up(user)
+    
+    def test_neighbours_ranked_by_co_votes_and_tags(self):
+        from .recommend import refresh
+        self.assertEqual(refresh(full=True), 4)
+        self.assertEqual([p.title for p in self.polls['Food'].recommended()], ['Drink', 'Film'])
+        self.assertEqual([p.title for p in self.polls['Music'].recommended()], ['Film'])
+        
+        self.polls['Film'].is_active = False
+        self.polls['Film'].save()
+        with self.assertNumQueries(1):
+            self.assertEqual([p.title for p in self.polls['Food'].recommended()], ['Drink'])
+    
+    def test_incremental_refresh_only_touches_polls_with_new_votes(self):
+        from .models import PollSimilarity
+        from .recommend import refresh
+        refresh(full=True)
+        self.assertEqual(refresh(), 0)
+        for user in self.users[4:]:
+            self.vote(user, 'Drink', 'Film')
+        self.assertEqual(refresh(), 2)
+        self.assertEqual(self.polls['Film'].recommended()[0].title, 'Drink')
+        
+        # Voter counts read for the reached polls only score as a full run does
+        touched = PollSimilarity.objects.filter(poll__in=[self.polls['Drink'], self.polls['Film']])
+        scores = lambda: list(touched.order_by('poll_id', 'rank').values_list('poll_id', 'neighbor_id', 'score'))
+        incremental = scores()
+        refresh(full=True)
+        self.assertEqual(scores(), incremental)
+    
+    def test_polls_without_neighbours_are_not_refreshed_again(self):
+        from .recommend import refresh
+        refresh(full=True)
+        lonely = Poll.objects.create(title='Lonely', description='?', created_by=self.users[0])
+        Choice.objects.create(poll=lonely, text='Yes').votes.up(self.users[6])
+        self.assertEqual(refresh(), 1)
+        self.assertFalse(lonely.similar.exists())
+        self.assertEqual(refresh(), 0)
+    
+    def test_detail_page_lists_recommendations(self):
+        from .recommend import refresh
+        refresh(full=True)
+        response = self.client.get(reverse('polls:detail', kwargs={'pk': self.polls['Drink'].pk}))
+        self.assertContains(response, 'Polls You Might Like')
+        self.assertEqual(response.context['recommended'], [self.polls['Food']])
+
+
+@override_settings(POLLS_CHOICE_CACHE={'MAX_ENTRIES': 100})
+class ChoiceCacheTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.user = User.objects.create_user(username='voter', password='pass')
+        self.poll = Poll.objects.create(title='Cached', description='Me', created_by=self.user)
+        self.choice1 = Choice.objects.create(poll=self.poll, text='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, text='Choice 2')
+    
+    def test_choice_survives_requests_until_the_user_votes(self):
+        from .choicecache import choice_cache
+        from .loaders import VoteLoader
+        self.assertIsNone(VoteLoader().user_choice_id(self.user, self.poll))
+        with self.assertNumQueries(0):
+            self.assertIsNone(VoteLoader().user_choice_id(self.user, self.poll))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice1.votes.up(self.user)
+        self.assertEqual(VoteLoader().user_choice_id(self.user, self.poll), self.choice1.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice2.votes.change(self.user, self.choice1)
+        self.assertEqual(VoteLoader().user_choice_id(self.user, self.poll), self.choice2.pk)
+        stats = choice_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 3, 1))
+        self.assertGreater(stats['approx_bytes'], 0)
+    
+    def test_voting_reads_the_standing_vote_past_a_stale_entry(self):
+        from django.contrib.contenttypes.models import ContentType
+        from .loaders import VoteLoader
+        from .voting import Vote
+        self.enterContext(override_settings(POLLS_CHOICE_CACHE={'MAX_ENTRIES': 100}))
+        self.assertIsNone(VoteLoader().user_choice_id(self.user, self.poll))
+        # Cast elsewhere; this process has not heard about it yet
+        Vote.objects.create(user=self.user, content_type=ContentType.objects.get_for_model(Choice),
+                            object_id=self.choice1.pk)
+        
+        self.client.login(username='voter', password='pass')
+        self.client.post(reverse('polls:vote', kwargs={'pk': self.poll.pk}), {'choice': self.choice2.pk})
+        self.assertEqual(list(Vote.objects.filter(user=self.user).values_list('object_id', flat=True)),
+                         [self.choice2.pk])
+    
+    def test_size_cap_evicts_least_recently_used(self):
+        from .choicecache import _MISSING, ChoiceCache
+        cache = ChoiceCache(max_entries=2)
+        cache.fill({(1, 1): 10, (1, 2): None}, cache.mark())
+        cache.get((1, 1))
+        cache.fill({(1, 3): 30}, cache.mark())
+        self.assertIs(cache.get((1, 2)), _MISSING)
+        self.assertEqual(cache.get((1, 1)), 10)
+        self.assertEqual(cache.stats()['evictions'], 1)
+    
+    def test_fill_skips_keys_invalidated_while_reading(self):
+        from .choicecache import _MISSING, ChoiceCache
+        cache = ChoiceCache(max_entries=10)
+        since = cache.mark()
+        cache.invalidate([(1, 1)])
+        cache.fill({(1, 1): 10, (1, 2): 20}, since)
+        self.assertIs(cache.get((1, 1)), _MISSING)
+        self.assertEqual(cache.get((1, 2)), 20)
+    
+    def test_buses_carry_invalidations_between_processes(self):
+        import os
+        from .choicecache import _MISSING, ChoiceCache, FileBus, SQLiteBus
+        for bus_class, name in [(FileBus, 'bus.log'), (SQLiteBus, 'bus.sqlite3')]:
+            path = os.path.join(self.tmp, name)
+            here, there = ChoiceCache(10, bus_class(path)), ChoiceCache(10, bus_class(path))
+            here.fill({(1, 1): 10, (1, 2): 20}, here.mark())
+            there.invalidate([(1, 1)])
+            here.sync()
+            self.assertIs(here.get((1, 1)), _MISSING, bus_class)
+            self.assertEqual(here.get((1, 2)), 20, bus_class)
+            there.invalidate_all()
+            here.sync()
+            self.assertEqual(here.stats()['entries'], 0, bus_class)
+
+
+class QueryPlanTest(TestCase):
+    def test_hot_paths_use_indexes_as_snapshotted(self):
+        from django.db import connection
+        from .queryplans import check, diff, read_snapshot
+        report = check()
+        self.assertEqual([p for result in report.values() for p in result['problems']], [])
+        snapshot = read_snapshot(connection.vendor)
+        if not snapshot:
+            self.skipTest(f"No {connection.vendor} plan snapshot")
+        changes = diff(snapshot, report)
+        self.assertFalse(changes, '\n'.join(changes.values()) + "\n(intended? manage.py check_query_plans --update)")
+    
+    def test_assert_indexed_flags_full_scans(self):
+        from .queryplans import QueryPlanMixin
+        
+        class Probe(QueryPlanMixin, TestCase):
+            def runTest(self):
+                pass
+        
+        probe = Probe()
+        probe.assertIndexed(lambda: Vote.objects.filter(user_id=1).count())
+        with self.assertRaisesMessage(AssertionError, 'SCAN polls_poll'):
+            probe.assertIndexed(lambda: Poll.objects.filter(description='x').count())
+        probe.assertIndexed(lambda: Poll.objects.filter(description='x').count(), allow=[r'SCAN polls_poll'])
+    
+    def test_diff_shows_plan_changes(self):
+        from .queryplans import diff
+        queries = [{'sql': 'SELECT ...', 'plan': ['SEARCH polls_vote USING INDEX x']}]
+        report = {'vote_count': {'queries': [{'sql': 'SELECT ...', 'plan': ['SCAN polls_vote']}], 'problems': []}}
+        changes = diff({'vote_count': queries}, report)
+        self.assertIn('-    SEARCH polls_vote USING INDEX x', changes['vote_count'])
+        self.assertIn('+    SCAN polls_vote', changes['vote_count'])
+
+
+class KioskSyncTest(TestCase):
+    def setUp(self):
+        self.kiosk = User.objects.create_user(username='kiosk', password='pass')
+        self.voters = [User.objects.create_user(username=f'voter{i}', password='pass') for i in range(3)]
+        self.poll = Poll.objects.create(title='Event', description='Booth', created_by=self.kiosk)
+        self.red = Choice.objects.create(poll=self.poll, text='Red')
+        self.blue = Choice.objects.create(poll=self.poll, text='Blue')
+    
+    def sync(self, records, batch_size=500):
+        import io
+        from .importer import iter_records
+        from .kiosk import KioskSync
+        text = '\n'.join(json.dumps(record) for record in records)
+        return list(KioskSync(self.kiosk, batch_size=batch_size).run(iter_records(io.StringIO(text))))
+    
+    def record(self, cid, voter, choice, at):
+        return {'client_vote_id': cid, 'user': voter.pk, 'poll': self.poll.pk, 'choice': choice.pk,
+                'timestamp': f'2025-05-01T10:{at:02d}:00Z'}
+    
+    def test_latest_vote_per_user_wins_and_reuploads_are_duplicates(self):
+        records = [
+            self.record('k-1', self.voters[0], self.red, 1),
+            self.record('k-2', self.voters[0], self.blue, 5),
+            self.record('k-3', self.voters[1], self.red, 2),
+            {'client_vote_id': 'k-4', 'user': 'nobody', 'poll': self.poll.pk, 'choice': self.red.pk},
+        ]
+        reports = self.sync(records)
+        self.assertEqual([r['status'] for r in reports], ['superseded', 'applied', 'applied', 'error'])
+        self.assertEqual(reports[3]['error'], 'Unknown user.')
+        self.assertEqual(self.poll.vote_counts(), {self.red.pk: 1, self.blue.pk: 1})
+        
+        again = self.sync(records[:3])
+        self.assertEqual([r['status'] for r in again], ['duplicate'] * 3)
+        self.assertEqual(self.poll.vote_counts(), {self.red.pk: 1, self.blue.pk: 1})
+    
+    def test_older_upload_loses_to_newer_standing_vote(self):
+        self.sync([self.record('k-1', self.voters[0], self.blue, 30)])
+        reports = self.sync([
+            self.record('k-2', self.voters[0], self.red, 10),   # taken before k-1: stale
+            self.record('k-3', self.voters[1], self.blue, 10),
+        ])
+        self.assertEqual([r['status'] for r in reports], ['stale', 'applied'])
+        self.assertEqual(self.poll.user_vote(self.voters[0]), self.blue)
+        
+        reports = self.sync([self.record('k-4', self.voters[0], self.red, 40)])
+        self.assertEqual(reports[0]['status'], 'applied')
+        self.assertEqual(self.poll.user_vote(self.voters[0]), self.red)
+        self.assertEqual(self.red.votes.count(), 1)
+        from .voting import VoteEvent
+        self.assertEqual(VoteEvent.objects.filter(kind=VoteEvent.CHANGE).count(), 1)
+    
+    @override_settings(VOTE_COUNTER_SHARDS=1)
+    def test_chunk_query_count_is_constant(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        def queries(records):
+            with CaptureQueriesContext(connection) as captured:
+                self.sync(records)
+            return len(captured)
+        
+        voters = [User.objects.create_user(username=f'extra{i}') for i in range(20)]
+        casts = lambda who, at: [self.record(f'{at}-{v.pk}', v, self.red, at) for v in who]
+        moves = lambda who, at: [self.record(f'{at}-{v.pk}', v, self.blue, at) for v in who]
+        self.sync(casts(self.voters, 0))
+        self.sync(moves(self.voters, 1))  # both choices have counter rows from here on
+        self.assertEqual(queries(casts(voters[:2], 1)), queries(casts(voters[2:], 1)))
+        self.assertEqual(queries(moves(voters[:2], 2)), queries(moves(voters[2:], 2)))
+    
+    def test_endpoint_requires_permission(self):
+        self.client.login(username='kiosk', password='pass')
+        url = reverse('polls:kiosk_sync')
+        body = json.dumps(self.record('k-1', self.voters[0], self.red, 1))
+        self.assertEqual(self.client.post(url, body, content_type='application/x-ndjson').status_code, 403)
+        
+        from django.contrib.auth.models import Permission
+        self.kiosk.user_permissions.add(Permission.objects.get(codename='sync_votes'))
+        response = self.client.post(url, body, content_type='application/x-ndjson')
+        line = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(line, {'record': 1, 'status': 'applied', 'client_vote_id': 'k-1'})
+    
+    def test_endpoint_takes_the_csrf_token_in_a_header(self):
+        from django.contrib.auth.models import Permission
+        self.kiosk.user_permissions.add(Permission.objects.get(codename='sync_votes'))
+        client = Client(enforce_csrf_checks=True)
+        client.login(username='kiosk', password='pass')
+        url = reverse('polls:kiosk_sync')
+        body = json.dumps(self.record('k-1', self.voters[0], self.red, 1))
+        self.assertEqual(client.post(url, body, content_type='application/x-ndjson').status_code, 403)
+        
+        token = client.get(url).json()['csrftoken']
+        response = client.post(url, body, content_type='application/x-ndjson', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['status'], 'applied')
+
+
+@override_settings(VOTE_TALLY_BACKEND='memory')
+class MemoryTallyTest(TestCase):
+    def setUp(self):
+        # A fresh model per test; ids are reused once a test's rows roll back
+        self.enterContext(override_settings(POLLS_TALLY_MEMORY={'MAX_LAG': 60}))
+        from django.contrib.contenttypes.models import ContentType
+        self.ct = ContentType.objects.get_for_model(Choice)
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(4)]
+        self.poll = Poll.objects.create(title='Memory', description='Lane', created_by=self.users[0])
+        self.choice1 = Choice.objects.create(poll=self.poll, text='Choice 1')
+        self.choice2 = Choice.objects.create(poll=self.poll, text='Choice 2')
+        for user in self.users[:3]:
+            self.choice1.votes.up(user)
+    
+    def counts(self, *choices):
+        from .readmodel import count_memory
+        return count_memory(self.ct, [choice.pk for choice in choices])
+    
+    def test_counts_follow_votes_changes_retracts_and_kiosk_syncs(self):
+        import io
+        from .importer import iter_records
+        from .kiosk import KioskSync
+        self.assertEqual([r['count'] for r in self.poll.get_results()], [3, 0])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice2.votes.change(self.users[0], self.choice1)
+            self.choice1.votes.delete(self.users[1])
+            self.choice2.votes.up(self.users[3])
+        self.assertEqual(self.counts(self.choice1, self.choice2), {self.choice1.pk: 1, self.choice2.pk: 2})
+        
+        record = {'client_vote_id': 'k-1', 'user': self.users[2].pk, 'poll': self.poll.pk, 'choice': self.choice2.pk}
+        with self.captureOnCommitCallbacks(execute=True):
+            list(KioskSync(self.users[0]).run(iter_records(io.StringIO(json.dumps(record)))))
+        self.assertEqual(self.poll.total_votes, 3)
+        self.assertEqual(self.counts(self.choice1, self.choice2), {self.choice1.pk: 0, self.choice2.pk: 3})
+    
+    def test_reads_within_max_lag_stay_in_memory(self):
+        from .readmodel import tally_model
+        from .voting import VoteEvent
+        self.counts(self.choice1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(self.choice1, self.choice2), {self.choice1.pk: 3, self.choice2.pk: 0})
+        
+        # Another worker's vote shows up once the lag runs out
+        Vote.objects.create(user=self.users[3], content_type=self.ct, object_id=self.choice2.pk)
+        VoteEvent.objects.create(kind=VoteEvent.CAST, user=self.users[3], content_type=self.ct, object_id=self.choice2.pk)
+        self.assertEqual(self.counts(self.choice2), {self.choice2.pk: 0})
+        tally_model().tailed_at -= 61
+        self.assertEqual(self.counts(self.choice2), {self.choice2.pk: 1})
+        self.assertEqual(tally_model().stats()['rebuilds'], 1)
+    
+    def test_events_committed_out_of_order_are_picked_up_late(self):
+        from .readmodel import tally_model
+        from .voting import VoteEvent
+        model = tally_model()
+        model.rebuild()
+        late = model.watermark + 1
+        cast = lambda event_id, user: VoteEvent.objects.create(
+            id=event_id, kind=VoteEvent.CAST, user=user, content_type=self.ct, object_id=self.choice2.pk
+        )
+        cast(late + 1, self.users[3])
+        model.tail()
+        self.assertIn(late, model.gaps)
+        cast(late, self.users[0])
+        model.tail()
+        self.assertEqual(model.gaps, {})
+        self.assertEqual(self.counts(self.choice2), {self.choice2.pk: 2})
+    
+    def test_new_polls_load_and_closed_polls_fall_back(self):
+        self.counts(self.choice1)
+        fresh = Poll.objects.create(title='Fresh', description='New', created_by=self.users[0])
+        yes = Choice.objects.create(poll=fresh, text='Yes')
+        yes.votes.up(self.users[0])
+        closed = Poll.objects.create(title='Closed', description='Old', created_by=self.users[0], is_active=False)
+        no = Choice.objects.create(poll=closed, text='No')
+        Vote.objects.create(user=self.users[1], content_type=self.ct, object_id=no.pk)
+        
+        self.assertEqual(self.counts(yes, no), {yes.pk: 1, no.pk: 1})
+        with self.assertNumQueries(1):  # the closed poll's count only
+            self.assertEqual(self.counts(yes, no), {yes.pk: 1, no.pk: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            yes.votes.up(self.users[1])
+        self.assertEqual(self.counts(yes), {yes.pk: 2})
+
+
+class HotPollTest(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(POLLS_HOT_POLLS={'MIN_HITS': 3, 'INTERVAL': 60}))
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(3)]
+        self.poll = Poll.objects.create(title='Hot', description='Take', created_by=self.users[0])
+        self.choice = Choice.objects.create(poll=self.poll, text='Yes')
+        self.choice.votes.up(self.users[0])
+    
+    def test_space_saving_keeps_heavy_hitters_within_error_bounds(self):
+        import random
+        from collections import Counter
+        from .hotpolls import SpaceSaving
+        rng = random.Random(7)
+        stream = [rng.choice(range(5)) if rng.random() < 0.6 else rng.randrange(5, 5000) for _ in range(20000)]
+        sketch = SpaceSaving(capacity=50)
+        for key in stream:
+            sketch.add(key)
+        truth = Counter(stream)
+        top = sketch.top(5)
+        self.assertEqual({key for key, _, _ in top}, set(range(5)))
+        for key, count, error in top:
+            self.assertLessEqual(count - error, truth[key])
+            self.assertGreaterEqual(count, truth[key])
+    
+    def test_hot_poll_results_are_recomputed_once_per_interval(self):
+        from .hotpolls import hot_polls
+        url = reverse('polls:results_ajax', kwargs={'pk': self.poll.pk})
+        for _ in range(3):
+            self.client.get(url)
+        hot_polls().rank()
+        self.assertEqual(self.client.get(url).json()['total_votes'], 1)
+        
+        self.choice.votes.up(self.users[1])
+        self.choice.votes.up(self.users[2])
+        for _ in range(5):
+            self.assertEqual(self.client.get(url).json()['total_votes'], 1)
+        stats = hot_polls().stats()
+        self.assertEqual(stats['top'][0], {'poll': self.poll.pk, 'hits': 9, 'error': 0, 'hot': True})
+        self.assertEqual(stats['recomputes'], 2)  # its counts and its vote version
+        
+        self.choice.text = 'Yes!'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.choice.save()
+        self.assertEqual(self.client.get(url).json()['total_votes'], 3)
+    
+    def test_voting_request_reads_its_poll_unpinned(self):
+        from .cache import pinned_vote_version, vote_version
+        from .hotpolls import hot_polls
+        from .loaders import VoteLoader
+        for _ in range(3):
+            hot_polls().record(self.poll.pk)
+        hot_polls().rank()
+        pinned_version = pinned_vote_version(self.poll.pk)
+        
+        loader = VoteLoader()
+        token = loader.activate()
+        try:
+            counts = loader.counts(self.poll)
+            counts[self.choice.pk] = 99  # a request's copy, not the shared pin
+            self.choice.votes.up(self.users[1])
+            self.assertEqual(loader.counts(self.poll), {self.choice.pk: 2})
+            self.assertEqual(pinned_vote_version(self.poll.pk), vote_version(self.poll.pk))
+        finally:
+            loader.deactivate(token)
+        # Other requests keep reading the pin until the interval is up
+        self.assertEqual(VoteLoader().counts(self.poll), {self.choice.pk: 1})
+        self.assertEqual(pinned_vote_version(self.poll.pk), pinned_version)
+    
+    def test_concurrent_requests_serve_the_previous_value_during_a_recompute(self):
+        import threading
+        import time
+        from .hotpolls import HotPolls
+        tracker = HotPolls(min_hits=1, interval=0.05)
+        tracker.record(1)
+        tracker.rank()
+        self.assertEqual(tracker.pinned(1, 'x', lambda: 'old'), 'old')
+        
+        started, release = threading.Event(), threading.Event()
+        
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'new'
+        
+        time.sleep(0.06)
+        worker = threading.Thread(target=lambda: tracker.pinned(1, 'x', slow))
+        worker.start()
+        started.wait(5)
+        self.assertEqual(tracker.pinned(1, 'x', lambda: self.fail("recomputed twice")), 'old')
+        release.set()
+        worker.join()
+        tracker.interval = 60
+        self.assertEqual(tracker.pinned(1, 'x', lambda: 'newer'), 'new')
+
+
+@override_settings(VOTE_COUNTER_SHARDS=8)
+class VerifyVotesTest(TestCase):
+    def setUp(self):
+        from django.contrib.contenttypes.models import ContentType
+        self.ct = ContentType.objects.get_for_model(Choice)
+        self.users = [User.objects.create_user(username=f'user{i}', password='pass') for i in range(3)]
+        self.polls = [Poll.objects.create(title=f'Poll {i}', description='?', created_by=self.users[0]) for i in range(3)]
+        self.choices = [Choice.objects.create(poll=poll, text=text) for poll in self.polls for text in 'AB']
+        for user in self.users:
+            self.choices[0].votes.up(user)
+            self.choices[2].votes.up(user)
+    
+    def verify(self, *args):
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('verify_votes', '--workers', '1', '--range-size', '2', *args, stdout=out)
+        return out.getvalue()
+    
+    def test_clean_votes_verify(self):
+        out = self.verify()
+        self.assertIn('[1/4] polls', out)
+        self.assertIn('Verified 4 ranges: 0 duplicates, 0 counters, 0 orphans', out)
+    
+    def test_repair_fixes_duplicates_orphans_and_counters(self):
+        from django.core.management.base import CommandError
+        from .voting import VoteCounterShard, VoteEvent, count_shards, replay_events
+        # A second vote in the same poll, and the votes of a deleted choice
+        Vote.objects.create(user=self.users[0], content_type=self.ct, object_id=self.choices[1].pk)
+        VoteEvent.objects.create(kind=VoteEvent.CAST, user=self.users[0], content_type=self.ct, object_id=self.choices[1].pk)
+        self.choices[2].delete()
+        VoteCounterShard.objects.filter(object_id=self.choices[0].pk).update(count=0)
+        
+        with self.assertRaisesMessage(CommandError, 'Found 1 duplicates, 2 counters, 3 orphans'):
+            self.verify()
+        out = self.verify('--repair', '--batch-size', '2')
+        self.assertIn('(repaired)', out)
+        self.assertIn('Repaired 4 ranges', out)
+        self.assertIn('0 duplicates, 0 counters, 0 orphans', self.verify())
+        
+        self.assertEqual(Vote.objects.filter(user=self.users[0], object_id__in=[c.pk for c in self.choices[:2]]).count(), 1)
+        self.assertFalse(Vote.objects.filter(object_id=self.choices[2].pk).exists())
+        self.assertEqual(count_shards(self.ct, [c.pk for c in self.choices[:2]]), {self.choices[0].pk: 2, self.choices[1].pk: 1})
+        # The event log agrees, so a replay doesn't bring the removed votes back
+        self.assertEqual(replay_events(), 3)
+    
+    def test_removal_queries_are_per_batch_not_per_vote(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .integrity import _remove
+        from .voting import VoteTombstone
+        
+        def queries(choice, batch_size):
+            votes = list(Vote.objects.filter(object_id=choice.pk).values_list('id', 'user_id', 'object_id', 'created_at'))
+            with CaptureQueriesContext(connection) as captured:
+                _remove(self.ct, votes, batch_size)
+            return len(captured)
+        
+        with self.settings(VOTE_COUNTER_SHARDS=0):
+            one_batch = queries(self.choices[0], batch_size=3)
+            self.assertEqual(queries(self.choices[2], batch_size=1), 3 * one_batch)
+        self.assertEqual(one_batch, 5)  # savepoint, events, DELETE, tombstones, release
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(VoteTombstone.objects.count(), 6)
+
+
+class ProductionProfileTest(TestCase):
+    # A fresh interpreter: here every component is already registered by autodiscovery
+    PROBE = """
+import django
+from django.conf import settings
+from votely.settings_prod import DEV_ONLY_APPS
+settings.INSTALLED_APPS = [app for app in settings.INSTALLED_APPS if app not in DEV_ONLY_APPS]
+settings.COMPONENTS = {**settings.COMPONENTS, 'autodiscover': False}
+settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}
+settings.ALLOWED_HOSTS = ['testserver']
+django.setup()
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client
+from polls.models import Choice, Poll
+call_command('migrate', verbosity=0)
+poll = Poll.objects.create(title='Prod', description='Profile', created_by=User.objects.create_user('prod'))
+Choice.objects.create(poll=poll, text='Yes')
+client = Client(raise_request_exception=True)
+print(client.get('/').status_code, client.get(f'/poll/{poll.pk}/').status_code)
+"""
+    
+    def test_pages_render_without_component_autodiscovery(self):
+        import subprocess
+        import sys
+        result = subprocess.run([sys.executable, '-c', self.PROBE], capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.stdout.split(), ['200', '200'], result.stderr[-2000:])
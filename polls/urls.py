@@ -7,7 +7,13 @@ app_name = 'polls'
 urlpatterns = [
     path('', views.PollListView.as_view(), name='list'),
     path('create/', views.PollCreateView.as_view(), name='create'),
+    path('import/', views.PollImportView.as_view(), name='import'),
     path('poll/<int:pk>/', views.PollDetailView.as_view(), name='detail'),
     path('vote/<int:pk>/', views.VoteView.as_view(), name='vote'),
+    path('api/kiosk/votes/', views.KioskSyncView.as_view(), name='kiosk_sync'),
+    path('my/votes/', views.MyVotesView.as_view(), name='my_votes'),
+    path('api/my/votes/', views.MyVotesJsonView.as_view(), name='my_votes_api'),
     path('results/<int:pk>/', views.poll_results_ajax, name='results_ajax'),
+    path('crosstab/<int:pk>/<int:other_pk>/', views.CrosstabView.as_view(), name='crosstab'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
 ]
@@ -1,33 +1,64 @@
+import codecs
+import json
+
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
 from django.views import View
-from django.views.generic import ListView, DetailView, CreateView
+from django.views.generic import ListView, DetailView, CreateView, TemplateView
 from django.urls import reverse_lazy
-from django.http import JsonResponse
-from django.template.loader import render_to_string
+from django.core.exceptions import BadRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.middleware.csrf import get_token
 from django_filters.views import FilterView
-from braces.views import LoginRequiredMixin, MessageMixin
-from .models import Poll, Choice
-from .forms import VoteForm, PollForm
+from braces.views import LoginRequiredMixin, MessageMixin, PermissionRequiredMixin, StaffuserRequiredMixin
+from . import metrics
+from .cache import AnonymousPageCacheMixin, filter_query_keys, list_generation, pinned_vote_version
+from .models import Poll, Choice, PollCrosstab
+from .forms import BallotForm, VoteForm, PollForm
+from .history import vote_history
+from .hotpolls import HotPollMixin, hot_polls
 from .filters import PollFilter
+from .importer import PollImporter, iter_records
+from .jobs import enqueue
+from .kiosk import KioskSync
+from .loaders import VoteLoader
+from .components.poll_results import PollResultsComponent
 
 
-class PollListView(FilterView):
+class PollListView(AnonymousPageCacheMixin, FilterView):
     model = Poll
     template_name = 'polls/poll_list.html'
     context_object_name = 'polls'
     paginate_by = 10
     filterset_class = PollFilter
+    page_cache_query_keys = filter_query_keys(PollFilter)
+    
+    def get_page_generation(self):
+        return list_generation()
     
     def get_queryset(self):
         return Poll.objects.filter(is_active=True).select_related('created_by').prefetch_related('tags')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Cards that miss the render cache share one batched count lookup
+        loader = VoteLoader.get()
+        loader.want(context['polls'])
+        user = self.request.user
+        voted = loader.voted_poll_ids(user, context['polls']) if user.is_authenticated else set()
+        for poll in context['polls']:
+            poll.user_voted = poll.pk in voted
+        return context
 
 
-class PollDetailView(DetailView):
+class PollDetailView(HotPollMixin, AnonymousPageCacheMixin, DetailView):
     model = Poll
     template_name = 'polls/poll_detail.html'
     context_object_name = 'poll'
     
+    def get_page_generation(self):
+        return pinned_vote_version(self.kwargs['pk'])
+    
     def get_queryset(self):
         return Poll.objects.filter(is_active=True).prefetch_related('choices')
     
@@ -36,11 +67,64 @@ class PollDetailView(DetailView):
         poll = self.object
         
         if self.request.user.is_authenticated:
-            context['vote_form'] = VoteForm(poll=poll, user=self.request.user)
+            form_class = BallotForm if poll.uses_ballots else VoteForm
+            context['vote_form'] = form_class(poll=poll, user=self.request.user)
             context['user_vote'] = poll.user_vote(self.request.user)
         
         context['results'] = poll.get_results()
+        context['recommended'] = poll.recommended()
+        if self.request.user.is_authenticated and 'compare' in self.request.GET:
+            context['compare_polls'] = (
+                Poll.objects.filter(is_active=True).exclude(pk=poll.pk)
+                .order_by('-created_at').only('pk', 'title')[:20]
+            )
+            other = self.get_compare_poll()
+            if other is not None:
+                context['crosstab'] = stored_crosstab(poll, other)
+                context['crosstab_pending'] = context['crosstab'] is None
         return context
+    
+    def get_compare_poll(self):
+        try:
+            pk = int(self.request.GET['compare'])
+        except (KeyError, ValueError):
+            return None
+        return Poll.objects.filter(is_active=True).exclude(pk=self.object.pk).filter(pk=pk).first()
+
+
+class MyVotesView(LoginRequiredMixin, TemplateView):
+    """The user's vote history, newest first"""
+    template_name = 'polls/my_votes.html'
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['entries'], context['next_cursor'] = vote_history(
+            self.request.user, after=self.request.GET.get('after')
+        )
+        return context
+
+
+class MyVotesJsonView(LoginRequiredMixin, View):
+    """The user's vote history as JSON: ?after=<cursor>&limit=<1-100>"""
+    raise_exception = True
+    
+    def get(self, request):
+        try:
+            limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        except ValueError:
+            limit = 20
+        entries, next_cursor = vote_history(request.user, after=request.GET.get('after'), limit=limit)
+        return JsonResponse({
+            'votes': [
+                {
+                    'poll': {'id': e['poll'].pk, 'title': e['poll'].title, 'url': e['poll'].get_absolute_url()},
+                    'choice': {'id': e['choice'].pk, 'text': e['choice'].text},
+                    'voted_at': e['voted_at'].isoformat(),
+                }
+                for e in entries
+            ],
+            'next': next_cursor,
+        })
 
 
 class PollCreateView(LoginRequiredMixin, MessageMixin, CreateView):
@@ -55,34 +139,71 @@ class PollCreateView(LoginRequiredMixin, MessageMixin, CreateView):
         return redirect(self.object.get_absolute_url())
 
 
-class VoteView(LoginRequiredMixin, MessageMixin, View):
+class CsrfTokenMixin:
+    """
+    Session-authenticated API views: GET returns the CSRF token.
+    
+    Scripts and kiosks log in, GET the endpoint, and send the token back in
+    the ``X-CSRFToken`` header of their POSTs, along with the session and
+    ``csrftoken`` cookies.
+    """
+    
+    def get(self, request):
+        return JsonResponse({'csrftoken': get_token(request)})
+
+
+class PollImportView(LoginRequiredMixin, PermissionRequiredMixin, CsrfTokenMixin, View):
+    """Batch import polls from a JSON array or NDJSON request body"""
+    permission_required = 'polls.add_poll'
+    raise_exception = True
+    
+    def post(self, request):
+        records = iter_records(codecs.getreader('utf-8')(request))
+        reports = PollImporter(request.user).run(records)
+        return StreamingHttpResponse(
+            (json.dumps(report) + '\n' for report in reports),
+            content_type='application/x-ndjson'
+        )
+
+
+class KioskSyncView(LoginRequiredMixin, PermissionRequiredMixin, CsrfTokenMixin, View):
+    """Apply votes queued offline by kiosks from an NDJSON or JSON array body"""
+    permission_required = 'polls.sync_votes'
+    raise_exception = True
+    
+    def post(self, request):
+        records = iter_records(codecs.getreader('utf-8')(request))
+        reports = KioskSync(request.user).run(records)
+        return StreamingHttpResponse(
+            (json.dumps(report) + '\n' for report in reports),
+            content_type='application/x-ndjson'
+        )
+
+
+class VoteView(LoginRequiredMixin, MessageMixin, HotPollMixin, View):
     def post(self, request, pk):
-        poll = get_object_or_404(Poll, pk=pk, is_active=True)
-        form = VoteForm(poll=poll, user=request.user, data=request.POST)
+        poll = get_object_or_404(Poll.objects.prefetch_related('choices'), pk=pk, is_active=True)
+        form_class = BallotForm if poll.uses_ballots else VoteForm
+        form = form_class(poll=poll, user=request.user, data=request.POST)
         
         if form.is_valid():
-            choice = form.cleaned_data['choice']
-            
-            # Clear any existing votes for this poll by this user
-            for poll_choice in poll.choices.all():
-                if poll_choice.votes.exists(request.user):
-                    poll_choice.votes.delete(request.user)
-            
-            # Cast new vote
-            choice.votes.up(request.user)
+            if poll.uses_ballots:
+                poll.cast_ballot(request.user, form.cleaned_data['ranking'])
+                message = "Ballot cast!"
+            else:
+                choice = form.cleaned_data['choice']
+                
+                poll.vote(request.user, choice)
+                message = f"Vote cast for '{choice.text}'!"
             
-            self.messages.success(f"Vote cast for '{choice.text}'!")
+            self.messages.success(message)
             
             # AJAX response
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                results_html = render_to_string(
-                    'polls/components/poll_results.html',
-                    {'poll': poll, 'results': poll.get_results()},
-                    request=request
-                )
+                results_html = render_results(request, poll)
                 return JsonResponse({
                     'success': True,
-                    'message': f"Vote cast for '{choice.text}'!",
+                    'message': message,
                     'results_html': results_html
                 })
         else:
@@ -97,15 +218,53 @@ class VoteView(LoginRequiredMixin, MessageMixin, View):
         return redirect('polls:detail', pk=pk)
 
 
+def render_results(request, poll):
+    """Render the (cached) results component outside of a template"""
+    return PollResultsComponent.render(kwargs={'poll': poll}, request=request)
+
+
 def poll_results_ajax(request, pk):
     """AJAX endpoint for live poll results"""
+    hot_polls().record(pk)
     poll = get_object_or_404(Poll, pk=pk)
-    results_html = render_to_string(
-        'polls/components/poll_results.html',
-        {'poll': poll, 'results': poll.get_results()},
-        request=request
-    )
+    results_html = render_results(request, poll)
     return JsonResponse({
         'results_html': results_html,
         'total_votes': poll.total_votes
-    })
\ No newline at end of file
+    })
+
+
+def stored_crosstab(poll, other):
+    """
+    Two polls' stored crosstab, or None before the first computation.
+    
+    A missing or outdated one queues the job that computes it; meanwhile an
+    outdated one is still served.
+    """
+    stored = PollCrosstab.objects.filter(poll=poll, other=other).first()
+    if stored is None or stored.is_outdated():
+        enqueue('compute_crosstab', poll_id=poll.pk, other_id=other.pk)
+    return stored.result if stored else None
+
+
+class CrosstabView(LoginRequiredMixin, View):
+    """How respondents of one active poll answered another, as JSON; 202 while it is computed"""
+    raise_exception = True
+    
+    def get(self, request, pk, other_pk):
+        if pk == other_pk:
+            raise BadRequest("Compare a poll with a different poll.")
+        poll = get_object_or_404(Poll, pk=pk, is_active=True)
+        other = get_object_or_404(Poll, pk=other_pk, is_active=True)
+        result = stored_crosstab(poll, other)
+        if result is None:
+            return JsonResponse({'pending': True}, status=202)
+        return JsonResponse(result)
+
+
+class MetricsView(StaffuserRequiredMixin, View):
+    """Process-local cache and performance metrics for staff"""
+    raise_exception = True
+    
+    def get(self, request):
+        return JsonResponse(metrics.collect())
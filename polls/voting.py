@@ -2,10 +2,53 @@
 Minimal, elegant voting system for Django 5.x
 Inspired by django-vote but ultra-minimal
 """
-from django.db import models
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Count, F, Max, Sum
+from django.db.models.signals import post_delete
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+
+# Sent with sender=<voted model class>, instance=<voted object>, user=<user>
+# whenever a vote is actually created or removed.
+vote_changed = Signal()
+
+
+class VoteEvent(models.Model):
+    """
+    Append-only log of what voters did; the source of truth for votes.
+    
+    ``Vote`` rows (the current votes) and the counter shards are projections
+    of this log, maintained in the same transaction as each event and
+    rebuilt from it by ``replay_events``.
+    """
+    CAST = 'cast'
+    CHANGE = 'change'
+    RETRACT = 'retract'
+    KINDS = [(CAST, 'Cast'), (CHANGE, 'Change'), (RETRACT, 'Retract')]
+    
+    kind = models.CharField(max_length=7, choices=KINDS)
+    # Kept, without the user, when the account is deleted
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='vote_events')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    previous_object_id = models.PositiveIntegerField(null=True, blank=True)  # change only
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} {self.content_type_id}:{self.object_id} by {self.user_id}"
 
 
 class Vote(models.Model):
@@ -13,16 +56,309 @@ class Vote(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         unique_together = ['user', 'content_type', 'object_id']
         indexes = [
             models.Index(fields=['content_type', 'object_id']),
-            models.Index(fields=['user']),
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['content_type', 'object_id', 'created_at']),
+        ]
+
+
+class VoteTombstone(models.Model):
+    """A removed vote, kept until every tally snapshot that counted it is retaken"""
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    vote_created_at = models.DateTimeField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'id']),
         ]
 
 
+@receiver(post_delete, sender=Vote)
+def bury_vote(sender, instance, **kwargs):
+    VoteTombstone.objects.create(
+        content_type_id=instance.content_type_id,
+        object_id=instance.object_id,
+        vote_created_at=instance.created_at,
+    )
+
+
+def delete_vote_rows(pks=None):
+    """
+    Delete the vote rows with these ids (all of them if None) in one statement.
+    
+    Skips ``bury_vote``, so callers write whatever tombstones they need.
+    Returns the number of rows deleted.
+    """
+    sql = f'DELETE FROM {connection.ops.quote_name(Vote._meta.db_table)}'
+    if pks is not None:
+        pks = list(pks)
+        if not pks:
+            return 0
+        sql += f' WHERE id IN ({", ".join(["%s"] * len(pks))})'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, pks)
+        return cursor.rowcount
+
+
+# Tombstone ids a snapshot leaves to the delta, in case lower ones are still committing
+TOMBSTONE_OVERLAP = 1000
+
+
+class TallySnapshot(models.Model):
+    """
+    Vote count of one object as of two high-water marks.
+    
+    The live count is ``count`` plus votes created after ``votes_until``,
+    minus tombstones newer than ``tombstone_mark`` for votes created at or
+    before ``votes_until`` (i.e. votes this snapshot counted).
+    
+    Both marks trail the moment the snapshot was taken (see
+    ``take_snapshots``), so rows that commit late or carry a skewed clock
+    still land in the delta.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField()
+    votes_until = models.DateTimeField()
+    tombstone_mark = models.BigIntegerField()
+    
+    class Meta:
+        unique_together = ['content_type', 'object_id']
+
+
+class VoteCounterShard(models.Model):
+    """
+    One of K counter rows per voted object.
+    
+    Increments land on a random shard so concurrent votes on a viral object
+    don't all queue on one row lock; the tally is the sum of the shards.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['content_type', 'object_id', 'shard']
+
+
+def counter_shards():
+    return getattr(settings, 'VOTE_COUNTER_SHARDS', 0)
+
+
+def snapshot_grace():
+    """Seconds of the newest votes a snapshot leaves to the delta"""
+    return getattr(settings, 'VOTE_SNAPSHOT_GRACE', 60)
+
+
+def bump_counter(ct, object_id, delta, shard=None):
+    """Add delta to a random counter shard of the object"""
+    if shard is None:
+        shard = random.randrange(counter_shards())
+    rows = VoteCounterShard.objects.filter(content_type=ct, object_id=object_id, shard=shard)
+    if rows.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            VoteCounterShard.objects.create(
+                content_type=ct, object_id=object_id, shard=shard, count=delta
+            )
+    except IntegrityError:  # created concurrently
+        rows.update(count=F('count') + delta)
+
+
+def compact_counters(batch_size=1000):
+    """
+    Fold every object's counter shards into shard 0.
+    
+    Each shard's count is moved with relative updates (``count - n`` there,
+    ``count + n`` on shard 0), so increments racing the compaction are never
+    lost. Rows left at zero are then deleted. Returns the rows folded.
+    """
+    folded = 0
+    while True:
+        rows = list(
+            VoteCounterShard.objects.exclude(shard=0).exclude(count=0)
+            .values_list('id', 'content_type_id', 'object_id', 'count')[:batch_size]
+        )
+        if not rows:
+            break
+        with transaction.atomic():
+            for pk, ct_id, object_id, count in rows:
+                VoteCounterShard.objects.filter(pk=pk).update(count=F('count') - count)
+                bump_counter(ContentType.objects.get_for_id(ct_id), object_id, count, shard=0)
+        folded += len(rows)
+    VoteCounterShard.objects.exclude(shard=0).filter(count=0).delete()
+    return folded
+
+
+def rebuild_counters(batch_size=1000):
+    """
+    Reset every counter to an exact count of the vote rows.
+    
+    Needed after writes that bypass VoteProxy (bulk loads, raw SQL). Not
+    safe against concurrent voting - run it while the site is quiet.
+    """
+    with transaction.atomic():
+        VoteCounterShard.objects.all().delete()
+        totals = (
+            Vote.objects.values('content_type_id', 'object_id')
+            .annotate(n=Count('id')).order_by().values_list('content_type_id', 'object_id', 'n')
+        )
+        VoteCounterShard.objects.bulk_create(
+            (VoteCounterShard(content_type_id=ct_id, object_id=object_id, shard=0, count=n)
+             for ct_id, object_id, n in totals.iterator()),
+            batch_size=batch_size,
+        )
+
+
+def count_votes(ct, object_ids, since=None, votes_until=None):
+    """{object_id: votes} counted from the vote rows, optionally within a time window"""
+    votes = Vote.objects.filter(content_type=ct, object_id__in=object_ids)
+    if since is not None:
+        votes = votes.filter(created_at__gt=since)
+    if votes_until is not None:
+        votes = votes.filter(created_at__lte=votes_until)
+    return dict(votes.values('object_id').annotate(n=Count('id')).values_list('object_id', 'n'))
+
+
+def count_shards(ct, object_ids):
+    """{object_id: votes} summed from the counter shards"""
+    return dict(
+        VoteCounterShard.objects.filter(content_type=ct, object_id__in=object_ids)
+        .values('object_id').annotate(n=Sum('count')).values_list('object_id', 'n')
+    )
+
+
+def take_snapshots(ct, object_ids):
+    """
+    Snapshot the vote counts of objects and prune the tombstones they absorb.
+    
+    A vote's ``created_at`` is stamped before its transaction commits, and
+    web workers' clocks drift, so votes created in the last
+    ``snapshot_grace()`` seconds are left for the delta to count rather
+    than risk missing one that commits after the count. Tombstone ids can
+    commit out of order too: the last ``TOMBSTONE_OVERLAP`` ids stay in the
+    delta, and the ones of them already visible are added back to the count
+    so they don't come off twice.
+    """
+    object_ids = list(object_ids)
+    with transaction.atomic():
+        votes_until = timezone.now() - timedelta(seconds=snapshot_grace())
+        newest = VoteTombstone.objects.aggregate(m=Max('id'))['m'] or 0
+        tombstone_mark = max(newest - TOMBSTONE_OVERLAP, 0)
+        counts = count_votes(ct, object_ids, votes_until=votes_until)
+        for object_id, n in count_tombstones(ct, object_ids, tombstone_mark, votes_until).items():
+            counts[object_id] = counts.get(object_id, 0) + n
+        TallySnapshot.objects.filter(content_type=ct, object_id__in=object_ids).delete()
+        TallySnapshot.objects.bulk_create([
+            TallySnapshot(content_type=ct, object_id=object_id, count=counts.get(object_id, 0),
+                          votes_until=votes_until, tombstone_mark=tombstone_mark)
+            for object_id in object_ids
+        ])
+        VoteTombstone.objects.filter(
+            content_type=ct, object_id__in=object_ids, id__lte=tombstone_mark
+        ).delete()
+
+
+def count_tombstones(ct, object_ids, tombstone_mark, votes_until):
+    """{object_id: removals} of votes created by votes_until, from tombstones after tombstone_mark"""
+    return dict(
+        VoteTombstone.objects.filter(
+            content_type=ct, object_id__in=object_ids,
+            id__gt=tombstone_mark, vote_created_at__lte=votes_until,
+        ).values('object_id').annotate(n=Count('id')).values_list('object_id', 'n')
+    )
+
+
+def count_snapshots(ct, object_ids):
+    """{object_id: votes} as snapshot plus the votes and removals since it"""
+    snapshots = TallySnapshot.objects.filter(content_type=ct, object_id__in=object_ids)
+    counts, by_marks = {}, {}
+    for snap in snapshots:
+        counts[snap.object_id] = snap.count
+        by_marks.setdefault((snap.votes_until, snap.tombstone_mark), []).append(snap.object_id)
+    
+    # Objects snapshotted together share marks, so this is two queries per batch
+    for (votes_until, tombstone_mark), ids in by_marks.items():
+        for object_id, n in count_votes(ct, ids, since=votes_until).items():
+            counts[object_id] += n
+        for object_id, n in count_tombstones(ct, ids, tombstone_mark, votes_until).items():
+            counts[object_id] -= n
+    
+    unsnapshotted = [object_id for object_id in object_ids if object_id not in counts]
+    if unsnapshotted:
+        counts.update(count_votes(ct, unsnapshotted))
+    return counts
+
+
+def events_after(cursor=0, limit=1000):
+    """
+    The next batch of vote events after ``cursor`` (an event id), oldest first.
+    
+    Consumers keep the id of the last event they processed and pass it back,
+    so each event is handled once however often they poll.
+    """
+    return list(VoteEvent.objects.filter(id__gt=cursor).order_by('id')[:limit])
+
+
+def replay_events(batch_size=5000):
+    """
+    Rebuild the vote rows and counters from the event log.
+    
+    Events are streamed in id order and folded into the set of current
+    votes, which is then written back in batches. Snapshots and tombstones
+    describe the old rows, so they are dropped too (the snapshot backend
+    counts from the votes until the next ``snapshot_tallies``). Returns the
+    number of votes. Events of deleted accounts are skipped, as their votes
+    went with them. Not safe against concurrent voting.
+    """
+    current = {}
+    events = VoteEvent.objects.filter(user__isnull=False).order_by('id').values_list(
+        'kind', 'user_id', 'content_type_id', 'object_id', 'previous_object_id', 'created_at'
+    )
+    for kind, user_id, ct_id, object_id, previous_id, created_at in events.iterator(chunk_size=batch_size):
+        if kind == VoteEvent.CHANGE:
+            current.pop((user_id, ct_id, previous_id), None)
+        if kind == VoteEvent.RETRACT:
+            current.pop((user_id, ct_id, object_id), None)
+        else:
+            current[(user_id, ct_id, object_id)] = created_at
+    
+    with transaction.atomic():
+        # No per-row tombstones for rows being rebuilt anyway
+        delete_vote_rows()
+        VoteTombstone.objects.all().delete()
+        TallySnapshot.objects.all().delete()
+        Vote.objects.bulk_create(
+            (Vote(user_id=user_id, content_type_id=ct_id, object_id=object_id, created_at=created_at)
+             for (user_id, ct_id, object_id), created_at in current.items()),
+            batch_size=batch_size,
+        )
+        rebuild_counters(batch_size)
+    return len(current)
+
+
+TALLY_BACKENDS = {
+    'votes': count_votes,
+    'shards': count_shards,
+    'snapshot': count_snapshots,
+}
+
+
+def tally_counts(ct, object_ids):
+    """{object_id: votes} from the backend named by VOTE_TALLY_BACKEND"""
+    backend = getattr(settings, 'VOTE_TALLY_BACKEND', 'votes')
+    return TALLY_BACKENDS[backend](ct, list(object_ids))
+
+
 class VoteModel(models.Model):
     """Minimal mixin - just inherit and use .votes"""
     
@@ -42,15 +378,56 @@ class VoteProxy:
         self.ct = ContentType.objects.get_for_model(obj)
     
     def up(self, user):
-        vote, _ = Vote.objects.get_or_create(
-            user=user, content_type=self.ct, object_id=self.obj.pk
-        )
+        with transaction.atomic():
+            vote, created = Vote.objects.get_or_create(
+                user=user, content_type=self.ct, object_id=self.obj.pk
+            )
+            if created:
+                self._log(VoteEvent.CAST, user, created_at=vote.created_at)
+                self._count(+1)
+        if created:
+            self._notify(user)
         return vote
     
     def delete(self, user):
-        return Vote.objects.filter(
-            user=user, content_type=self.ct, object_id=self.obj.pk
-        ).delete()
+        with transaction.atomic():
+            result = Vote.objects.filter(
+                user=user, content_type=self.ct, object_id=self.obj.pk
+            ).delete()
+            if result[0]:
+                self._log(VoteEvent.RETRACT, user)
+                self._count(-result[0])
+        if result[0]:
+            self._notify(user)
+        return result
+    
+    def change(self, user, previous):
+        """
+        Move the user's vote on ``previous`` to this object.
+        
+        The vote row is updated in place, so only the event is inserted; the
+        move counts as a removal from ``previous`` and a new vote here. Casts
+        a plain vote when the user had no vote on ``previous``.
+        """
+        with transaction.atomic():
+            vote = Vote.objects.select_for_update().filter(
+                user=user, content_type=self.ct, object_id=previous.pk
+            ).first()
+            if vote is not None:
+                VoteTombstone.objects.create(
+                    content_type=self.ct, object_id=previous.pk, vote_created_at=vote.created_at
+                )
+                vote.object_id, vote.created_at = self.obj.pk, timezone.now()
+                vote.save(update_fields=['object_id', 'created_at'])
+                self._log(VoteEvent.CHANGE, user, previous_object_id=previous.pk,
+                          created_at=vote.created_at)
+                previous.votes._count(-1)
+                self._count(+1)
+        if vote is None:
+            return self.up(user)
+        previous.votes._notify(user)
+        self._notify(user)
+        return vote
     
     def exists(self, user):
         return Vote.objects.filter(
@@ -61,4 +438,16 @@ class VoteProxy:
         return Vote.objects.filter(
             content_type=self.ct, object_id=self.obj.pk
         ).count()
-
+    
+    def _log(self, kind, user, **fields):
+        VoteEvent.objects.create(
+            kind=kind, user=user, content_type=self.ct, object_id=self.obj.pk, **fields
+        )
+    
+    def _count(self, delta):
+        if counter_shards():
+            bump_counter(self.ct, self.obj.pk, delta)
+    
+    def _notify(self, user):
+        # Sent once the writes are done so caches don't refill with pre-vote data
+        vote_changed.send(sender=type(self.obj), instance=self.obj, user=user)
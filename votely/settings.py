@@ -54,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'polls.loaders.VoteLoaderMiddleware',
 ]
 
 ROOT_URLCONF = 'votely.urls'
@@ -85,6 +86,15 @@ DATABASES = {
     }
 }
 
+# Cache (component fragments and vote versions live here; point this at
+# Redis/Memcached in production so all workers share invalidation)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'votely',
+    }
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -130,24 +140,11 @@ COMPONENTS = {
     ],
 }
 
-# Django Bootstrap 5
-BOOTSTRAP5 = {    
-# Popular Bootswatch themes (uncomment one):
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
- 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/darkly/bootstrap.min.css',  # Dark theme
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/cerulean/bootstrap.min.css',  # Blue theme
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/cosmo/bootstrap.min.css',  # Flat theme
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/flatly/bootstrap.min.css',  # Modern flat
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/journal/bootstrap.min.css',  # Newspaper
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/lux/bootstrap.min.css',  # Elegant
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/materia/bootstrap.min.css',  # Material Design
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/minty/bootstrap.min.css',  # Fresh mint
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/pulse/bootstrap.min.css',  # Purple
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/sandstone/bootstrap.min.css',  # Warm
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/united/bootstrap.min.css',  # Orange
-# 'css_url': 'https://cdn.jsdelivr.net/npm/bootswatch@5.3.3/dist/yeti/bootstrap.min.css',  # Clean
-'javascript_url': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js',
-}
+# Bootstrap assets: `manage.py vendor_assets` copies Bootstrap, this Bootswatch
+# theme and Bootstrap Icons into static/vendor/ (templates use the CDN until then).
+# Themes: cerulean, cosmo, darkly, flatly, journal, lux, materia, minty, pulse,
+# sandstone, united, yeti - or 'bootstrap' for the stock look.
+BOOTSWATCH_THEME = 'darkly'
 
 # Crispy Forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
@@ -173,3 +170,43 @@ INTERNAL_IPS = [
 
 # Taggit
 TAGGIT_CASE_INSENSITIVE = True
+
+# Polls
+POLLS_PAGE_CACHE_TIMEOUT = 300  # seconds an anonymous list/detail page is served from cache
+
+# Background jobs queued by `manage.py run_jobs` every so many seconds
+POLLS_JOB_SCHEDULE = {
+    'compact_vote_counters': 5 * 60,
+    'snapshot_tallies': 10 * 60,
+    'compute_recommendations': 15 * 60,
+}
+
+# Voting: votes bump one of VOTE_COUNTER_SHARDS counter rows per choice (0, the
+# default, skips that write). To read from the counters, set e.g. 8 and run
+# `manage.py compact_vote_counters --rebuild` before switching the backend.
+# VOTE_TALLY_BACKEND picks where results are read from: 'votes' counts vote
+# rows, 'shards' sums the counters, 'snapshot' adds the votes and removals since
+# the last `manage.py snapshot_tallies` to its counts, 'memory' keeps active
+# polls' counts in each worker (see polls.readmodel).
+# Snapshots leave the last VOTE_SNAPSHOT_GRACE seconds of votes to the delta, so
+# votes that commit late or come from a server with a skewed clock still count.
+VOTE_COUNTER_SHARDS = 0
+VOTE_TALLY_BACKEND = 'votes'
+VOTE_SNAPSHOT_GRACE = 60
+POLLS_TALLY_MEMORY = {
+    'MAX_LAG': 1.0,         # seconds a read may trail the vote event log
+    'REBUILD_EVERY': 300,   # seconds between full reloads
+    'GAP_GRACE': 10,        # seconds to wait for event ids committed out of order
+    'FALLBACK': 'votes',    # backend for polls it doesn't hold (closed, ballot polls)
+}
+
+# Hot polls: the TOP most requested polls with at least MIN_HITS recent requests
+# (halved every DECAY seconds) get their results recomputed once per INTERVAL
+# seconds instead of after every vote (see polls.hotpolls); MIN_HITS 0 disables
+POLLS_HOT_POLLS = {
+    'CAPACITY': 256,
+    'TOP': 10,
+    'MIN_HITS': 50,
+    'INTERVAL': 1.0,
+    'DECAY': 60,
+}
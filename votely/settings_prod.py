@@ -0,0 +1,52 @@
+"""
+Production settings for votely: the dev settings minus dev-only weight.
+
+    DJANGO_SETTINGS_MODULE=votely.settings_prod gunicorn votely.wsgi
+
+Drops apps that only serve development (the debug toolbar, shell_plus and
+friends, social login which no template uses) and component autodiscovery,
+which walks every app directory at startup; the component libraries listed
+in COMPONENTS are still imported. Check the effect with
+``manage.py startup_profile --settings votely.settings_prod``.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, COMPONENTS, DATABASES, INSTALLED_APPS, MIDDLEWARE, SECRET_KEY
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', SECRET_KEY)
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
+
+DEV_ONLY_APPS = {
+    'debug_toolbar',
+    'django_extensions',
+    'allauth.socialaccount',
+}
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEV_ONLY_APPS]
+MIDDLEWARE = [m for m in MIDDLEWARE if not m.startswith('debug_toolbar.')]
+
+COMPONENTS = {**COMPONENTS, 'autodiscover': False}
+
+# collectstatic writes fingerprinted, precompressed files; with no web server
+# in front, set POLLS_SERVE_STATIC so Django serves them (polls.assets.serve)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'polls.assets.CompressedManifestStaticFilesStorage'},
+}
+POLLS_SERVE_STATIC = os.environ.get('POLLS_SERVE_STATIC', '') == '1'
+
+# Keep connections open across requests instead of reconnecting every time
+DATABASES = {
+    alias: {**db, 'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True}
+    for alias, db in DATABASES.items()
+}
+
+# Each worker caches users' own votes; votes are broadcast between workers
+# on this host through a shared SQLite file (see polls.choicecache)
+POLLS_CHOICE_CACHE = {
+    'MAX_ENTRIES': int(os.environ.get('POLLS_CHOICE_CACHE_ENTRIES', 100_000)),
+    'BUS': 'polls.choicecache.SQLiteBus',
+    'OPTIONS': {'path': os.environ.get('POLLS_CHOICE_BUS', str(BASE_DIR / 'choice-bus.sqlite3'))},
+}
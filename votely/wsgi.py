@@ -9,3 +9,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'votely.settings')
 
 application = get_wsgi_application()
+
+# Load in-memory tallies before the first request (VOTE_TALLY_BACKEND = 'memory')
+from polls.readmodel import warm  # noqa: E402
+
+warm()